@@ -0,0 +1,135 @@
+'''
+runs the AI search off the pygame render loop.
+the search works on its own copy of the game (rebuilt from gamestate.snapshot) in a
+background thread, and its result comes back through a queue the main loop polls once
+per frame, so event handling and drawing never wait on it.
+
+  -- think(gs)              : start searching the position for the side to move
+  -- ponder(gs, predicted)  : while the human thinks, search the position after the
+                              predicted reply, a correct prediction turns into the real
+                              search (ponder hit) and is often already finished. a ponder
+                              search has no deadline, so it stops at ponderDepth
+  -- poll()                 : the finished searchresult, or None
+  -- cancel()               : drop whatever is running (undo, restart, back to menu)
+
+with an opening book the first moves come straight from the book without searching,
+with endgame tables (chess_tablebase.py) three piece endings are played perfectly.
+
+no pygame here, so the worker can be driven by any front end.
+'''
+
+import queue
+import threading
+import time
+
+import chess_book
+import chess_engine
+import chess_search
+import chess_tablebase
+
+
+class aijob:
+    '''
+    one search request. it doubles as the searcher's stop event: is_set() turns true once
+    the job is cancelled or its deadline passes. a ponder job has no deadline until the
+    ponder hit gives it one.
+    '''
+    def __init__(self, snapshot, ponder, deadline):
+        self.snapshot = snapshot
+        self.ponder = ponder
+        self.deadline = deadline
+        self.cancelled = False
+
+    def is_set(self):
+        return self.cancelled or (self.deadline is not None and time.perf_counter() >= self.deadline)
+
+
+class aiworker:
+    def __init__(self, thinkTime=1.0, maxDepth=None, ttSizeMB=16, bookPath=None, tablebasePath=None,
+                 ponderDepth=8):
+        self.thinkTime = thinkTime
+        self.maxDepth = maxDepth
+        self.ponderDepth = ponderDepth # a ponder search has no deadline, this bounds it instead
+        self.book = chess_book.openingbook(bookPath) if bookPath else None
+        tablebase = chess_tablebase.tablebase(tablebasePath) if tablebasePath else None
+        self.searcher = chess_search.searcher(chess_search.transpositiontable(ttSizeMB), tablebase)
+        self.results = queue.Queue()
+        self.job = None
+        self.thread = None
+        self.ponderResult = None # a ponder search that finished before the human moved
+
+    '''
+    is a move for the side to move on its way (a ponder search does not count)
+    '''
+    def busy(self):
+        return self.job is not None and not self.job.ponder
+
+    def think(self, gs):
+        snapshot = gs.snapshot()
+        job = self.job
+        if job is not None and job.ponder and job.snapshot == snapshot: # ponder hit
+            job.deadline = time.perf_counter() + self.thinkTime
+            job.ponder = False
+            if self.ponderResult is not None:
+                self.results.put((job, self.ponderResult))
+                self.ponderResult = None
+            return
+        self.cancel()
+        bookMove = self.book.pickMove(gs) if self.book is not None else None
+        if bookMove is not None:
+            self.job = aijob(snapshot, False, None)
+            self.results.put((self.job, chess_search.searchresult(bookMove, 0, 0, 0, [bookMove], 0.0)))
+            return
+        self.start(snapshot, ponder=False)
+
+    def ponder(self, gs, predictedMove):
+        self.cancel()
+        if predictedMove is None:
+            return
+        copy = chess_engine.gamestate.fromSnapshot(gs.snapshot())
+        copy.makeMove(chess_engine.move.fromMoveID(predictedMove.moveID, copy.board))
+        self.start(copy.snapshot(), ponder=True)
+
+    def start(self, snapshot, ponder):
+        deadline = None if ponder else time.perf_counter() + self.thinkTime
+        job = aijob(snapshot, ponder, deadline)
+        self.job = job
+        self.thread = threading.Thread(target=self.run, args=(job,), daemon=True)
+        self.thread.start()
+
+    def run(self, job):
+        gs = chess_engine.gamestate.fromSnapshot(job.snapshot)
+        maxDepth = self.maxDepth
+        if job.ponder:
+            maxDepth = self.ponderDepth if maxDepth is None else min(maxDepth, self.ponderDepth)
+        result = self.searcher.search(gs, maxDepth=maxDepth, stopEvent=job)
+        self.results.put((job, result))
+
+    '''
+    return the finished searchresult for the current think request, or None.
+    results of cancelled jobs are dropped, a finished ponder search is held until its hit.
+    '''
+    def poll(self):
+        while True:
+            try:
+                job, result = self.results.get_nowait()
+            except queue.Empty:
+                return None
+            if job is not self.job or job.cancelled:
+                continue
+            if job.ponder:
+                self.ponderResult = result
+                continue
+            self.job = None
+            return result
+
+    def cancel(self):
+        if self.job is not None:
+            self.job.cancelled = True
+        if self.thread is not None:
+            self.thread.join() # the searcher checks its stop event every few hundred nodes
+            self.thread = None
+        self.job = None
+        self.ponderResult = None
+        while not self.results.empty():
+            self.results.get_nowait()
@@ -0,0 +1,160 @@
+'''
+batched position analysis: a stream of FENs in, one result per position out, in input order.
+positions travel to the worker processes in chunks, every worker loads each FEN into one
+reused gamestate (gamestate.setFen) and keeps one searcher, so there is no per position
+process round trip or object setup. only a bounded number of chunks is in flight at a time,
+so a file of millions of positions is streamed through with flat memory.
+
+a result is a dict:
+    fen          the input line
+    legalMoves   number of legal moves
+    status       "ok", "check", "checkmate" or "stalemate"
+    bestMove, score, depth, nodes, pv    only when a search was asked for
+    error        instead of the above when the FEN cannot be read or the analysis fails
+
+  python chess_analysis.py puzzles.fen --depth 3 --workers 8 > results.jsonl
+  cat positions.fen | python chess_analysis.py - --nodes 20000
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import chess_engine
+import chess_search
+
+_worker = {} # per process gamestate and searcher, created on first use
+
+
+'''
+analyse the position in gs (already loaded) and return its result dict
+'''
+def analyzePosition(gs, searcher=None, maxDepth=None, nodeLimit=None, timeLimit=None):
+    legalMoves = gs.countLegalMoves()
+    if gs.inCheck():
+        status = "check" if legalMoves else "checkmate"
+    else:
+        status = "ok" if legalMoves else "stalemate"
+    result = {"legalMoves": legalMoves, "status": status}
+    if searcher is not None and legalMoves:
+        found = searcher.search(gs, maxDepth, timeLimit, nodeLimit)
+        result.update(bestMove=found.bestMove.getChessNotation(), score=found.score,
+                      depth=found.depth, nodes=found.nodes,
+                      pv=[m.getChessNotation() for m in found.pv])
+    return result
+
+
+'''
+runs in the worker process: analyse a chunk of FENs and return the list of results
+'''
+def analyzeChunk(fens, maxDepth=None, nodeLimit=None, timeLimit=None, ttSizeMB=16):
+    search = maxDepth is not None or nodeLimit is not None or timeLimit is not None
+    if "gs" not in _worker:
+        _worker["gs"] = chess_engine.gamestate()
+    if search and "searcher" not in _worker:
+        _worker["searcher"] = chess_search.searcher(chess_search.transpositiontable(ttSizeMB))
+    gs = _worker["gs"]
+    searcher = _worker.get("searcher") if search else None
+    results = []
+    for fen in fens:
+        try:
+            gs.setFen(fen)
+        except ValueError as e:
+            results.append({"fen": fen, "error": str(e)})
+            continue
+        result = {"fen": fen}
+        try:
+            result.update(analyzePosition(gs, searcher, maxDepth, nodeLimit, timeLimit))
+        except Exception as e: # one position the engine chokes on must not cost the whole batch
+            result = {"fen": fen, "error": "analysis failed: %s: %s" % (e.__class__.__name__, e)}
+            gs = _worker["gs"] = chess_engine.gamestate() # it may be left half way through a move
+        results.append(result)
+    return results
+
+
+def _chunks(fens, chunkSize):
+    chunk = []
+    for fen in fens:
+        fen = fen.strip()
+        if not fen or fen.startswith("#"):
+            continue
+        chunk.append(fen)
+        if len(chunk) == chunkSize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+'''
+analyse every FEN of the iterable fens (blank lines and # comments are skipped) and yield
+the result dicts in input order. search limits are optional, without them only the legal
+move count and the status are reported. workers=0 runs everything in this process.
+at most 2 * workers chunks of chunkSize positions are queued or held at any time.
+'''
+def analyzeBatch(fens, workers=None, chunkSize=256, maxDepth=None, nodeLimit=None, timeLimit=None,
+                 ttSizeMB=16):
+    chunks = _chunks(fens, chunkSize)
+    if workers == 0:
+        for chunk in chunks:
+            yield from analyzeChunk(chunk, maxDepth, nodeLimit, timeLimit, ttSizeMB)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {} # future -> chunk number
+        finished = {} # chunk number -> results that arrived ahead of an earlier chunk
+        submitted = emitted = 0
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) + len(finished) < 2 * workers:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                    break
+                future = pool.submit(analyzeChunk, chunk, maxDepth, nodeLimit, timeLimit, ttSizeMB)
+                pending[future] = submitted
+                submitted += 1
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                finished[pending.pop(future)] = future.result()
+            while emitted in finished:
+                yield from finished.pop(emitted)
+                emitted += 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="analyse a stream of FEN positions")
+    parser.add_argument("input", help="file with one FEN per line, - for stdin")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="0 runs in process")
+    parser.add_argument("--chunk", type=int, default=256, help="positions per worker task")
+    parser.add_argument("--depth", type=int, help="search each position to this depth")
+    parser.add_argument("--nodes", type=int, help="search each position for this many nodes")
+    parser.add_argument("--time", type=float, help="search each position for this many seconds")
+    parser.add_argument("--hash", type=int, default=16, help="transposition table MB per worker")
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    start = time.perf_counter()
+    count = 0
+    try:
+        for result in analyzeBatch(source, args.workers, args.chunk, args.depth, args.nodes,
+                                   args.time, args.hash):
+            sys.stdout.write(json.dumps(result) + "\n")
+            count += 1
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    seconds = time.perf_counter() - start
+    sys.stderr.write("%d positions in %.2fs, %.0f positions/s\n" % (
+        count, seconds, count / seconds if seconds > 0 else 0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,508 @@
+'''
+game archive: millions of games in one compact binary file, plus a position index.
+
+the archive is a header followed by blocks appended one after another:
+
+    header   "CHESSARC" | version (2 bytes)
+    block    "GBLK" | flags (1 byte, 1 = zlib) | games (2 bytes) | raw size (4) | stored size (4)
+             then the stored bytes: the game records of the block, zlib compressed or not
+    game     result (1 byte: 0 *, 1 1-0, 2 0-1, 3 1/2-1/2) | FEN length (1) | tags length (2) |
+             plies (2) | FEN (empty for the normal start) | tags ("name\\tvalue" lines, utf-8) |
+             the moves, 2 bytes each
+
+everything is big endian. a move is its moveID (start | end << 6 | flags << 12), which is
+below 2 ** 15, so a game costs 2 bytes a ply before compression. a game is addressed by its
+ref, the file offset of its block shifted left 16 bits, plus its number inside the block.
+the reader holds one block at a time, and a block cut short at the end of the file (a
+writer that died) is ignored.
+
+the index is a separate file of 18 byte entries sorted by position key:
+
+    header   "CHESSIDX" | entries (8 bytes)
+    entry    key (8 bytes) | game ref (8) | ply (2)
+
+the key is gamestate.zobristKey (the same keys as the opening book), ply is the first ply at
+which the game reached the position. the index is opened through mmap and binary searched, so
+"every game that reached this position" costs a few page reads however big the file is, and the
+ply gives the move played there without replaying the game.
+
+  python chess_archive.py build games.pgn games.arc --index games.idx
+  python chess_archive.py find games.arc games.idx --moves "e2e4 c7c5 g1f3"
+  python chess_archive.py stats games.arc
+'''
+
+import argparse
+import array
+import heapq
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import zlib
+
+import chess_engine
+import chess_pgn
+
+archiveMagic = b"CHESSARC"
+archiveVersion = 1
+headerFormat = struct.Struct(">8sH")
+blockFormat = struct.Struct(">4sBHII")
+blockMagic = b"GBLK"
+gameFormat = struct.Struct(">BBHH")
+results = ("*", "1-0", "0-1", "1/2-1/2")
+BLOCK_ZLIB = 1
+
+indexMagic = b"CHESSIDX"
+indexHeaderFormat = struct.Struct(">8sQ")
+entryFormat = struct.Struct(">QQH")
+entrySize = entryFormat.size
+
+
+def _packMoves(moveIDs):
+    moves = array.array("H", moveIDs)
+    if sys.byteorder == "little":
+        moves.byteswap()
+    return moves.tobytes()
+
+
+def _unpackMoves(data):
+    moves = array.array("H", data)
+    if sys.byteorder == "little":
+        moves.byteswap()
+    return moves
+
+
+'''
+coordinate notation (e2e4, e7e8q) of a moveID, without a board
+'''
+def moveIdNotation(moveID):
+    start, end, flags = moveID & 63, moveID >> 6 & 63, moveID >> 12
+    text = "%s%d%s%d" % ("abcdefgh"[start & 7], 8 - (start >> 3), "abcdefgh"[end & 7], 8 - (end >> 3))
+    return text + chess_engine.promotionPieces[flags - 4].lower() if flags >= 4 else text
+
+
+class archivedgame:
+    def __init__(self, ref, fen, moves, result, tags):
+        self.ref = ref
+        self.fen = fen
+        self.moves = moves # array of moveIDs
+        self.result = result # "1-0", "0-1", "1/2-1/2" or "*"
+        self.tags = tags # dict of PGN tag pairs
+
+    '''
+    yield (gamestate, move) for every move, with gs positioned before the move is made.
+    pass gs to reuse one gamestate for many games, it is reset to the starting position
+    '''
+    def replay(self, gs=None):
+        if gs is None:
+            gs = chess_engine.gamestate.from_fen(self.fen)
+        else:
+            gs.setFen(self.fen)
+        for moveID in self.moves:
+            m = chess_engine.move.fromMoveID(moveID, gs.board)
+            yield gs, m
+            gs.makeMove(m)
+
+    def snapshot(self):
+        return {"fen": self.fen, "moves": self.moves.tolist()}
+
+    def toPgn(self):
+        sanMoves = []
+        gs = chess_engine.gamestate.from_fen(self.fen)
+        for gs, m in self.replay(gs):
+            sanMoves.append(chess_pgn.toSan(gs, m))
+        headers = dict(self.tags, Result=self.result)
+        if self.fen != chess_engine.startFen:
+            headers.update(SetUp="1", FEN=self.fen)
+        return chess_pgn.formatGame(headers, sanMoves, self.result)
+
+
+class archivewriter:
+    '''
+    appends games to an archive, creating it if needed. games are collected until a block
+    of blockGames is full, so call close() (or use with) to write the last one. a block cut
+    short at the end of an existing archive is cut off before anything is appended.
+    '''
+    def __init__(self, path, blockGames=256, compress=True):
+        if not 0 < blockGames < 65536:
+            raise ValueError("blockGames must be between 1 and 65535")
+        self.blockGames = blockGames
+        self.compress = compress
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self.file = open(path, "r+b")
+            _readHeader(self.file)
+            self.offset = headerFormat.size
+            for offset, _, _, _, storedSize in _scanBlocks(self.file):
+                self.offset = offset + blockFormat.size + storedSize
+            self.file.truncate(self.offset)
+            self.file.seek(self.offset)
+        else:
+            self.file = open(path, "wb")
+            self.file.write(headerFormat.pack(archiveMagic, archiveVersion))
+            self.offset = headerFormat.size
+        self.pending = []
+        self.games = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    '''
+    add one game given by its moveIDs, returns its ref
+    '''
+    def add(self, moveIDs, result="*", fen=None, tags=None):
+        fenBytes = b"" if fen is None or fen == chess_engine.startFen else fen.encode("ascii")
+        tagBytes = "\n".join("%s\t%s" % item for item in (tags or {}).items()).encode("utf-8")
+        moves = _packMoves(moveIDs)
+        if len(fenBytes) > 255 or len(tagBytes) > 65535 or len(moves) > 2 * 65535:
+            raise ValueError("game too large for the archive format")
+        self.pending.append(gameFormat.pack(results.index(result), len(fenBytes), len(tagBytes),
+                                            len(moves) // 2) + fenBytes + tagBytes + moves)
+        ref = self.offset << 16 | len(self.pending) - 1
+        self.games += 1
+        if len(self.pending) >= self.blockGames:
+            self.flush()
+        return ref
+
+    def addGamestate(self, gs, result="*", tags=None):
+        snapshot = gs.snapshot()
+        return self.add(snapshot["moves"], result, snapshot["fen"], tags)
+
+    '''
+    add a chess_pgn.pgngame, only the moves the engine can replay are kept
+    '''
+    def addPgnGame(self, game):
+        moveIDs = [m.moveID for _, m in game.replay(chess_engine.gamestate())]
+        tags = {name: value for name, value in game.headers.items() if name != "Result"}
+        return self.add(moveIDs, game.result, None, tags)
+
+    def flush(self):
+        if not self.pending:
+            return
+        raw = b"".join(self.pending)
+        stored = zlib.compress(raw, 6) if self.compress else raw
+        flags = BLOCK_ZLIB if self.compress else 0
+        self.file.write(blockFormat.pack(blockMagic, flags, len(self.pending), len(raw), len(stored)))
+        self.file.write(stored)
+        self.file.flush()
+        self.offset += blockFormat.size + len(stored)
+        self.pending = []
+
+
+def _readHeader(f):
+    header = f.read(headerFormat.size)
+    if len(header) < headerFormat.size:
+        raise ValueError("not a game archive: file too short")
+    magic, version = headerFormat.unpack(header)
+    if magic != archiveMagic:
+        raise ValueError("not a game archive")
+    if version != archiveVersion:
+        raise ValueError("unsupported archive version %d" % version)
+
+
+'''
+yield (offset, flags, games, raw size, stored size) of every complete block from the block
+headers alone, stopping at a block cut short by the end of the file
+'''
+def _scanBlocks(f):
+    size = os.fstat(f.fileno()).st_size
+    offset = headerFormat.size
+    while offset + blockFormat.size <= size:
+        f.seek(offset)
+        magic, flags, count, rawSize, storedSize = blockFormat.unpack(f.read(blockFormat.size))
+        if magic != blockMagic:
+            raise ValueError("corrupt archive: no block at offset %d" % offset)
+        end = offset + blockFormat.size + storedSize
+        if end > size:
+            return
+        yield offset, flags, count, rawSize, storedSize
+        offset = end
+
+
+class archivereader:
+    '''
+    streams the games of an archive: iterating reads and decodes one block at a time, so the
+    file is never held in memory. gameAt(ref) jumps straight to one game.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        _readHeader(self.file)
+        self.cached = (None, None) # (block offset, its games) of the last block gameAt decoded
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        for offset, games in self.blocks():
+            yield from games
+
+    '''
+    yield (block offset, list of archivedgame) for every complete block in file order
+    '''
+    def blocks(self):
+        offset = headerFormat.size
+        while True:
+            games = self.readBlock(offset)
+            if games is None:
+                return
+            yield offset, games
+            offset = self.file.tell()
+
+    '''
+    the games of the block at offset, None past the end or for a block cut short
+    '''
+    def readBlock(self, offset):
+        self.file.seek(offset)
+        header = self.file.read(blockFormat.size)
+        if len(header) < blockFormat.size:
+            return None
+        magic, flags, count, rawSize, storedSize = blockFormat.unpack(header)
+        if magic != blockMagic:
+            raise ValueError("corrupt archive: no block at offset %d" % offset)
+        stored = self.file.read(storedSize)
+        if len(stored) < storedSize:
+            return None
+        try:
+            raw = zlib.decompress(stored) if flags & BLOCK_ZLIB else stored
+        except zlib.error as e:
+            raise ValueError("corrupt archive: block at offset %d does not decompress: %s" % (offset, e))
+        if len(raw) != rawSize:
+            raise ValueError("corrupt archive: block at offset %d holds %d bytes, expected %d" % (
+                offset, len(raw), rawSize))
+        try:
+            return self.parseBlock(offset, count, raw)
+        except (struct.error, UnicodeDecodeError, IndexError) as e:
+            raise ValueError("corrupt archive: bad game record in block at offset %d: %s" % (offset, e))
+
+    def parseBlock(self, offset, count, raw):
+        games = []
+        position = 0
+        for index in range(count):
+            result, fenLength, tagLength, plies = gameFormat.unpack_from(raw, position)
+            position += gameFormat.size
+            fen = raw[position:position + fenLength].decode("ascii") or chess_engine.startFen
+            position += fenLength
+            tagText = raw[position:position + tagLength].decode("utf-8")
+            position += tagLength
+            tags = dict(line.split("\t", 1) for line in tagText.split("\n")) if tagText else {}
+            moves = _unpackMoves(raw[position:position + 2 * plies])
+            position += 2 * plies
+            games.append(archivedgame(offset << 16 | index, fen, moves, results[result], tags))
+        if position != len(raw):
+            raise ValueError("corrupt archive: game records of block at offset %d do not fill it" % offset)
+        return games
+
+    def gameAt(self, ref):
+        offset, index = ref >> 16, ref & 0xFFFF
+        if self.cached[0] != offset:
+            games = self.readBlock(offset)
+            if games is None:
+                raise ValueError("no block at offset %d" % offset)
+            self.cached = (offset, games)
+        return self.cached[1][index]
+
+
+def _runEntries(f):
+    while True:
+        data = f.read(entrySize * 4096)
+        if not data:
+            return
+        yield from entryFormat.iter_unpack(data)
+
+
+'''
+index every position of the archive at archivePath into indexPath, only the first maxPly
+plies of each game when maxPly is given. entries are sorted in runs of runEntries and the
+runs merged, so memory stays bounded however many games there are. returns the entry count.
+'''
+def buildIndex(archivePath, indexPath, maxPly=None, runEntries=1 << 21):
+    runs = []
+    entries = []
+
+    def spill():
+        entries.sort()
+        run = tempfile.TemporaryFile()
+        run.write(b"".join(entryFormat.pack(*entry) for entry in entries))
+        run.seek(0)
+        runs.append(run)
+        entries.clear()
+
+    gs = chess_engine.gamestate()
+    with archivereader(archivePath) as reader:
+        for game in reader:
+            seen = set()
+            ply = 0
+            for ply, (gs, m) in enumerate(game.replay(gs)):
+                if maxPly is not None and ply >= maxPly:
+                    break
+                if gs.zobristKey not in seen:
+                    seen.add(gs.zobristKey)
+                    entries.append((gs.zobristKey, game.ref, ply))
+            else:
+                ply = len(game.moves) # the position after the last move
+                if (maxPly is None or ply < maxPly) and gs.zobristKey not in seen:
+                    entries.append((gs.zobristKey, game.ref, ply))
+            if len(entries) >= runEntries:
+                spill()
+    if entries or not runs:
+        spill()
+
+    count = 0
+    with open(indexPath, "wb") as out:
+        out.write(indexHeaderFormat.pack(indexMagic, 0))
+        buffer = []
+        for entry in heapq.merge(*(_runEntries(run) for run in runs)):
+            buffer.append(entryFormat.pack(*entry))
+            if len(buffer) >= 4096:
+                out.write(b"".join(buffer))
+                buffer = []
+            count += 1
+        out.write(b"".join(buffer))
+        out.seek(0)
+        out.write(indexHeaderFormat.pack(indexMagic, count))
+    for run in runs:
+        run.close()
+    return count
+
+
+class archiveindex:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        magic, self.count = indexHeaderFormat.unpack(self.file.read(indexHeaderFormat.size))
+        if magic != indexMagic:
+            raise ValueError("not a position index")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.count else None
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def keyAt(self, i):
+        return struct.unpack_from(">Q", self.map, indexHeaderFormat.size + i * entrySize)[0]
+
+    '''
+    (game ref, ply) of every game that reached the position with this key, found by binary search
+    '''
+    def lookup(self, key):
+        if self.map is None:
+            return []
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.keyAt(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        hits = []
+        while lo < self.count:
+            entryKey, ref, ply = entryFormat.unpack_from(self.map, indexHeaderFormat.size + lo * entrySize)
+            if entryKey != key:
+                break
+            hits.append((ref, ply))
+            lo += 1
+        return hits
+
+
+'''
+what was played from a position: {moveID or None (the game ended there): [games, white wins,
+draws, black wins]} over the (ref, ply) hits of an index lookup
+'''
+def continuations(reader, hits):
+    stats = {}
+    for ref, ply in hits:
+        game = reader.gameAt(ref)
+        moveID = game.moves[ply] if ply < len(game.moves) else None
+        entry = stats.setdefault(moveID, [0, 0, 0, 0])
+        entry[0] += 1
+        if game.result in ("1-0", "1/2-1/2", "0-1"):
+            entry[("1-0", "1/2-1/2", "0-1").index(game.result) + 1] += 1
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="build, index and query game archives")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="append the games of PGN files to an archive")
+    build.add_argument("pgn", nargs="+")
+    build.add_argument("archive")
+    build.add_argument("--block", type=int, default=256, help="games per block")
+    build.add_argument("--no-compress", action="store_true")
+    build.add_argument("--index", help="also write the position index to this file")
+    build.add_argument("--max-ply", type=int, help="index only the first plies of each game")
+    index = commands.add_parser("index", help="build the position index of an archive")
+    index.add_argument("archive")
+    index.add_argument("index")
+    index.add_argument("--max-ply", type=int)
+    find = commands.add_parser("find", help="games that reached a position and what was played next")
+    find.add_argument("archive")
+    find.add_argument("index")
+    find.add_argument("--fen", default=chess_engine.startFen)
+    find.add_argument("--moves", default="", help="moves from the FEN in coordinate notation")
+    find.add_argument("--list", type=int, default=0, help="also print the refs of this many games")
+    stats = commands.add_parser("stats", help="count the games and plies of an archive")
+    stats.add_argument("archive")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        with archivewriter(args.archive, args.block, not args.no_compress) as writer:
+            for path in args.pgn:
+                with open(path, encoding="utf-8", errors="replace") as f:
+                    for game in chess_pgn.readGames(f):
+                        writer.addPgnGame(game)
+        print("added %d games to %s" % (writer.games, args.archive))
+        if args.index:
+            print("indexed %d positions" % buildIndex(args.archive, args.index, args.max_ply))
+    elif args.command == "index":
+        print("indexed %d positions" % buildIndex(args.archive, args.index, args.max_ply))
+    elif args.command == "find":
+        gs = chess_engine.gamestate.from_fen(args.fen)
+        for text in args.moves.split():
+            m = next((m for m in gs.getValidMoves() if m.getChessNotation() == text), None)
+            if m is None:
+                parser.error("illegal move %s" % text)
+            gs.makeMove(m)
+        with archiveindex(args.index) as positions, archivereader(args.archive) as reader:
+            hits = positions.lookup(gs.zobristKey)
+            print("%d games" % len(hits))
+            ranked = sorted(continuations(reader, hits).items(), key=lambda item: -item[1][0])
+            for moveID, (games, white, draws, black) in ranked:
+                print("%-6s %7d  +%d =%d -%d" % (moveIdNotation(moveID) if moveID is not None else "end",
+                                                games, white, draws, black))
+            for ref, ply in hits[:args.list]:
+                print("game %d ply %d" % (ref, ply))
+    else:
+        games = plies = 0
+        with archivereader(args.archive) as reader:
+            for game in reader:
+                games += 1
+                plies += len(game.moves)
+        size = os.path.getsize(args.archive)
+        print("%d games, %d plies, %d bytes (%.1f bytes per game, %.2f per ply)" % (
+            games, plies, size, size / max(1, games), size / max(1, plies)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+'''
+numpy batch representation of many positions, for dataset generation and evaluation tuning.
+
+a batch is an N x 64 int8 array of piece codes (0 empty, 1..12 in pieceOrder, square index
+row * 8 + col like the rest of the engine, so a8 is 0) plus an N bool side to move array.
+at 65 bytes per position a million positions fit in 65 MB, against a gamestate per position.
+every operation below works on the whole batch at once:
+
+  -- planes()      N x 12 x 8 x 8 uint8 one-hot planes (network input)
+  -- evaluate()    tapered material + piece-square score, equal to gamestate.evaluate()
+  -- bitboards()   N x 12 uint64 piece bitboards
+  -- attackMaps()  N x 2 x 8 x 8 number of white / black pieces attacking each square
+  -- features()    N x len(featureNames) float32 summary features
+
+numpy is needed by this module only, the game and the engine run without it.
+
+  python chess_batch.py positions.fen --out positions.npz
+'''
+
+import argparse
+import re
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError: # only this module needs numpy
+    raise ImportError("chess_batch needs numpy: pip install numpy")
+
+import chess_engine
+
+pieceOrder = chess_engine.pieceNames['w'] + chess_engine.pieceNames['b']
+pieceCodes = {name: code for code, name in enumerate(pieceOrder, 1)}
+pieceCodes["--"] = 0
+# FEN letter -> piece code, anything unknown maps to 255 and is rejected
+fenCodes = np.full(256, 255, dtype=np.uint8)
+fenCodes[ord('.')] = 0
+for _letter, _name in chess_engine.fenPieces.items():
+    fenCodes[ord(_letter)] = pieceCodes[_name]
+_emptyRuns = re.compile("[1-8]")
+
+featureNames = ("sideToMove", "phase", "whiteMaterial", "blackMaterial",
+                "whitePawns", "whiteKnights", "whiteBishops", "whiteRooks", "whiteQueens",
+                "blackPawns", "blackKnights", "blackBishops", "blackRooks", "blackQueens",
+                "whiteAttacked", "blackAttacked", "whiteKingRingAttacked", "blackKingRingAttacked",
+                "whiteInCheck", "blackInCheck")
+
+
+'''
+(mg, eg, phase) lookup tables indexed [piece code, square], from the engine's own tables,
+the tuner can pass modified copies of mg / eg to evaluate
+'''
+def evalTables():
+    mg = np.zeros((13, 64), dtype=np.int64)
+    eg = np.zeros((13, 64), dtype=np.int64)
+    phase = np.zeros(13, dtype=np.int64)
+    for name, code in pieceCodes.items():
+        mg[code] = np.array(chess_engine.evalMg[name]).ravel()
+        eg[code] = np.array(chess_engine.evalEg[name]).ravel()
+        phase[code] = chess_engine.piecePhase[name]
+    return mg, eg, phase
+
+
+_mg, _eg, _phase = evalTables()
+_material = np.array([0] + [chess_engine.materialMg[name[1]] for name in pieceOrder], dtype=np.int64)
+
+
+_files = [np.uint64(0x0101010101010101 << c) for c in range(8)]
+
+
+'''
+squares a move dc columns sideways can land on without wrapping round the board edge
+'''
+def _wrapMask(dc):
+    mask = np.uint64(0xFFFFFFFFFFFFFFFF)
+    for c in (range(dc) if dc > 0 else range(8 + dc, 8)):
+        mask &= ~_files[c]
+    return mask
+
+
+'''
+uint64 bitboards (bit row * 8 + col) moved dr rows and dc columns, bits leaving the board dropped
+'''
+def _shift(bitboards, dr, dc):
+    amount = 8 * dr + dc
+    shifted = bitboards << np.uint64(amount) if amount > 0 else bitboards >> np.uint64(-amount)
+    return shifted & _wrapMask(dc) if dc else shifted
+
+
+'''
+squares attacked in direction dr , dc by the sliders, for every position at once, by a
+doubling (Kogge-Stone) fill through the empty squares. a square is reached by at most one
+slider per direction, the nearest one
+'''
+def _slide(sliders, empty, dr, dc):
+    amount = 8 * dr + dc
+    through = empty & _wrapMask(dc)
+    for step in (amount, 2 * amount, 4 * amount):
+        shift = np.uint64(abs(step))
+        sliders = sliders | (through & (sliders << shift if step > 0 else sliders >> shift))
+        through = through & (through << shift if step > 0 else through >> shift)
+    return _shift(sliders, dr, dc)
+
+
+'''
+(...) uint64 -> (..., 64) uint8 with a 1 for every set bit
+'''
+def _squares(bitboards):
+    bytesView = np.ascontiguousarray(bitboards, dtype="<u8").view(np.uint8).reshape(bitboards.shape + (8,))
+    return np.unpackbits(bytesView, axis=-1, bitorder="little")
+
+
+'''
+(N, 64) uint8: for every square, how many of the N x K sets hold it. done in chunks so the
+unpacked bits stay small
+'''
+def _countSquares(sets, chunkSize=32768):
+    counts = np.empty((len(sets), 64), dtype=np.uint8)
+    for start in range(0, len(sets), chunkSize):
+        counts[start:start + chunkSize] = _squares(sets[start:start + chunkSize]).sum(axis=1, dtype=np.uint8)
+    return counts
+
+
+def _popcount(bitboards):
+    if hasattr(np, "bitwise_count"): # numpy 2
+        return np.bitwise_count(bitboards).astype(np.int64)
+    return _squares(bitboards).sum(axis=-1, dtype=np.int64)
+
+
+'''
+(N, 2, 19) uint64 attack sets per side: 2 pawn diagonals, 8 knight jumps, the king and 8 slider
+directions. no square is attacked twice within one set, so the number of sets holding a square
+is the number of pieces attacking it
+'''
+def _attackSets(pieces):
+    empty = ~np.bitwise_or.reduce(pieces, axis=1)
+    sides = []
+    for side, pawnRow in ((0, -1), (1, 1)):
+        pawn, knight, bishop, rook, queen, king = (pieces[:, side * 6 + i] for i in range(6))
+        sets = [_shift(pawn, pawnRow, -1), _shift(pawn, pawnRow, 1)]
+        sets += [_shift(knight, dr, dc) for dr, dc in chess_engine.knightDirections]
+        kingSet = np.zeros_like(king)
+        for dr, dc in chess_engine.queenDirections:
+            kingSet |= _shift(king, dr, dc)
+        sets.append(kingSet)
+        sets += [_slide(rook | queen, empty, dr, dc) for dr, dc in chess_engine.rookDirections]
+        sets += [_slide(bishop | queen, empty, dr, dc) for dr, dc in chess_engine.bishopDirections]
+        sides.append(np.stack(sets, axis=1))
+    return np.stack(sides, axis=1)
+
+
+class positionbatch:
+    def __init__(self, squares, whiteToMove):
+        self.squares = np.ascontiguousarray(squares, dtype=np.int8).reshape(-1, 64)
+        self.whiteToMove = np.asarray(whiteToMove, dtype=bool).reshape(-1)
+        if len(self.squares) != len(self.whiteToMove):
+            raise ValueError("squares and whiteToMove differ in length")
+
+    def __len__(self):
+        return len(self.squares)
+
+    def __getitem__(self, index):
+        return positionbatch(self.squares[index], self.whiteToMove[index])
+
+    @classmethod
+    def fromGamestates(cls, states):
+        states = list(states)
+        return cls.fromBoards([gs.board for gs in states], [gs.whiteToMove for gs in states])
+
+    @classmethod
+    def fromBoards(cls, boards, whiteToMove):
+        squares = np.array([[pieceCodes[piece] for row in board for piece in row] for board in boards],
+                           dtype=np.int8).reshape(-1, 64)
+        return cls(squares, whiteToMove)
+
+    '''
+    only the placement and side to move fields are read, so rights and clocks are not
+    validated here (gamestate.setFen does that)
+    '''
+    @classmethod
+    def fromFens(cls, fens):
+        fens = list(fens)
+        placement = bytearray()
+        whiteToMove = np.empty(len(fens), dtype=bool)
+        for i, fen in enumerate(fens):
+            fields = fen.split()
+            if len(fields) < 2 or fields[1] not in ("w", "b"):
+                raise ValueError("bad FEN %r" % fen)
+            board = _emptyRuns.sub(lambda run: "." * int(run.group()), fields[0]).replace("/", "")
+            if len(board) != 64:
+                raise ValueError("bad FEN %r: placement is not 64 squares" % fen)
+            placement += board.encode("ascii", "replace")
+            whiteToMove[i] = fields[1] == "w"
+        squares = fenCodes[np.frombuffer(bytes(placement), dtype=np.uint8)]
+        if (squares == 255).any():
+            bad = int(np.flatnonzero((squares == 255).reshape(-1, 64).any(axis=1))[0])
+            raise ValueError("bad FEN %r: unknown piece letter" % fens[bad])
+        return cls(squares.astype(np.int8).reshape(-1, 64), whiteToMove)
+
+    def toBoards(self):
+        return [[[pieceOrder[code - 1] if code else "--" for code in row[r * 8:r * 8 + 8]] for r in range(8)]
+                for row in self.squares.tolist()]
+
+    def planes(self):
+        return (self.squares[:, None, :] == np.arange(1, 13, dtype=np.int8)[None, :, None]) \
+            .astype(np.uint8).reshape(-1, 12, 8, 8)
+
+    '''
+    N x 13 counts of every piece code (column 0 counts the empty squares)
+    '''
+    def pieceCounts(self):
+        offsets = np.arange(len(self), dtype=np.int64)[:, None] * 13
+        return np.bincount((self.squares.astype(np.int64) + offsets).ravel(),
+                           minlength=13 * len(self)).reshape(-1, 13)
+
+    '''
+    gamestate.evaluate() for every position: the tapered material + piece-square score from
+    the side to move's point of view. mg / eg default to the engine's tables (see evalTables)
+    '''
+    def evaluate(self, mg=None, eg=None):
+        mg = _mg if mg is None else mg
+        eg = _eg if eg is None else eg
+        codes = self.squares.astype(np.intp)
+        squareIndex = np.arange(64)
+        mgScore = mg[codes, squareIndex].sum(axis=1)
+        egScore = eg[codes, squareIndex].sum(axis=1)
+        phase = np.minimum(_phase[codes].sum(axis=1), chess_engine.totalPhase)
+        score = (mgScore * phase + egScore * (chess_engine.totalPhase - phase)) // chess_engine.totalPhase
+        return np.where(self.whiteToMove, score, -score)
+
+    '''
+    N x 12 uint64 piece bitboards in pieceOrder (bit row * 8 + col)
+    '''
+    def bitboards(self):
+        planes = self.squares[:, None, :] == np.arange(1, 13, dtype=np.int8)[None, :, None]
+        return np.packbits(planes, axis=-1, bitorder="little").view("<u8")[..., 0].astype(np.uint64)
+
+    '''
+    N x 2 x 8 x 8 uint8: how many white (index 0) and black (index 1) pieces attack each square.
+    the attack sets are built on bitboards for the whole batch, sliders by a fill through
+    the empty squares, so the cost does not depend on how many pieces are on the board
+    '''
+    def attackMaps(self):
+        sets = _attackSets(self.bitboards())
+        attacks = np.empty((len(self), 2, 64), dtype=np.uint8)
+        for side in (0, 1):
+            attacks[:, side] = _countSquares(sets[:, side])
+        return attacks.reshape(-1, 2, 8, 8)
+
+    def features(self):
+        counts = self.pieceCounts()
+        pieces = self.bitboards()
+        attacked = np.bitwise_or.reduce(_attackSets(pieces), axis=2) # N x 2 squares each side attacks
+        material = counts * _material
+        kings = pieces[:, [5, 11]]
+        kingRing = np.zeros_like(kings)
+        for dr, dc in chess_engine.queenDirections:
+            kingRing |= _shift(kings, dr, dc)
+        columns = [self.whiteToMove, np.minimum(_phase[self.squares.astype(np.intp)].sum(axis=1), chess_engine.totalPhase),
+                   material[:, 1:6].sum(axis=1), material[:, 7:12].sum(axis=1)]
+        columns += [counts[:, code] for code in range(1, 6)] + [counts[:, code] for code in range(7, 12)]
+        columns += [_popcount(attacked[:, 0]), _popcount(attacked[:, 1]),
+                    _popcount(attacked[:, 1] & kingRing[:, 0]), _popcount(attacked[:, 0] & kingRing[:, 1]),
+                    (attacked[:, 1] & kings[:, 0]) != 0, (attacked[:, 0] & kings[:, 1]) != 0]
+        return np.stack(columns, axis=1).astype(np.float32)
+
+    def save(self, path, **arrays):
+        np.savez_compressed(path, squares=self.squares, whiteToMove=self.whiteToMove, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["squares"], data["whiteToMove"])
+
+
+'''
+read FENs in chunks of chunkSize so a huge file never needs all its text in memory at once
+'''
+def readFens(lines, chunkSize=100000):
+    chunk = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            chunk.append(line)
+            if len(chunk) == chunkSize:
+                yield positionbatch.fromFens(chunk)
+                chunk = []
+    if chunk:
+        yield positionbatch.fromFens(chunk)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="convert FEN positions into a numpy batch with evaluations and features")
+    parser.add_argument("input", help="file with one FEN per line, - for stdin")
+    parser.add_argument("--out", required=True, help="write squares, whiteToMove, eval and features to this .npz")
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    start = time.perf_counter()
+    try:
+        batches = list(readFens(source))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    if not batches:
+        parser.error("no positions in %s" % args.input)
+    batch = positionbatch(np.concatenate([b.squares for b in batches]),
+                          np.concatenate([b.whiteToMove for b in batches]))
+    batch.save(args.out, eval=batch.evaluate(), features=batch.features(),
+               featureNames=np.array(featureNames))
+    seconds = time.perf_counter() - start
+    sys.stderr.write("%d positions in %.2fs, %.0f positions/s\n" % (len(batch), seconds, len(batch) / seconds))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
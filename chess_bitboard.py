@@ -0,0 +1,533 @@
+'''
+bitboard backed engine core.
+it shares the move-generation and make / undo surface of chess_engine.gamestate (setBoard,
+makeMove, undoMove, getValidMoves, getAllPossibleMoves, inCheck, squareUnderAttack, board,
+moveLog, checkMate / staleMate), enough for perft and for drawing the board, but it is not a
+drop-in gamestate: there is no zobristKey, evaluate, drawReason, iterMoves, snapshot or to_fen,
+so the search, the AI and the file formats keep using gamestate. internally every piece type
+of every color is a 64 bit integer.
+
+  -- square index is row * 8 + col, so bit 0 is a8 and bit 63 is h1 (same orientation as board)
+  -- knight, king and pawn attacks come from precomputed tables
+  -- sliding attacks are looked up by (square, relevant occupancy), the same indexing that
+     magic bitboards use, with a dict per square standing in for the magic multiply
+  -- the 2d string board is kept as a derived view so chess_main can still draw it
+  -- moves are the 16 bit moveID codes of chess_engine.move (flags included), the state a
+     move destroys is kept on a stack of small tuples like gamestate does
+'''
+
+from chess_engine import (CASTLE_ALL, CASTLE_BK, CASTLE_BQ, CASTLE_WK, CASTLE_WQ, MOVE_CASTLE,
+                          MOVE_ENPASSANT, castleMasks, enPassantPossible, move)
+
+WHITE, BLACK = 0, 1
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+
+pieceTypes = {'p': PAWN, 'N': KNIGHT, 'B': BISHOP, 'R': ROOK, 'Q': QUEEN, 'K': KING}
+pieceNames = [['wp', 'wN', 'wB', 'wR', 'wQ', 'wK'],
+              ['bp', 'bN', 'bB', 'bR', 'bQ', 'bK']]
+
+FULL = 0xFFFFFFFFFFFFFFFF
+
+rookDirections = ((-1, 0), (0, -1), (1, 0), (0, 1))
+bishopDirections = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+knightOffsets = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+kingOffsets = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+
+def _onBoard(r, c):
+    return 0 <= r < 8 and 0 <= c < 8
+
+
+def _leaperTable(offsets):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        bb = 0
+        for dr, dc in offsets:
+            if _onBoard(r + dr, c + dc):
+                bb |= 1 << ((r + dr) * 8 + c + dc)
+        table.append(bb)
+    return table
+
+
+def _slide(sq, occ, directions):
+    '''
+    walk every ray from sq, stopping on (and including) the first occupied square
+    '''
+    r, c = divmod(sq, 8)
+    attacks = 0
+    for dr, dc in directions:
+        endRow, endCol = r + dr, c + dc
+        while _onBoard(endRow, endCol):
+            bit = 1 << (endRow * 8 + endCol)
+            attacks |= bit
+            if occ & bit:
+                break
+            endRow += dr
+            endCol += dc
+    return attacks
+
+
+def _relevantMask(sq, directions):
+    '''
+    squares whose occupancy can change the attack set, the last square of every ray never can
+    '''
+    r, c = divmod(sq, 8)
+    mask = 0
+    for dr, dc in directions:
+        endRow, endCol = r + dr, c + dc
+        while _onBoard(endRow + dr, endCol + dc):
+            mask |= 1 << (endRow * 8 + endCol)
+            endRow += dr
+            endCol += dc
+    return mask
+
+
+knightAttacks = _leaperTable(knightOffsets)
+kingAttacks = _leaperTable(kingOffsets)
+# pawnAttacks[color][sq] -> squares attacked by a pawn of that color standing on sq
+pawnAttacks = [_leaperTable(((-1, -1), (-1, 1))), _leaperTable(((1, -1), (1, 1)))]
+
+rookMasks = [_relevantMask(sq, rookDirections) for sq in range(64)]
+bishopMasks = [_relevantMask(sq, bishopDirections) for sq in range(64)]
+# filled lazily, each distinct (square, relevant occupancy) is computed once per process
+rookTables = [{} for _ in range(64)]
+bishopTables = [{} for _ in range(64)]
+
+
+def rookAttacks(sq, occ):
+    key = occ & rookMasks[sq]
+    table = rookTables[sq]
+    attacks = table.get(key)
+    if attacks is None:
+        attacks = table[key] = _slide(sq, key, rookDirections)
+    return attacks
+
+
+def bishopAttacks(sq, occ):
+    key = occ & bishopMasks[sq]
+    table = bishopTables[sq]
+    attacks = table.get(key)
+    if attacks is None:
+        attacks = table[key] = _slide(sq, key, bishopDirections)
+    return attacks
+
+
+def _lineTables():
+    '''
+    between[a][b] -> squares strictly between two aligned squares
+    line[a][b]    -> the full line through two aligned squares (0 if not aligned)
+    '''
+    between = [[0] * 64 for _ in range(64)]
+    line = [[0] * 64 for _ in range(64)]
+    for a in range(64):
+        r, c = divmod(a, 8)
+        for dr, dc in rookDirections + bishopDirections:
+            ray = 0
+            endRow, endCol = r + dr, c + dc
+            while _onBoard(endRow, endCol):
+                b = endRow * 8 + endCol
+                between[a][b] = ray
+                ray |= 1 << b
+                endRow += dr
+                endCol += dc
+            full = ray | (1 << a)
+            endRow, endCol = r - dr, c - dc
+            while _onBoard(endRow, endCol):
+                full |= 1 << (endRow * 8 + endCol)
+                endRow -= dr
+                endCol -= dc
+            endRow, endCol = r + dr, c + dc
+            while _onBoard(endRow, endCol):
+                line[a][endRow * 8 + endCol] = full
+                endRow += dr
+                endCol += dc
+    return between, line
+
+
+betweenSquares, lineThrough = _lineTables()
+
+castleMaskSq = [castleMasks[sq >> 3][sq & 7] for sq in range(64)]
+# (right, king start, king end, rook start, rook end, squares that must be empty,
+#  squares the king crosses that must not be attacked)
+castlings = [
+    [(CASTLE_WK, 60, 62, 63, 61, 0x6 << 60, (61, 62)),
+     (CASTLE_WQ, 60, 58, 56, 59, 0xE << 56, (59, 58))],
+    [(CASTLE_BK, 4, 6, 7, 5, 0x60, (5, 6)),
+     (CASTLE_BQ, 4, 2, 0, 3, 0xE, (3, 2))],
+]
+castleRookMoves = {62: (63, 61), 58: (56, 59), 6: (7, 5), 2: (0, 3)}
+promotionCodes = tuple((4 + i) << 12 for i in (3, 2, 1, 0)) # queen first, as gamestate
+
+
+class bitboardstate:
+    def __init__(self):
+        self.board = [
+            ["bR","bN","bB","bQ","bK","bB","bN","bR"],
+            ["bp","bp","bp","bp","bp","bp","bp","bp"],
+            ["--","--","--","--","--","--","--","--"],
+            ["--","--","--","--","--","--","--","--"],
+            ["--","--","--","--","--","--","--","--"],
+            ["--","--","--","--","--","--","--","--"],
+            ["wp","wp","wp","wp","wp","wp","wp","wp"],
+            ["wR","wN","wB","wQ","wK","wB","wN","wR"]]
+
+        self.setBoard(self.board, True, CASTLE_ALL)
+
+    '''
+    replace the position with board (8 X 8 list of piece strings), side to move and the rest
+    of the FEN state, same arguments as gamestate.setBoard
+    '''
+    def setBoard(self, board, whiteToMove=True, castleRights=0, enPassant=(), halfmoveClock=0, fullmove=1):
+        self.board = [list(row) for row in board]
+        self.whiteToMove = whiteToMove
+        self.castleRights = castleRights
+        self.halfmoveClock = halfmoveClock
+        self.moveLog = []
+        self.stateLog = []
+        self.checkMate = False
+        self.staleMate = False
+        self.setBitboards()
+        self.enPassant = -1 # square index a pawn just skipped, if it can be captured there
+        if enPassant and enPassantPossible(self.board, whiteToMove, *enPassant):
+            sq = enPassant[0] * 8 + enPassant[1]
+            us = WHITE if whiteToMove else BLACK
+            if pawnAttacks[us ^ 1][sq] & self.pieces[us][PAWN]:
+                self.enPassant = sq
+
+    '''
+    rebuild every bitboard from the string board
+    '''
+    def setBitboards(self):
+        self.pieces = [[0] * 6, [0] * 6]
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    color = WHITE if piece[0] == 'w' else BLACK
+                    self.pieces[color][pieceTypes[piece[1]]] |= 1 << (r * 8 + c)
+        self.occupied = [0, 0]
+        for color in (WHITE, BLACK):
+            for bb in self.pieces[color]:
+                self.occupied[color] |= bb
+
+    @property
+    def whiteKingLocation(self):
+        return divmod(self.pieces[WHITE][KING].bit_length() - 1, 8)
+
+    @property
+    def blackKingLocation(self):
+        return divmod(self.pieces[BLACK][KING].bit_length() - 1, 8)
+
+    '''
+    take a move as parameter and execute it.
+    '''
+    def makeMove(self, move):
+        self.stateLog.append(self.push(move.moveID))
+        self.moveLog.append(move)
+
+    '''
+    undo the last move made
+    '''
+    def undoMove(self):
+        if len(self.moveLog) != 0:
+            move = self.moveLog.pop()
+            self.pop(move.moveID, self.stateLog.pop())
+
+    '''
+    low level make on a packed move code, what perft and search call. returns the record
+    pop needs: (captured piece, castling rights, en passant square, halfmove clock)
+    '''
+    def push(self, code):
+        us = WHITE if self.whiteToMove else BLACK
+        start, end, flags = code & 63, code >> 6 & 63, code >> 12
+        board = self.board
+        pieceMoved = board[start >> 3][start & 7]
+        captureSq = (start & 56) | (end & 7) if flags == MOVE_ENPASSANT else end
+        pieceCaptured = board[captureSq >> 3][captureSq & 7]
+        record = (pieceCaptured, self.castleRights, self.enPassant, self.halfmoveClock)
+        startBit = 1 << start
+        endBit = 1 << end
+        movedType = pieceTypes[pieceMoved[1]]
+
+        self.pieces[us][movedType] ^= startBit
+        self.occupied[us] ^= startBit | endBit
+        board[start >> 3][start & 7] = "--"
+        if pieceCaptured != "--":
+            captureBit = 1 << captureSq
+            self.pieces[us ^ 1][pieceTypes[pieceCaptured[1]]] ^= captureBit
+            self.occupied[us ^ 1] ^= captureBit
+            board[captureSq >> 3][captureSq & 7] = "--"
+        placedType = KNIGHT + flags - 4 if flags >= 4 else movedType
+        self.pieces[us][placedType] ^= endBit
+        board[end >> 3][end & 7] = pieceNames[us][placedType]
+        if flags == MOVE_CASTLE:
+            rookStart, rookEnd = castleRookMoves[end]
+            rookBits = 1 << rookStart | 1 << rookEnd
+            self.pieces[us][ROOK] ^= rookBits
+            self.occupied[us] ^= rookBits
+            board[rookEnd >> 3][rookEnd & 7] = board[rookStart >> 3][rookStart & 7]
+            board[rookStart >> 3][rookStart & 7] = "--"
+
+        self.castleRights &= castleMaskSq[start] & castleMaskSq[end]
+        self.enPassant = -1
+        if movedType == PAWN:
+            self.halfmoveClock = 0
+            if end - start in (16, -16) and pawnAttacks[us][(start + end) >> 1] & self.pieces[us ^ 1][PAWN]:
+                self.enPassant = (start + end) >> 1
+        elif pieceCaptured != "--":
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        self.whiteToMove = not self.whiteToMove
+        return record
+
+    def pop(self, code, record):
+        self.whiteToMove = not self.whiteToMove
+        us = WHITE if self.whiteToMove else BLACK
+        start, end, flags = code & 63, code >> 6 & 63, code >> 12
+        pieceCaptured, self.castleRights, self.enPassant, self.halfmoveClock = record
+        board = self.board
+        startBit = 1 << start
+        endBit = 1 << end
+        placedType = pieceTypes[board[end >> 3][end & 7][1]]
+        movedType = PAWN if flags >= 4 else placedType
+
+        self.pieces[us][placedType] ^= endBit
+        self.pieces[us][movedType] ^= startBit
+        self.occupied[us] ^= startBit | endBit
+        board[start >> 3][start & 7] = pieceNames[us][movedType]
+        board[end >> 3][end & 7] = "--"
+        if pieceCaptured != "--":
+            captureSq = (start & 56) | (end & 7) if flags == MOVE_ENPASSANT else end
+            captureBit = 1 << captureSq
+            self.pieces[us ^ 1][pieceTypes[pieceCaptured[1]]] ^= captureBit
+            self.occupied[us ^ 1] ^= captureBit
+            board[captureSq >> 3][captureSq & 7] = pieceCaptured
+        if flags == MOVE_CASTLE:
+            rookStart, rookEnd = castleRookMoves[end]
+            rookBits = 1 << rookStart | 1 << rookEnd
+            self.pieces[us][ROOK] ^= rookBits
+            self.occupied[us] ^= rookBits
+            board[rookStart >> 3][rookStart & 7] = board[rookEnd >> 3][rookEnd & 7]
+            board[rookEnd >> 3][rookEnd & 7] = "--"
+
+    '''
+    All moves considering checks
+    '''
+    def getValidMoves(self):
+        moves = []
+        board = self.board
+        for code in self.generateLegal():
+            moves.append(move.fromMoveID(code, board))
+
+        if len(moves) == 0:
+            if self.inCheck():
+                self.checkMate = True
+            else:
+                self.staleMate = True
+        else:
+            self.checkMate = False
+            self.staleMate = False
+        return moves
+
+    '''
+    All moves without considering checks
+    '''
+    def getAllPossibleMoves(self):
+        moves = []
+        board = self.board
+        us = WHITE if self.whiteToMove else BLACK
+        for code in self.generatePseudoLegal(us):
+            moves.append(move.fromMoveID(code, board))
+        return moves
+
+    '''
+    determine if the current player is in check
+    '''
+    def inCheck(self):
+        us = WHITE if self.whiteToMove else BLACK
+        king = self.pieces[us][KING].bit_length() - 1
+        return self.isAttacked(king, us ^ 1, self.occupied[WHITE] | self.occupied[BLACK])
+
+    '''
+    determine if the enemy can attack the square r , c
+    '''
+    def squareUnderAttack(self, r, c):
+        them = BLACK if self.whiteToMove else WHITE
+        return self.isAttacked(r * 8 + c, them, self.occupied[WHITE] | self.occupied[BLACK])
+
+    '''
+    is sq attacked by color, with the given occupancy used to block sliders
+    '''
+    def isAttacked(self, sq, color, occ):
+        them = self.pieces[color]
+        if knightAttacks[sq] & them[KNIGHT]:
+            return True
+        if pawnAttacks[color ^ 1][sq] & them[PAWN]:
+            return True
+        if kingAttacks[sq] & them[KING]:
+            return True
+        if rookAttacks(sq, occ) & (them[ROOK] | them[QUEEN]):
+            return True
+        return bool(bishopAttacks(sq, occ) & (them[BISHOP] | them[QUEEN]))
+
+    def attackersOf(self, sq, color, occ):
+        them = self.pieces[color]
+        return ((knightAttacks[sq] & them[KNIGHT])
+                | (pawnAttacks[color ^ 1][sq] & them[PAWN])
+                | (kingAttacks[sq] & them[KING])
+                | (rookAttacks(sq, occ) & (them[ROOK] | them[QUEEN]))
+                | (bishopAttacks(sq, occ) & (them[BISHOP] | them[QUEEN])))
+
+    '''
+    pseudo legal moves as packed ints (start | end << 6), the same packing as move.moveID
+    '''
+    def generatePseudoLegal(self, us):
+        occ = self.occupied[WHITE] | self.occupied[BLACK]
+        return self._generate(us, occ, ~self.occupied[us] & FULL, 0, -1)
+
+    '''
+    legal moves as packed ints (start | end << 6), the same packing as move.moveID
+    checkers and pinned pieces are found once, from the king outward, so no move is ever
+    played just to see whether it leaves the king hanging
+    '''
+    def generateLegal(self):
+        us = WHITE if self.whiteToMove else BLACK
+        them = us ^ 1
+        ours = self.pieces[us]
+        theirs = self.pieces[them]
+        occ = self.occupied[WHITE] | self.occupied[BLACK]
+        king = ours[KING].bit_length() - 1
+
+        checkers = self.attackersOf(king, them, occ)
+
+        # pieces standing alone between our king and an enemy slider
+        pinned = 0
+        snipers = ((rookAttacks(king, self.occupied[them]) & (theirs[ROOK] | theirs[QUEEN]))
+                   | (bishopAttacks(king, self.occupied[them]) & (theirs[BISHOP] | theirs[QUEEN])))
+        while snipers:
+            low = snipers & -snipers
+            snipers ^= low
+            blockers = betweenSquares[king][low.bit_length() - 1] & occ
+            if blockers and not blockers & (blockers - 1) and blockers & self.occupied[us]:
+                pinned |= blockers
+
+        moves = []
+        # king moves, the king itself is removed so it cannot hide behind its own square
+        targets = kingAttacks[king] & ~self.occupied[us]
+        occWithoutKing = occ ^ (1 << king)
+        while targets:
+            low = targets & -targets
+            targets ^= low
+            end = low.bit_length() - 1
+            if not self.isAttacked(end, them, occWithoutKing):
+                moves.append(king | end << 6)
+
+        if checkers & (checkers - 1):  # double check, only the king can move
+            return moves
+        if checkers:
+            checker = checkers.bit_length() - 1
+            targetMask = checkers | betweenSquares[king][checker]
+        else:
+            targetMask = ~self.occupied[us] & FULL
+            for right, kingStart, kingEnd, _, _, empty, crossed in castlings[us]:
+                if self.castleRights & right and not occ & empty and \
+                        not any(self.isAttacked(sq, them, occ) for sq in crossed):
+                    moves.append(kingStart | kingEnd << 6 | MOVE_CASTLE << 12)
+
+        self._generate(us, occ, targetMask, pinned, king, moves)
+
+        if self.enPassant >= 0:
+            # two pawns leave one rank at once, so the pin test above is not enough: try it
+            ep = self.enPassant
+            candidates = pawnAttacks[them][ep] & ours[PAWN]
+            while candidates:
+                low = candidates & -candidates
+                candidates ^= low
+                code = (low.bit_length() - 1) | ep << 6 | MOVE_ENPASSANT << 12
+                record = self.push(code)
+                if not self.isAttacked(king, them, self.occupied[WHITE] | self.occupied[BLACK]):
+                    moves.append(code)
+                self.pop(code, record)
+        return moves
+
+    def _generate(self, us, occ, targetMask, pinned, king, moves=None):
+        '''
+        every non king move (plus king moves when king is -1) whose target is in targetMask,
+        pinned pieces are held to the line through their king
+        '''
+        if moves is None:
+            moves = []
+        ours = self.pieces[us]
+        enemy = self.occupied[us ^ 1]
+        empty = ~occ & FULL
+
+        # pawns
+        pawns = ours[PAWN]
+        forward = -8 if us == WHITE else 8
+        startRank = 6 if us == WHITE else 1
+        while pawns:
+            low = pawns & -pawns
+            pawns ^= low
+            start = low.bit_length() - 1
+            targets = pawnAttacks[us][start] & enemy
+            one = start + forward
+            if 0 <= one < 64 and empty >> one & 1:
+                targets |= 1 << one
+                if start >> 3 == startRank and empty >> (one + forward) & 1:
+                    targets |= 1 << (one + forward)
+            targets &= targetMask
+            if pinned & low:
+                targets &= lineThrough[king][start]
+            while targets:
+                bit = targets & -targets
+                targets ^= bit
+                code = start | (bit.bit_length() - 1) << 6
+                if bit & 0xFF000000000000FF: # last rank
+                    moves.extend(code | flag for flag in promotionCodes)
+                else:
+                    moves.append(code)
+
+        for pieceType in (KNIGHT, BISHOP, ROOK, QUEEN, KING):
+            if pieceType == KING and king >= 0:
+                continue
+            bb = ours[pieceType]
+            while bb:
+                low = bb & -bb
+                bb ^= low
+                start = low.bit_length() - 1
+                if pieceType == KNIGHT:
+                    if pinned & low:  # a pinned knight can never move
+                        continue
+                    targets = knightAttacks[start]
+                elif pieceType == BISHOP:
+                    targets = bishopAttacks(start, occ)
+                elif pieceType == ROOK:
+                    targets = rookAttacks(start, occ)
+                elif pieceType == QUEEN:
+                    targets = rookAttacks(start, occ) | bishopAttacks(start, occ)
+                else:
+                    targets = kingAttacks[start]
+                targets &= targetMask & ~self.occupied[us]
+                if pinned & low:
+                    targets &= lineThrough[king][start]
+                while targets:
+                    bit = targets & -targets
+                    targets ^= bit
+                    moves.append(start | (bit.bit_length() - 1) << 6)
+        return moves
+
+    '''
+    count leaf nodes to the given depth, works on packed moves so no move objects are built
+    '''
+    def perft(self, depth):
+        codes = self.generateLegal()
+        if depth <= 1:
+            return len(codes) if depth == 1 else 1
+        nodes = 0
+        for code in codes:
+            record = self.push(code)
+            nodes += self.perft(depth - 1)
+            self.pop(code, record)
+        return nodes
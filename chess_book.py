@@ -0,0 +1,180 @@
+'''
+opening book: a Polyglot style binary file of 16 byte entries, sorted by position key
+
+    key (8 bytes) | move (2 bytes) | weight (2 bytes) | learn (4 bytes)     big endian
+
+the key is gamestate.zobristKey (the engine's own keys, not the Polyglot random table),
+the move uses the Polyglot bit layout: to file, to rank, from file, from rank, 3 bits each,
+then the promotion piece (1 knight .. 4 queen); castling is written as the king taking its rook.
+the file is opened through mmap and binary searched, so it is never read into memory and
+every process probing the same book shares the page cache.
+
+  python chess_book.py build games/ book.bin --max-ply 20
+  python chess_book.py probe book.bin
+'''
+
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+
+import chess_engine
+import chess_pgn
+
+entryFormat = struct.Struct(">QHHI")
+entrySize = entryFormat.size
+
+
+'''
+move <-> Polyglot move code (ranks counted from white's side, rank 1 = 0)
+'''
+def encodeMove(m):
+    endCol = (7 if m.endCol == 6 else 0) if m.isCastleMove else m.endCol
+    promotion = chess_engine.promotionPieces.index(m.promotionChoice) + 1 if m.isPawnPromotion else 0
+    return (endCol | (7 - m.endRow) << 3 | m.startCol << 6 | (7 - m.startRow) << 9 | promotion << 12)
+
+
+'''
+(start square, end square, promotion piece or None) of a move code, castling still as the
+king taking its rook
+'''
+def decodeMove(code):
+    endCol, endRow = code & 7, 7 - (code >> 3 & 7)
+    startCol, startRow = code >> 6 & 7, 7 - (code >> 9 & 7)
+    promotion = code >> 12 & 7
+    return (startRow, startCol), (endRow, endCol), \
+        chess_engine.promotionPieces[promotion - 1] if promotion else None
+
+
+class openingbook:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        self.count = size // entrySize
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def keyAt(self, i):
+        return struct.unpack_from(">Q", self.map, i * entrySize)[0]
+
+    '''
+    every (key, move code, weight) entry stored for key, found by binary search
+    '''
+    def entriesFor(self, key):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.keyAt(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        entries = []
+        while lo < self.count:
+            entry = entryFormat.unpack_from(self.map, lo * entrySize)
+            if entry[0] != key:
+                break
+            entries.append(entry[:3])
+            lo += 1
+        return entries
+
+    '''
+    the book moves for the position in gs as a list of (move, weight), illegal codes
+    (possible if two positions ever shared a key) are skipped
+    '''
+    def getMoves(self, gs):
+        if self.map is None:
+            return []
+        validMoves = {encodeMove(m): m for m in gs.getValidMoves()}
+        moves = []
+        for _, code, weight in self.entriesFor(gs.zobristKey):
+            m = validMoves.get(code)
+            if m is not None:
+                moves.append((m, weight))
+        return moves
+
+    '''
+    a book move picked at random in proportion to its weight, or None when out of book
+    '''
+    def pickMove(self, gs, rng=random):
+        moves = [(m, w) for m, w in self.getMoves(gs) if w > 0]
+        if not moves:
+            return None
+        return rng.choices([m for m, _ in moves], weights=[w for _, w in moves])[0]
+
+
+'''
+compile every *.pgn file under pgnDir into a book at outPath.
+each (position, move) seen in the first maxPly plies gets 2 points when the side that played
+it won and 1 for a draw; weights are scaled so the largest fits in 16 bits.
+returns the number of entries written.
+'''
+def buildBook(pgnDir, outPath, maxPly=20, minGames=1):
+    counts = {} # (key, code) -> [games, points]
+    for root, _, files in os.walk(pgnDir):
+        for name in sorted(files):
+            if not name.lower().endswith(".pgn"):
+                continue
+            with open(os.path.join(root, name), encoding="utf-8", errors="replace") as f:
+                for game in chess_pgn.readGames(f):
+                    for ply, (gs, m) in enumerate(game.replay()):
+                        if ply >= maxPly:
+                            break
+                        if game.result == "1/2-1/2":
+                            points = 1
+                        elif game.result == ("1-0" if gs.whiteToMove else "0-1"):
+                            points = 2
+                        else:
+                            points = 0
+                        entry = counts.setdefault((gs.zobristKey, encodeMove(m)), [0, 0])
+                        entry[0] += 1
+                        entry[1] += points
+
+    kept = [(key, code, points) for (key, code), (games, points) in counts.items()
+            if games >= minGames and points > 0]
+    scale = max([points for _, _, points in kept], default=1)
+    scale = max(1, -(-scale // 65535))
+    kept.sort()
+    with open(outPath, "wb") as out:
+        for key, code, points in kept:
+            out.write(entryFormat.pack(key, code, max(1, points // scale), 0))
+    return len(kept)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="build or probe an opening book")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="compile a directory of PGN files into a book")
+    build.add_argument("pgnDir")
+    build.add_argument("book")
+    build.add_argument("--max-ply", type=int, default=20)
+    build.add_argument("--min-games", type=int, default=1)
+    probe = commands.add_parser("probe", help="list the book moves of the start position")
+    probe.add_argument("book")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        count = buildBook(args.pgnDir, args.book, args.max_ply, args.min_games)
+        print("wrote %d entries to %s" % (count, args.book))
+    else:
+        gs = chess_engine.gamestate()
+        with openingbook(args.book) as book:
+            for m, weight in sorted(book.getMoves(gs), key=lambda mw: -mw[1]):
+                print("%s %d" % (m.getChessNotation(), weight))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,6 +7,292 @@ it will also keep a move log
 
 '''
 
+import random
+
+rookDirections = ((-1,0),(0,-1),(1,0),(0,1)) # up ,left ,down ,right
+bishopDirections = ((-1,-1),(-1,1),(1,-1),(1,1))
+queenDirections = rookDirections + bishopDirections
+knightDirections = ((-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1))
+
+
+def _targets(r, c, offsets):
+    return tuple((r + d[0], c + d[1]) for d in offsets if 0 <= r + d[0] < 8 and 0 <= c + d[1] < 8)
+
+
+def _rays(r, c, directions):
+    rays = []
+    for d in directions:
+        ray = tuple((r + d[0] * i, c + d[1] * i) for i in range(1, 8)
+                    if 0 <= r + d[0] * i < 8 and 0 <= c + d[1] * i < 8)
+        if ray:
+            rays.append(ray)
+    return tuple(rays)
+
+
+# precomputed per square so the attack queries never bounds check or build tuples
+knightTargets = [[_targets(r, c, knightDirections) for c in range(8)] for r in range(8)]
+kingTargets = [[_targets(r, c, queenDirections) for c in range(8)] for r in range(8)]
+rookRays = [[_rays(r, c, rookDirections) for c in range(8)] for r in range(8)]
+bishopRays = [[_rays(r, c, bishopDirections) for c in range(8)] for r in range(8)]
+# pawnAttackers[color][r][c] -> squares a pawn of that color must stand on to attack r , c
+pawnAttackers = {'w': [[_targets(r, c, ((1,-1),(1,1))) for c in range(8)] for r in range(8)],
+                 'b': [[_targets(r, c, ((-1,-1),(-1,1))) for c in range(8)] for r in range(8)]}
+# piece names by color: pawn, knight, bishop, rook, queen, king
+pieceNames = {'w': ('wp','wN','wB','wR','wQ','wK'), 'b': ('bp','bN','bB','bR','bQ','bK')}
+knightTargetSets = [[frozenset(knightTargets[r][c]) for c in range(8)] for r in range(8)]
+
+
+def _between(rays):
+    '''
+    between[a][b] for squares a , b (row * 8 + col) on one of the rays: the squares strictly
+    between them, None when b is on no ray from a
+    '''
+    between = [[None] * 64 for _ in range(64)]
+    for r in range(8):
+        for c in range(8):
+            for ray in rays[r][c]:
+                for i, (endRow, endCol) in enumerate(ray):
+                    between[r * 8 + c][endRow * 8 + endCol] = ray[:i]
+    return between
+
+
+rookBetween = _between(rookRays)
+bishopBetween = _between(bishopRays)
+# sliderBetweens[color] -> (piece name, between tables it slides along) for each slider
+sliderBetweens = {color: ((names[3], (rookBetween,)), (names[2], (bishopBetween,)),
+                          (names[4], (rookBetween, bishopBetween)))
+                  for color, names in pieceNames.items()}
+
+
+'''
+zobrist keys: one random 64 bit number per (piece, square), xor-ed together with the side
+to move key they identify a position whatever move order reached it.
+the generator is seeded so every process (search workers, books, archives) agrees on them.
+castling keys are indexed by the rights mask (no rights hash to nothing), en passant keys
+by the file of the en passant square.
+'''
+def _zobristKeys():
+    rng = random.Random(0x5A0B15)
+    pieces = {"--": [[0] * 8 for _ in range(8)]} # empty squares hash to nothing
+    for color in "wb":
+        for name in pieceNames[color]:
+            pieces[name] = [[rng.getrandbits(64) for c in range(8)] for r in range(8)]
+    side = rng.getrandbits(64)
+    castling = [rng.getrandbits(64) for _ in range(16)]
+    castling[0] = 0
+    enPassant = [rng.getrandbits(64) for _ in range(8)]
+    return pieces, side, castling, enPassant
+
+
+zobristPieces, zobristBlackToMove, zobristCastling, zobristEnPassant = _zobristKeys()
+
+# ------------------ SPECIAL MOVES ------------------
+# castling rights as a 4 bit mask
+CASTLE_WK, CASTLE_WQ, CASTLE_BK, CASTLE_BQ = 1, 2, 4, 8
+CASTLE_ALL = 15
+
+'''
+rights left after a move touches a square: rights &= castleMasks[r][c] for its start and end
+squares, a king or rook leaving home (or a rook captured at home) drops the matching rights
+'''
+def _castleMasks():
+    masks = [[CASTLE_ALL] * 8 for _ in range(8)]
+    masks[7][4] = CASTLE_ALL & ~(CASTLE_WK | CASTLE_WQ)
+    masks[7][7] = CASTLE_ALL & ~CASTLE_WK
+    masks[7][0] = CASTLE_ALL & ~CASTLE_WQ
+    masks[0][4] = CASTLE_ALL & ~(CASTLE_BK | CASTLE_BQ)
+    masks[0][7] = CASTLE_ALL & ~CASTLE_BK
+    masks[0][0] = CASTLE_ALL & ~CASTLE_BQ
+    return masks
+
+
+castleMasks = _castleMasks()
+castleRookCols = {6: (7, 5), 2: (0, 3)} # king end col -> rook (start col, end col)
+
+# moveID bits 12-15
+MOVE_ENPASSANT = 1
+MOVE_CASTLE = 2
+promotionPieces = "NBRQ" # promotion flag is 4 + index
+
+# stages of gamestate.iterMoves, combine with |
+STAGE_HASH = 1 # the move from the transposition table
+STAGE_CAPTURES = 2 # captures and queen promotions that do not lose material (see_ge 0)
+STAGE_KILLERS = 4 # quiet moves that caused a cutoff in a sibling position
+STAGE_QUIETS = 8 # every other move
+STAGE_BAD_CAPTURES = 16 # captures and queen promotions that lose material, last
+STAGE_ALL = 31
+# piece values for capture ordering, the king is worth more than any exchange
+exchangeValues = {'p': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 20000}
+
+
+'''
+evaluation: tapered material plus piece-square tables.
+tables are written from white's side with rank 8 first, the same layout as board,
+black reads them mirrored. middlegame and endgame scores are blended by the game phase
+(knight and bishop 1, rook 2, queen 4, 24 with all pieces on the board).
+'''
+materialMg = {'p': 82, 'N': 337, 'B': 365, 'R': 477, 'Q': 1025, 'K': 0}
+materialEg = {'p': 94, 'N': 281, 'B': 297, 'R': 512, 'Q': 936, 'K': 0}
+phaseWeights = {'p': 0, 'N': 1, 'B': 1, 'R': 2, 'Q': 4, 'K': 0}
+totalPhase = 24
+
+pawnTable = (
+      0,  0,  0,  0,  0,  0,  0,  0,
+     50, 50, 50, 50, 50, 50, 50, 50,
+     10, 10, 20, 30, 30, 20, 10, 10,
+      5,  5, 10, 25, 25, 10,  5,  5,
+      0,  0,  0, 20, 20,  0,  0,  0,
+      5, -5,-10,  0,  0,-10, -5,  5,
+      5, 10, 10,-20,-20, 10, 10,  5,
+      0,  0,  0,  0,  0,  0,  0,  0)
+pawnTableEg = (
+      0,  0,  0,  0,  0,  0,  0,  0,
+     80, 80, 80, 80, 80, 80, 80, 80,
+     50, 50, 50, 50, 50, 50, 50, 50,
+     30, 30, 30, 30, 30, 30, 30, 30,
+     15, 15, 15, 15, 15, 15, 15, 15,
+      5,  5,  5,  5,  5,  5,  5,  5,
+      0,  0,  0,  0,  0,  0,  0,  0,
+      0,  0,  0,  0,  0,  0,  0,  0)
+knightTable = (
+    -50,-40,-30,-30,-30,-30,-40,-50,
+    -40,-20,  0,  0,  0,  0,-20,-40,
+    -30,  0, 10, 15, 15, 10,  0,-30,
+    -30,  5, 15, 20, 20, 15,  5,-30,
+    -30,  0, 15, 20, 20, 15,  0,-30,
+    -30,  5, 10, 15, 15, 10,  5,-30,
+    -40,-20,  0,  5,  5,  0,-20,-40,
+    -50,-40,-30,-30,-30,-30,-40,-50)
+bishopTable = (
+    -20,-10,-10,-10,-10,-10,-10,-20,
+    -10,  0,  0,  0,  0,  0,  0,-10,
+    -10,  0,  5, 10, 10,  5,  0,-10,
+    -10,  5,  5, 10, 10,  5,  5,-10,
+    -10,  0, 10, 10, 10, 10,  0,-10,
+    -10, 10, 10, 10, 10, 10, 10,-10,
+    -10,  5,  0,  0,  0,  0,  5,-10,
+    -20,-10,-10,-10,-10,-10,-10,-20)
+rookTable = (
+      0,  0,  0,  0,  0,  0,  0,  0,
+      5, 10, 10, 10, 10, 10, 10,  5,
+     -5,  0,  0,  0,  0,  0,  0, -5,
+     -5,  0,  0,  0,  0,  0,  0, -5,
+     -5,  0,  0,  0,  0,  0,  0, -5,
+     -5,  0,  0,  0,  0,  0,  0, -5,
+     -5,  0,  0,  0,  0,  0,  0, -5,
+      0,  0,  0,  5,  5,  0,  0,  0)
+queenTable = (
+    -20,-10,-10, -5, -5,-10,-10,-20,
+    -10,  0,  0,  0,  0,  0,  0,-10,
+    -10,  0,  5,  5,  5,  5,  0,-10,
+     -5,  0,  5,  5,  5,  5,  0, -5,
+      0,  0,  5,  5,  5,  5,  0, -5,
+    -10,  5,  5,  5,  5,  5,  0,-10,
+    -10,  0,  5,  0,  0,  0,  0,-10,
+    -20,-10,-10, -5, -5,-10,-10,-20)
+kingTable = (
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -20,-30,-30,-40,-40,-30,-30,-20,
+    -10,-20,-20,-20,-20,-20,-20,-10,
+     20, 20,  0,  0,  0,  0, 20, 20,
+     20, 30, 10,  0,  0, 10, 30, 20)
+kingTableEg = (
+    -50,-40,-30,-20,-20,-30,-40,-50,
+    -30,-20,-10,  0,  0,-10,-20,-30,
+    -30,-10, 20, 30, 30, 20,-10,-30,
+    -30,-10, 30, 40, 40, 30,-10,-30,
+    -30,-10, 30, 40, 40, 30,-10,-30,
+    -30,-10, 20, 30, 30, 20,-10,-30,
+    -30,-30,  0,  0,  0,  0,-30,-30,
+    -50,-30,-30,-30,-30,-30,-30,-50)
+
+pieceSquareTablesMg = {'p': pawnTable, 'N': knightTable, 'B': bishopTable,
+                       'R': rookTable, 'Q': queenTable, 'K': kingTable}
+pieceSquareTablesEg = {'p': pawnTableEg, 'N': knightTable, 'B': bishopTable,
+                       'R': rookTable, 'Q': queenTable, 'K': kingTableEg}
+
+
+'''
+fold material and position into one signed table per piece name, white positive,
+so a move's evaluation delta is three lookups per phase
+'''
+def _evalTables(material, tables):
+    scores = {"--": [[0] * 8 for _ in range(8)]}
+    for pieceType, table in tables.items():
+        value = material[pieceType]
+        scores['w' + pieceType] = [[value + table[r * 8 + c] for c in range(8)] for r in range(8)]
+        scores['b' + pieceType] = [[-(value + table[(7 - r) * 8 + c]) for c in range(8)] for r in range(8)]
+    return scores
+
+
+evalMg = _evalTables(materialMg, pieceSquareTablesMg)
+evalEg = _evalTables(materialEg, pieceSquareTablesEg)
+piecePhase = {name: phaseWeights[name[1]] for name in pieceNames['w'] + pieceNames['b']}
+piecePhase["--"] = 0
+
+# ------------------ FEN ------------------
+startFen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+fenPieces = {'P': 'wp', 'N': 'wN', 'B': 'wB', 'R': 'wR', 'Q': 'wQ', 'K': 'wK',
+             'p': 'bp', 'n': 'bN', 'b': 'bB', 'r': 'bR', 'q': 'bQ', 'k': 'bK'}
+pieceLetters = {name: letter for letter, name in fenPieces.items()}
+
+
+'''
+split a FEN into (board, whiteToMove, castleRights, enPassant, halfmove clock, fullmove
+number), raises ValueError if it is malformed. castling rights without the king and rook
+on their home squares are dropped.
+'''
+def parseFen(fen):
+    fields = fen.split()
+    if not fields:
+        raise ValueError("empty FEN")
+    board = []
+    for rank in fields[0].split('/'):
+        row = []
+        for ch in rank:
+            if ch.isdigit():
+                row.extend(["--"] * int(ch))
+            elif ch in fenPieces:
+                row.append(fenPieces[ch])
+            else:
+                raise ValueError("bad FEN piece %r: %s" % (ch, fen))
+        board.append(row)
+    if len(board) != 8 or any(len(row) != 8 for row in board):
+        raise ValueError("bad FEN placement: " + fields[0])
+    pieces = [p for row in board for p in row]
+    if pieces.count("wK") != 1 or pieces.count("bK") != 1:
+        raise ValueError("FEN needs one king per side: " + fields[0])
+    if len(fields) > 1 and fields[1] not in ('w', 'b'):
+        raise ValueError("bad FEN side to move: " + fields[1])
+    castleRights = 0
+    if len(fields) > 2 and fields[2] != '-':
+        for ch, right, row, rookCol, color in (('K', CASTLE_WK, 7, 7, 'w'), ('Q', CASTLE_WQ, 7, 0, 'w'),
+                                               ('k', CASTLE_BK, 0, 7, 'b'), ('q', CASTLE_BQ, 0, 0, 'b')):
+            if ch in fields[2] and board[row][4] == color + 'K' and board[row][rookCol] == color + 'R':
+                castleRights |= right
+    enPassant = ()
+    if len(fields) > 3 and fields[3] != '-':
+        if len(fields[3]) != 2 or fields[3][0] not in move.filesToCols or fields[3][1] not in "36":
+            raise ValueError("bad FEN en passant square: " + fields[3])
+        enPassant = (move.ranksToRows[fields[3][1]], move.filesToCols[fields[3][0]])
+    halfmove = int(fields[4]) if len(fields) > 4 and fields[4].isdigit() else 0
+    fullmove = int(fields[5]) if len(fields) > 5 and fields[5].isdigit() else 1
+    return board, len(fields) < 2 or fields[1] == 'w', castleRights, enPassant, halfmove, max(1, fullmove)
+
+
+'''
+could an enemy pawn have just skipped r , c with a double push: the square is on the right
+rank for the side to move, the pawn stands beyond it, and the square it skipped and the one
+it came from are empty. setBoard drops a FEN en passant square that fails this.
+'''
+def enPassantPossible(board, whiteToMove, r, c):
+    pawnRow, pawn, startRow = (3, 'bp', 1) if whiteToMove else (4, 'wp', 6)
+    return r == (2 if whiteToMove else 5) and board[pawnRow][c] == pawn \
+        and board[r][c] == "--" and board[startRow][c] == "--"
+
 
 class gamestate:
     def __init__(self):
@@ -29,19 +315,151 @@ class gamestate:
         self.moveFunctions = {'p' : self.getPawnMoves , 'R' : self.getRookMoves , 'N' : self.getKnightMoves,
                               'B' : self.getBishopMoves , 'Q' : self.getQueenMoves , 'K' : self.getKingMoves}
         
-        self.whiteToMove = True
+        self.pins = {} # square -> pin direction, only filled while getValidMoves runs
+        self.setBoard(self.board, True, CASTLE_ALL)
+
+    '''
+    replace the position with board (8 X 8 list of piece strings), side to move and the
+    rest of the FEN state. the move log is cleared since the new position has no history.
+
+    state that a move cannot give back by itself (castling rights, en passant square,
+    halfmove clock, and the zobrist key and evaluation to save recomputing them) is pushed
+    as one small tuple per move on stateLog, undoMove pops it. repetitions counts how often
+    every zobrist key occurred since the position was set.
+    '''
+    def setBoard(self, board, whiteToMove=True, castleRights=0, enPassant=(), halfmoveClock=0, fullmove=1):
+        self.board = [list(row) for row in board]
+        self.whiteToMove = whiteToMove
+        self.castleRights = castleRights
+        self.enPassant = enPassant if enPassant and enPassantPossible(board, whiteToMove, *enPassant) \
+            and self.enPassantCapturable(*enPassant) else ()
+        self.halfmoveClock = halfmoveClock
+        self.startFullmove = fullmove
         self.moveLog = []
-        self.whiteKingLocation = (7,4)
-        self.blackKingLocation = (0,4)
+        self.stateLog = []
         self.checkMate = False
         self.staleMate = False
+        # piece name -> set of (row, col), kept in step with board by makeMove / undoMove so
+        # generation and attack tests visit occupied squares only
+        self.pieceLocations = {name: set() for name in pieceNames['w'] + pieceNames['b']}
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] != "--":
+                    self.pieceLocations[self.board[r][c]].add((r, c))
+                if self.board[r][c] == 'wK':
+                    self.whiteKingLocation = (r, c)
+                elif self.board[r][c] == 'bK':
+                    self.blackKingLocation = (r, c)
+        self.zobristKey = self.computeZobristKey()
+        self.repetitions = {self.zobristKey: 1}
+        self.mgScore, self.egScore, self.phase = self.computeEvaluation()
+        self.startFen = self.to_fen()
+
+    '''
+    load a FEN into this gamestate, reusing the object (cheaper than building a new one)
+    '''
+    def setFen(self, fen):
+        self.setBoard(*parseFen(fen))
+
+    @classmethod
+    def from_fen(cls, fen):
+        gs = cls()
+        gs.setFen(fen)
+        return gs
+
+    '''
+    the current position as FEN
+    '''
+    def to_fen(self):
+        ranks = []
+        for row in self.board:
+            rank, empty = "", 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += pieceLetters[piece]
+            ranks.append(rank + (str(empty) if empty else ""))
+        startedWhite = self.whiteToMove == (len(self.moveLog) % 2 == 0)
+        fullmove = self.startFullmove + (len(self.moveLog) + (0 if startedWhite else 1)) // 2
+        castling = "".join(ch for ch, right in (('K', CASTLE_WK), ('Q', CASTLE_WQ), ('k', CASTLE_BK),
+                                                  ('q', CASTLE_BQ)) if self.castleRights & right)
+        enPassant = move.colsToFiles[self.enPassant[1]] + move.rowsToRanks[self.enPassant[0]] \
+            if self.enPassant else "-"
+        return "%s %s %s %s %d %d" % ("/".join(ranks), 'w' if self.whiteToMove else 'b',
+                                      castling or "-", enPassant, self.halfmoveClock, fullmove)
+
+    '''
+    plain data copy of the game (starting FEN and the moveIDs played since), cheap to pickle
+    or send to another thread or process, fromSnapshot replays it
+    '''
+    def snapshot(self):
+        return {"fen": self.startFen, "moves": [m.moveID for m in self.moveLog]}
+
+    @classmethod
+    def fromSnapshot(cls, snapshot):
+        gs = cls.from_fen(snapshot["fen"])
+        for moveID in snapshot["moves"]:
+            gs.makeMove(move.fromMoveID(moveID, gs.board))
+        return gs
+
+    '''
+    hash the whole position from scratch, makeMove and undoMove keep it up to date by xor
+    '''
+    def computeZobristKey(self):
+        key = 0 if self.whiteToMove else zobristBlackToMove
+        key ^= zobristCastling[self.castleRights]
+        if self.enPassant:
+            key ^= zobristEnPassant[self.enPassant[1]]
+        for piece, squares in self.pieceLocations.items():
+            for r, c in squares:
+                key ^= zobristPieces[piece][r][c]
+        return key
+
+    '''
+    can the side to move capture en passant onto r , c (the square a pawn just skipped)
+    '''
+    def enPassantCapturable(self, r, c):
+        pawnRow, capturer = (r - 1, 'bp') if r == 5 else (r + 1, 'wp')
+        return (c > 0 and self.board[pawnRow][c-1] == capturer) or \
+            (c < 7 and self.board[pawnRow][c+1] == capturer)
 
     '''
     take a move as parameter and execute it.
     '''
     def makeMove(self ,move):
-        self.board[move.startRow][move.startCol] = "--"
-        self.board[move.endRow][move.endCol] = move.pieceMoved
+        board = self.board
+        self.stateLog.append((self.castleRights, self.enPassant, self.halfmoveClock,
+                              self.zobristKey, self.mgScore, self.egScore, self.phase))
+        key = self.zobristKey ^ self.zobristDelta(move) ^ zobristCastling[self.castleRights]
+        if self.enPassant:
+            key ^= zobristEnPassant[self.enPassant[1]]
+        self.updateEvaluation(move, 1)
+
+        locations = self.pieceLocations
+        start = (move.startRow, move.startCol)
+        end = (move.endRow, move.endCol)
+        locations[move.pieceMoved].remove(start)
+        board[move.startRow][move.startCol] = "--"
+        board[move.endRow][move.endCol] = move.pieceMoved
+        if move.isEnpassantMove:
+            board[move.startRow][move.endCol] = "--" # the captured pawn is beside the start square
+            locations[move.pieceCaptured].remove((move.startRow, move.endCol))
+        elif move.pieceCaptured != "--":
+            locations[move.pieceCaptured].remove(end)
+        if move.isPawnPromotion:
+            board[move.endRow][move.endCol] = move.pieceMoved[0] + move.promotionChoice
+        elif move.isCastleMove:
+            rookStart, rookEnd = castleRookCols[move.endCol]
+            rook = board[move.endRow][rookStart]
+            board[move.endRow][rookEnd] = rook
+            board[move.endRow][rookStart] = "--"
+            locations[rook].remove((move.endRow, rookStart))
+            locations[rook].add((move.endRow, rookEnd))
+        locations[board[move.endRow][move.endCol]].add(end)
         self.moveLog.append(move) # log the move so we can undo it later and print them
         self.whiteToMove = not self.whiteToMove # swap the player 
 
@@ -50,7 +468,23 @@ class gamestate:
             self.whiteKingLocation = (move.endRow,move.endCol)           
         elif move.pieceMoved == 'bK':
             self.blackKingLocation = (move.endRow,move.endCol)
-            
+
+        self.castleRights &= castleMasks[move.startRow][move.startCol] & castleMasks[move.endRow][move.endCol]
+        self.enPassant = ()
+        if move.pieceMoved[1] == 'p':
+            self.halfmoveClock = 0
+            if abs(move.endRow - move.startRow) == 2:
+                square = ((move.startRow + move.endRow) // 2, move.startCol)
+                if self.enPassantCapturable(*square):
+                    self.enPassant = square
+                    key ^= zobristEnPassant[move.startCol]
+        elif move.pieceCaptured != "--":
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        key ^= zobristCastling[self.castleRights]
+        self.zobristKey = key
+        self.repetitions[key] = self.repetitions.get(key, 0) + 1
 
     '''
     undo the last move made
@@ -58,32 +492,158 @@ class gamestate:
     def undoMove(self):
         if len(self.moveLog) != 0: # make sure that there is move to undo
             move = self.moveLog.pop()
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+            count = self.repetitions[self.zobristKey] - 1
+            if count:
+                self.repetitions[self.zobristKey] = count
+            else:
+                del self.repetitions[self.zobristKey]
+
+            board = self.board
+            locations = self.pieceLocations
+            end = (move.endRow, move.endCol)
+            locations[board[move.endRow][move.endCol]].remove(end)
+            locations[move.pieceMoved].add((move.startRow, move.startCol))
+            board[move.startRow][move.startCol] = move.pieceMoved
+            board[move.endRow][move.endCol] = move.pieceCaptured
+            if move.isEnpassantMove:
+                board[move.endRow][move.endCol] = "--"
+                board[move.startRow][move.endCol] = move.pieceCaptured
+                locations[move.pieceCaptured].add((move.startRow, move.endCol))
+            elif move.pieceCaptured != "--":
+                locations[move.pieceCaptured].add(end)
+            if move.isCastleMove:
+                rookStart, rookEnd = castleRookCols[move.endCol]
+                rook = board[move.endRow][rookEnd]
+                board[move.endRow][rookStart] = rook
+                board[move.endRow][rookEnd] = "--"
+                locations[rook].remove((move.endRow, rookEnd))
+                locations[rook].add((move.endRow, rookStart))
             self.whiteToMove = not self.whiteToMove # switch turns back
             if move.pieceMoved == 'wK':
                 self.whiteKingLocation = (move.startRow,move.startCol)           
             elif move.pieceMoved == 'bK':
                 self.blackKingLocation = (move.startRow,move.startCol)
+            (self.castleRights, self.enPassant, self.halfmoveClock,
+             self.zobristKey, self.mgScore, self.egScore, self.phase) = self.stateLog.pop()
+
+    '''
+    the xor of the piece and side to move keys that move changes (castling and en passant
+    keys are handled by makeMove, which knows the rights before and after)
+    '''
+    def zobristDelta(self, move):
+        moved = zobristPieces[move.pieceMoved]
+        placed = zobristPieces[move.pieceMoved[0] + move.promotionChoice] if move.isPawnPromotion else moved
+        capturedRow = move.startRow if move.isEnpassantMove else move.endRow
+        delta = (moved[move.startRow][move.startCol] ^ placed[move.endRow][move.endCol]
+                 ^ zobristPieces[move.pieceCaptured][capturedRow][move.endCol] ^ zobristBlackToMove)
+        if move.isCastleMove:
+            rook = zobristPieces[move.pieceMoved[0] + 'R'][move.endRow]
+            rookStart, rookEnd = castleRookCols[move.endCol]
+            delta ^= rook[rookStart] ^ rook[rookEnd]
+        return delta
+
+    '''
+    add (sign 1) or take back (sign -1) the evaluation change of move, makeMove adds it and
+    undoMove restores the saved scores
+    '''
+    def updateEvaluation(self, move, sign):
+        moved = move.pieceMoved
+        placed = moved[0] + move.promotionChoice if move.isPawnPromotion else moved
+        captured = move.pieceCaptured
+        capturedRow = move.startRow if move.isEnpassantMove else move.endRow
+        self.mgScore += sign * (evalMg[placed][move.endRow][move.endCol] - evalMg[moved][move.startRow][move.startCol]
+                                - evalMg[captured][capturedRow][move.endCol])
+        self.egScore += sign * (evalEg[placed][move.endRow][move.endCol] - evalEg[moved][move.startRow][move.startCol]
+                                - evalEg[captured][capturedRow][move.endCol])
+        self.phase += sign * (piecePhase[placed] - piecePhase[moved] - piecePhase[captured])
+        if move.isCastleMove:
+            rookStart, rookEnd = castleRookCols[move.endCol]
+            mg = evalMg[moved[0] + 'R'][move.endRow]
+            eg = evalEg[moved[0] + 'R'][move.endRow]
+            self.mgScore += sign * (mg[rookEnd] - mg[rookStart])
+            self.egScore += sign * (eg[rookEnd] - eg[rookStart])
+
+    '''
+    the draw the rules impose on the current position ("fifty-move rule" or "threefold
+    repetition"), or None. checkmate on the move that completes the fifty moves still wins,
+    so ask after getValidMoves has set checkMate
+    '''
+    def drawReason(self):
+        if self.halfmoveClock >= 100 and not self.checkMate:
+            return "fifty-move rule"
+        if self.repetitions.get(self.zobristKey, 0) >= 3:
+            return "threefold repetition"
+        return None
+
+    '''
+    full recompute of (middlegame score, endgame score, phase) from the piece lists,
+    makeMove keeps the same three numbers up to date by deltas
+    '''
+    def computeEvaluation(self):
+        mgScore = egScore = phase = 0
+        for piece, squares in self.pieceLocations.items():
+            mg, eg = evalMg[piece], evalEg[piece]
+            for r, c in squares:
+                mgScore += mg[r][c]
+                egScore += eg[r][c]
+            phase += piecePhase[piece] * len(squares)
+        return mgScore, egScore, phase
+
+    '''
+    static evaluation in centipawns from the side to move's point of view, an O(1) read of
+    the incrementally kept scores. recompute=True rebuilds them from the board instead,
+    which is the path to use when verifying the incremental updates
+    '''
+    def evaluate(self, recompute=False):
+        if recompute:
+            mgScore, egScore, phase = self.computeEvaluation()
+        else:
+            mgScore, egScore, phase = self.mgScore, self.egScore, self.phase
+        phase = min(phase, totalPhase)
+        score = (mgScore * phase + egScore * (totalPhase - phase)) // totalPhase
+        return score if self.whiteToMove else -score
+
     '''
     All moves considering checks
+    checks and pins are found once from the king outward, so only legal moves are kept:
+    pinned pieces stay on their pin ray, a single check must be captured or blocked and
+    the king may only step onto squares the enemy does not attack. en passant, which takes
+    two pawns off one rank at once, is tried on the board instead
     '''
     def getValidMoves(self):
-        # 1) generate all possible moves
-        moves = self.getAllPossibleMoves()  # for now, we will not worry about checks
-        # 2) for each move, make the move
-        for i in range(len(moves)-1, -1, -1):
-            self.makeMove(moves[i])
-            # 3) generate all opponent's moves
-            # 4) for each of your opponent's moves, see if they attack your king
-            self.whiteToMove = not self.whiteToMove
-            if self.inCheck():
-                moves.remove(moves[i])  # 5) if they do attack your king, not a valid move
-            self.whiteToMove = not self.whiteToMove
-            self.undoMove()
+        kingRow, kingCol, inCheck, self.pins, checks, validSquares = self.legalityContext()
+        allMoves = self.getAllPossibleMoves() # pinned pieces only move along their pin ray
+        self.pins = {}
+
+        enemyColor = "b" if self.whiteToMove else "w"
+        king = self.board[kingRow][kingCol]
+        self.board[kingRow][kingCol] = "--" # lift the king so it cannot hide on its own ray
+        moves = []
+        enPassantMoves = []
+        for m in allMoves:
+            if m.startRow == kingRow and m.startCol == kingCol:
+                if not self.isSquareAttacked(m.endRow, m.endCol, enemyColor):
+                    moves.append(m)
+            elif m.isEnpassantMove:
+                enPassantMoves.append(m)
+            elif len(checks) == 0 or (len(checks) == 1 and (m.endRow, m.endCol) in validSquares):
+                moves.append(m)
+        self.board[kingRow][kingCol] = king
+
+        for m in enPassantMoves:
+            board = self.board
+            board[m.startRow][m.startCol] = board[m.startRow][m.endCol] = "--"
+            board[m.endRow][m.endCol] = m.pieceMoved
+            if not self.isSquareAttacked(kingRow, kingCol, enemyColor):
+                moves.append(m)
+            board[m.startRow][m.startCol] = m.pieceMoved
+            board[m.startRow][m.endCol] = m.pieceCaptured
+            board[m.endRow][m.endCol] = "--"
+        if not inCheck:
+            self.getCastleMoves(kingRow, kingCol, moves)
 
         if len(moves) == 0:
-            if self.inCheck():
+            if inCheck:
                 self.checkMate = True
             else:
                 self.staleMate = True
@@ -92,98 +652,459 @@ class gamestate:
             self.staleMate = False
 
         return moves
-    
+
+    '''
+    what every legality test for the side to move needs, found once per position:
+    (kingRow, kingCol, inCheck, pins, checks, validSquares), validSquares being the squares a
+    non king move must land on to answer a single check
+    '''
+    def legalityContext(self):
+        if self.whiteToMove:
+            kingRow, kingCol = self.whiteKingLocation
+        else:
+            kingRow, kingCol = self.blackKingLocation
+        inCheck, pins, checks = self.checkForPinsAndChecks(kingRow, kingCol)
+        validSquares = set()
+        if len(checks) == 1:
+            checkRow, checkCol, dRow, dCol = checks[0]
+            if self.board[checkRow][checkCol][1] == 'N': # a knight check can only be captured
+                validSquares.add((checkRow, checkCol))
+            else:
+                for i in range(1, 8):
+                    square = (kingRow + dRow * i, kingCol + dCol * i)
+                    validSquares.add(square)
+                    if square == (checkRow, checkCol):
+                        break
+        return kingRow, kingCol, inCheck, pins, checks, validSquares
+
+    '''
+    is m, generated under the pins of context (see legalityContext), legal
+    '''
+    def isLegal(self, m, context):
+        kingRow, kingCol, inCheck, pins, checks, validSquares = context
+        enemyColor = "b" if self.whiteToMove else "w"
+        board = self.board
+        if m.startRow == kingRow and m.startCol == kingCol:
+            if m.isCastleMove: # getCastleMoves only emits legal castles
+                return True
+            board[kingRow][kingCol] = "--" # lift the king so it cannot hide on its own ray
+            legal = not self.isSquareAttacked(m.endRow, m.endCol, enemyColor)
+            board[kingRow][kingCol] = m.pieceMoved
+            return legal
+        if m.isEnpassantMove:
+            board[m.startRow][m.startCol] = board[m.startRow][m.endCol] = "--"
+            board[m.endRow][m.endCol] = m.pieceMoved
+            legal = not self.isSquareAttacked(kingRow, kingCol, enemyColor)
+            board[m.startRow][m.startCol] = m.pieceMoved
+            board[m.startRow][m.endCol] = m.pieceCaptured
+            board[m.endRow][m.endCol] = "--"
+            return legal
+        return len(checks) == 0 or (len(checks) == 1 and (m.endRow, m.endCol) in validSquares)
+
+    '''
+    legal moves in stages, each stage generated only when the consumer gets to it:
+    STAGE_HASH (hashMove, a moveID), STAGE_CAPTURES (most valuable victim first, only those
+    see_ge(m, 0) passes), STAGE_KILLERS (killers, moveIDs), STAGE_QUIETS (by
+    history[moveID & 4095] when a history table is given), STAGE_BAD_CAPTURES (the captures
+    that lose material). stage selects the stages to run, no move is yielded twice. the consumer may make and undo moves between items as long
+    as the position is back when it asks for the next one.
+    '''
+    def iterMoves(self, stage=STAGE_ALL, hashMove=0, killers=(), history=None):
+        context = self.legalityContext()
+        kingRow, kingCol, inCheck, pins, checks, validSquares = context
+        done = set() # moveIDs already yielded
+        if stage & STAGE_HASH and hashMove:
+            m = self.pseudoLegalMove(hashMove, context)
+            if m is not None and self.isLegal(m, context):
+                done.add(m.moveID)
+                yield m
+
+        badCaptures = []
+        if stage & (STAGE_CAPTURES | STAGE_BAD_CAPTURES):
+            self.pins = pins
+            captures = self.getCaptureMoves()
+            self.pins = {}
+            captures.sort(key=captureOrder, reverse=True)
+            for m in captures:
+                if m.moveID in done or not self.isLegal(m, context):
+                    continue
+                if self.see_ge(m, 0):
+                    if stage & STAGE_CAPTURES:
+                        yield m
+                elif stage & STAGE_BAD_CAPTURES:
+                    badCaptures.append(m)
+
+        if stage & STAGE_KILLERS:
+            for killer in killers:
+                if killer and killer not in done:
+                    m = self.pseudoLegalMove(killer, context)
+                    if m is not None and not isTactical(m) and self.isLegal(m, context):
+                        done.add(killer)
+                        yield m
+
+        if stage & STAGE_QUIETS:
+            self.pins = pins
+            quiets = [m for m in self.getAllPossibleMoves() if not isTactical(m)]
+            self.pins = {}
+            if not inCheck:
+                self.getCastleMoves(kingRow, kingCol, quiets)
+            if history is not None:
+                quiets.sort(key=lambda m: history[m.moveID & 4095], reverse=True)
+            for m in quiets:
+                if m.moveID not in done and self.isLegal(m, context):
+                    yield m
+
+        yield from badCaptures
+
+    '''
+    the pseudo legal move with this moveID in the current position (respecting the pins of
+    context), or None. used for hash and killer moves, which may come from another position
+    '''
+    def pseudoLegalMove(self, moveID, context):
+        r, c = (moveID & 63) >> 3, moveID & 7
+        piece = self.board[r][c]
+        if piece[0] != ('w' if self.whiteToMove else 'b'):
+            return None
+        moves = []
+        self.pins = context[3]
+        self.moveFunctions[piece[1]](r, c, moves)
+        self.pins = {}
+        if piece[1] == 'K' and not context[2] and moveID >> 12 == MOVE_CASTLE:
+            self.getCastleMoves(r, c, moves)
+        for m in moves:
+            if m.moveID == moveID:
+                return m
+        return None
+
+    '''
+    pseudo legal captures (en passant and promotions with capture included) and queen
+    promotions, found from the victims: for every enemy piece, the pieces of ours attacking it.
+    pins are respected like the other generators (self.pins)
+    '''
+    def getCaptureMoves(self):
+        board = self.board
+        us, them = ('w', 'b') if self.whiteToMove else ('b', 'w')
+        moveAmount, lastRow = (-1, 0) if self.whiteToMove else (1, 7)
+        moves = []
+        for victim in pieceNames[them][:5]: # a king is never captured
+            for r, c in self.pieceLocations[victim]:
+                for startRow, startCol in self.getAttackers(r, c, us):
+                    pieceType = board[startRow][startCol][1]
+                    if pieceType == 'N':
+                        if (startRow, startCol) in self.pins:
+                            continue
+                    elif not self.pinAllows(startRow, startCol, ((r > startRow) - (r < startRow),
+                                                                 (c > startCol) - (c < startCol))):
+                        continue
+                    if pieceType == 'p':
+                        self.addPawnMove((startRow, startCol), (r, c), lastRow, moves)
+                    else:
+                        moves.append(move((startRow, startCol), (r, c), board))
+        if self.enPassant:
+            r, c = self.enPassant
+            for startRow, startCol in pawnAttackers[us][r][c]:
+                if board[startRow][startCol] == us + 'p' and self.pinAllows(startRow, startCol, (r - startRow, c - startCol)):
+                    moves.append(move((startRow, startCol), (r, c), board, isEnpassantMove=True))
+        for r, c in self.pieceLocations[us + 'p']:
+            if r + moveAmount == lastRow and board[lastRow][c] == "--" and self.pinAllows(r, c, (moveAmount, 0)):
+                moves.append(move((r, c), (lastRow, c), board, promotionChoice='Q'))
+        return moves
+
+    '''
+    material the side to move stands to win (negative: to lose) by playing m and then
+    trading on its end square, each side recapturing with its least valuable attacker and
+    free to stop when going on would cost it. the board is not touched: pieces that have
+    taken part are only marked as gone, so sliders behind them join in (x-rays).
+    pins and checks are not looked at
+    '''
+    def see(self, m):
+        r, c = m.endRow, m.endCol
+        removed, gain, onSquare = self.seeStart(m)
+        gain = [gain]
+        color = 'b' if self.whiteToMove else 'w'
+        while True:
+            attacker = self.leastValuableAttacker(r, c, color, removed)
+            if attacker is None:
+                break
+            value, square = attacker
+            if value == exchangeValues['K'] and \
+                    self.getAttackers(r, c, 'w' if color == 'b' else 'b', removed | {square}):
+                break # the king may not take a defended piece
+            gain.append(onSquare - gain[-1])
+            onSquare = value
+            removed.add(square)
+            color = 'w' if color == 'b' else 'b'
+        for i in range(len(gain) - 1, 0, -1): # either side may stop the exchange when it pays
+            gain[i - 1] = -max(-gain[i - 1], gain[i])
+        return gain[0]
+
+    '''
+    is see(m) >= threshold, decided with as few exchange steps as possible
+    '''
+    def see_ge(self, m, threshold=0):
+        r, c = m.endRow, m.endCol
+        removed, swap, onSquare = self.seeStart(m)
+        swap -= threshold
+        if swap < 0: # even an unanswered capture is not enough
+            return False
+        swap = onSquare - swap
+        if swap <= 0: # even losing the moved piece keeps us at the threshold
+            return True
+        color = 'b' if self.whiteToMove else 'w'
+        result = 1
+        while True:
+            attacker = self.leastValuableAttacker(r, c, color, removed)
+            if attacker is None:
+                break
+            result ^= 1
+            value, square = attacker
+            removed.add(square)
+            if value == exchangeValues['K']: # a king only recaptures when nothing else can
+                other = 'w' if color == 'b' else 'b'
+                return bool(result ^ 1 if self.getAttackers(r, c, other, removed) else result)
+            swap = value - swap
+            if swap < result:
+                break
+            color = 'w' if color == 'b' else 'b'
+        return bool(result)
+
+    '''
+    (removed squares, material won by m itself, value of the piece left on the end square)
+    '''
+    def seeStart(self, m):
+        removed = {(m.startRow, m.startCol)}
+        gain = exchangeValues.get(m.pieceCaptured[1], 0)
+        onSquare = exchangeValues[m.pieceMoved[1]]
+        if m.isEnpassantMove:
+            removed.add((m.startRow, m.endCol))
+        elif m.isPawnPromotion:
+            onSquare = exchangeValues[m.promotionChoice]
+            gain += onSquare - exchangeValues['p']
+        return removed, gain, onSquare
+
+    '''
+    (value, square) of the cheapest piece of color attacking r , c, or None
+    '''
+    def leastValuableAttacker(self, r, c, color, removed):
+        attackers = self.getAttackers(r, c, color, removed)
+        if not attackers:
+            return None
+        return min((exchangeValues[self.board[row][col][1]], (row, col)) for row, col in attackers)
+
+    '''
+    legal moves piece by piece, king first (it nearly always has one), castles left out
+    '''
+    def iterLegalByPiece(self, context):
+        pins = context[3]
+        for piece in reversed(pieceNames['w' if self.whiteToMove else 'b']):
+            moveFunction = self.moveFunctions[piece[1]]
+            for r, c in tuple(self.pieceLocations[piece]):
+                moves = []
+                self.pins = pins
+                moveFunction(r, c, moves)
+                self.pins = {}
+                for m in moves:
+                    if self.isLegal(m, context):
+                        yield m
+
+    '''
+    does the side to move have a legal move, stops at the first one found.
+    castles can be left out: a legal castle means the king can also step aside
+    '''
+    def hasLegalMove(self):
+        return next(self.iterLegalByPiece(self.legalityContext()), None) is not None
+
+    def countLegalMoves(self):
+        context = self.legalityContext()
+        count = sum(1 for _ in self.iterLegalByPiece(context))
+        if not context[2]:
+            castles = []
+            self.getCastleMoves(context[0], context[1], castles)
+            count += len(castles)
+        return count
+
+    '''
+    look outward from the king at r , c and return (inCheck, pins, checks)
+    pins maps the square of a pinned piece to the direction from the king towards it,
+    checks is a list of (row, col, dRow, dCol) for every checking piece
+    '''
+    def checkForPinsAndChecks(self, r, c):
+        pins = {}
+        checks = []
+        enemyColor = "b" if self.whiteToMove else "w"
+        allyColor = "w" if self.whiteToMove else "b"
+        pawnDirections = ((-1,-1),(-1,1)) if self.whiteToMove else ((1,-1),(1,1))
+        for d in queenDirections:
+            possiblePin = ()
+            for i in range(1, 8):
+                endRow = r + d[0] * i
+                endCol = c + d[1] * i
+                if not (0 <= endRow < 8 and 0 <= endCol < 8): # off board
+                    break
+                endPiece = self.board[endRow][endCol]
+                if endPiece[0] == allyColor:
+                    if possiblePin == (): # first allied piece could be pinned
+                        possiblePin = (endRow, endCol)
+                    else: # second allied piece, no pin or check in this direction
+                        break
+                elif endPiece[0] == enemyColor:
+                    pieceType = endPiece[1]
+                    diagonal = d[0] != 0 and d[1] != 0
+                    if pieceType == 'Q' or \
+                            (pieceType == 'R' and not diagonal) or \
+                            (pieceType == 'B' and diagonal) or \
+                            (pieceType == 'p' and i == 1 and d in pawnDirections):
+                        if possiblePin == ():
+                            checks.append((endRow, endCol, d[0], d[1]))
+                        else:
+                            pins[possiblePin] = d
+                    break # any enemy piece blocks the rest of the ray
+
+        for m in knightDirections:
+            endRow = r + m[0]
+            endCol = c + m[1]
+            if 0 <= endRow < 8 and 0 <= endCol < 8 and self.board[endRow][endCol] == enemyColor + 'N':
+                checks.append((endRow, endCol, m[0], m[1]))
+
+        return len(checks) > 0, pins, checks
+
+    '''
+    can the piece at r , c move in direction d without breaking a pin
+    '''
+    def pinAllows(self, r, c, d):
+        pinDirection = self.pins.get((r, c))
+        return pinDirection is None or pinDirection == d or pinDirection == (-d[0], -d[1])
+
     '''
     determine if the current player is in check  
     '''
     def inCheck(self):
         if self.whiteToMove:
-            return self.squareUnderAttack(self.whiteKingLocation[0], self.whiteKingLocation[1])
+            return self.isSquareAttacked(self.whiteKingLocation[0], self.whiteKingLocation[1], 'b')
         else:
-            return self.squareUnderAttack(self.blackKingLocation[0], self.blackKingLocation[1])
+            return self.isSquareAttacked(self.blackKingLocation[0], self.blackKingLocation[1], 'w')
 
 
     '''
     determine if the enemy can attack the square r , c
     '''
     def squareUnderAttack(self , r , c):
-        self.whiteToMove = not self.whiteToMove # switch to oppenent's turn
-        oppMoves = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove # switch turn back
-        for move in oppMoves:
-            if move.endRow == r and move.endCol == c: # square is under attack
+        return self.isSquareAttacked(r, c, 'b' if self.whiteToMove else 'w')
+
+    '''
+    is the square r , c attacked by any piece of color ('w' or 'b')
+    only the attacker's pieces from the piece lists are visited: pawns and the king by their
+    offsets, knights by table lookup, sliders by the between tables (every square between
+    must be empty on the board). returns at the first attacker found
+    '''
+    def isSquareAttacked(self, r, c, color):
+        board = self.board
+        locations = self.pieceLocations
+        pawn, knight, _, _, _, king = pieceNames[color]
+        for endRow, endCol in pawnAttackers[color][r][c]:
+            if board[endRow][endCol] == pawn:
                 return True
+        kingRow, kingCol = self.whiteKingLocation if color == 'w' else self.blackKingLocation
+        if max(abs(kingRow - r), abs(kingCol - c)) == 1 and board[kingRow][kingCol] == king:
+            return True
+        if locations[knight] and not knightTargetSets[r][c].isdisjoint(locations[knight]):
+            return True
+        square = r * 8 + c
+        for piece, betweens in sliderBetweens[color]:
+            for endRow, endCol in locations[piece]:
+                for between in betweens:
+                    squares = between[square][endRow * 8 + endCol]
+                    if squares is not None:
+                        for betweenRow, betweenCol in squares:
+                            if board[betweenRow][betweenCol] != "--":
+                                break
+                        else:
+                            return True
         return False
 
+    '''
+    every piece of color ('w' or 'b') attacking the square r , c as a list of (row, col).
+    squares in removed count as empty, which is how see() uncovers x-ray attackers
+    '''
+    def getAttackers(self, r, c, color, removed=()):
+        board = self.board
+        locations = self.pieceLocations
+        pawn, knight, _, _, _, king = pieceNames[color]
+        attackers = [(endRow, endCol) for endRow, endCol in pawnAttackers[color][r][c]
+                     if board[endRow][endCol] == pawn and (endRow, endCol) not in removed]
+        attackers.extend(knightTargetSets[r][c].intersection(locations[knight]).difference(removed))
+        for endRow, endCol in locations[king]:
+            if max(abs(endRow - r), abs(endCol - c)) == 1 and (endRow, endCol) not in removed:
+                attackers.append((endRow, endCol))
+        square = r * 8 + c
+        for piece, betweens in sliderBetweens[color]:
+            for endRow, endCol in locations[piece]:
+                if (endRow, endCol) in removed:
+                    continue
+                for between in betweens:
+                    squares = between[square][endRow * 8 + endCol]
+                    if squares is not None and all(board[row][col] == "--" or (row, col) in removed
+                                                   for row, col in squares):
+                        attackers.append((endRow, endCol))
+        return attackers
+
     '''
     All moes without considering checks
     '''
     def getAllPossibleMoves(self):
         moves = []
-        for r in range(len(self.board)): # number of rows
-            for c in range(len(self.board[r])): # number of cols in 
-                turn = self.board[r][c][0]                
-                if (turn == 'w' and self.whiteToMove) or (turn == 'b' and not self.whiteToMove):
-                    piece = self.board[r][c][1]
-                    self.moveFunctions[piece](r ,c ,moves)
+        for piece in pieceNames['w' if self.whiteToMove else 'b']: # only the squares our pieces are on
+            moveFunction = self.moveFunctions[piece[1]]
+            for r, c in self.pieceLocations[piece]:
+                moveFunction(r ,c ,moves)
         return moves
     '''
     get all pawn moves for the pawn located at row ,col and add these moves to the list
     '''
     def getPawnMoves(self, r, c, moves):
-        if self.whiteToMove: # white pawn 
-            if self.board[r-1][c] == "--": # 1 square pawn advance
-                moves.append(move((r,c),(r-1,c),self.board))
-                if r == 6 and self.board[r-2][c] == "--": # 2 square pawn advance
-                    moves.append(move((r,c),(r-2,c),self.board))
-            if c-1 >= 0: # captured to left
-                if self.board[r-1][c-1][0] == 'b': # enemy piece to captured 
-                    moves.append(move((r,c),(r-1,c-1),self.board))
-            if c+1 <= 7: # captured to right 
-                if self.board[r-1][c+1][0] == 'b': 
-                    moves.append(move((r,c),(r-1,c+1),self.board))
+        if self.whiteToMove: # white pawn
+            moveAmount, startRow, enemyColor, lastRow = -1, 6, 'b', 0
         else: # black pawn
-            if self.board[r+1][c] == "--": # 1 square pawn advance
-                moves.append(move((r,c),(r+1,c),self.board))
-                if r == 1 and self.board[r+2][c] == "--": # 2 square pawn advance
-                    moves.append(move((r,c),(r+2,c),self.board))            
-            # captured 
-            if c-1 >= 0: # captured to left
-                if self.board[r+1][c-1][0] == 'w':
-                    moves.append(move((r,c),(r+1,c-1),self.board))
-            if c+1 <= 7: # captured to right
-                if self.board[r+1][c+1][0] == 'w':
-                    moves.append(move((r,c),(r+1,c+1),self.board))
-                   
+            moveAmount, startRow, enemyColor, lastRow = 1, 1, 'w', 7
+        endRow = r + moveAmount
+        if not 0 <= endRow <= 7: # only reachable from a hand made board, nothing to do
+            return
+        if self.board[endRow][c] == "--" and self.pinAllows(r, c, (moveAmount, 0)): # 1 square pawn advance
+            self.addPawnMove((r,c), (endRow,c), lastRow, moves)
+            if r == startRow and self.board[r+2*moveAmount][c] == "--": # 2 square pawn advance
+                moves.append(move((r,c),(r+2*moveAmount,c),self.board))
+        for dCol in (-1, 1): # captures to the left and right
+            endCol = c + dCol
+            if 0 <= endCol <= 7 and self.pinAllows(r, c, (moveAmount, dCol)):
+                if self.board[endRow][endCol][0] == enemyColor:
+                    self.addPawnMove((r,c), (endRow,endCol), lastRow, moves)
+                elif (endRow, endCol) == self.enPassant:
+                    moves.append(move((r,c),(endRow,endCol),self.board, isEnpassantMove=True))
+
+    '''
+    a pawn move, or the four promotions when it reaches the last rank (queen first)
+    '''
+    def addPawnMove(self, startSq, endSq, lastRow, moves):
+        if endSq[0] == lastRow:
+            for choice in "QRBN":
+                moves.append(move(startSq, endSq, self.board, promotionChoice=choice))
+        else:
+            moves.append(move(startSq, endSq, self.board))
+
     '''
     Get all Rook moves for the Rook located at row ,col and add these moves to the list
     '''
     def getRookMoves(self ,r , c ,moves):
-        directions = ((-1,0),(0,-1),(1,0),(0,1)) # up ,left ,down ,right 
-        enemyColor = "b" if self.whiteToMove else "w"
-        for d in directions:
-            for i in range(1,8):
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8: # on board 
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == "--": # empty space valid 
-                        moves.append(move((r,c),(endRow,endCol),self.board))
-                    elif endPiece[0] == enemyColor: # enemy piece valid 
-                        moves.append(move((r,c),(endRow,endCol),self.board))
-                        break
-                    else: # friendly piece in valid
-                        break
-                else:
-                    break
+        self.getSlidingMoves(r, c, rookDirections, moves)
 
     '''
     Get all knight moves for the knight located at row ,col and add these moves to the list
     '''
     def getKnightMoves(self ,r , c ,moves):
-        knightMoves = ((-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1))
+        if (r, c) in self.pins: # a pinned knight can never move
+            return
         allyColor = "w" if self.whiteToMove else "b"
-        for m in knightMoves:
+        for m in knightDirections:
             endRow = r + m[0]
             endCol = c + m[1]
             if 0 <= endRow < 8 and 0 <= endCol < 8:
@@ -195,26 +1116,31 @@ class gamestate:
     Get all Bishop moves for the Bishop located at row ,col and add these moves to the list
     '''
     def getBishopMoves(self ,r , c ,moves):
-        directions = ((-1,-1),(-1,1),(1,-1),(1,1))
+        self.getSlidingMoves(r, c, bishopDirections, moves)
+
+    '''
+    walk each direction until the edge, a friendly piece or the first enemy piece
+    '''
+    def getSlidingMoves(self, r, c, directions, moves):
         enemyColor = "b" if self.whiteToMove else "w"
         for d in directions:
+            if not self.pinAllows(r, c, d):
+                continue
             for i in range(1,8):
                 endRow = r + d[0] * i
                 endCol = c + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
+                if 0 <= endRow < 8 and 0 <= endCol < 8: # on board 
                     endPiece = self.board[endRow][endCol]
                     if endPiece == "--": # empty space valid 
                         moves.append(move((r,c),(endRow,endCol),self.board))
-                    elif endPiece[0] == enemyColor:
+                    elif endPiece[0] == enemyColor: # enemy piece valid 
                         moves.append(move((r,c),(endRow,endCol),self.board))
                         break
                     else: # friendly piece invalid
                         break
-                else: # off board 
+                else: # off board
                     break
 
-
-
     '''
     Get all Queen moves for the Queen located at row ,col and add these moves to the list
     '''
@@ -242,7 +1168,36 @@ class gamestate:
                 if endPiece[0] != allyColor:
                     moves.append(move((r,c),(endRow,endCol),self.board))
 
+    '''
+    add the castling moves of the king at r , c (not in check): the right is still held, the
+    squares between king and rook are empty and the king does not pass an attacked square
+    '''
+    def getCastleMoves(self, r, c, moves):
+        if self.whiteToMove:
+            kingSide, queenSide, allyColor, enemyColor = CASTLE_WK, CASTLE_WQ, 'w', 'b'
+        else:
+            kingSide, queenSide, allyColor, enemyColor = CASTLE_BK, CASTLE_BQ, 'b', 'w'
+        board = self.board
+        if self.castleRights & kingSide and board[r][5] == "--" and board[r][6] == "--" and \
+                board[r][7] == allyColor + 'R' and not self.isSquareAttacked(r, 5, enemyColor) and \
+                not self.isSquareAttacked(r, 6, enemyColor):
+            moves.append(move((r,c),(r,6),board, isCastleMove=True))
+        if self.castleRights & queenSide and board[r][3] == "--" and board[r][2] == "--" and \
+                board[r][1] == "--" and board[r][0] == allyColor + 'R' and \
+                not self.isSquareAttacked(r, 3, enemyColor) and not self.isSquareAttacked(r, 2, enemyColor):
+            moves.append(move((r,c),(r,2),board, isCastleMove=True))
+
 class move():
+    '''
+    millions of these are built during search, so the attributes live in __slots__ and
+    the whole move is also packed into 16 bits of moveID: start square (6 bits) | end square
+    (6 bits) | flags (4 bits: MOVE_ENPASSANT, MOVE_CASTLE or 4 + promotion piece index),
+    squares counted row * 8 + col. moves hash and compare by moveID so they can be
+    looked up in sets and dicts.
+    '''
+    __slots__ = ('startRow', 'startCol', 'endRow', 'endCol', 'pieceMoved', 'pieceCaptured', 'moveID',
+                 'isPawnPromotion', 'promotionChoice', 'isEnpassantMove', 'isCastleMove')
+
     # map keys to values 
     # key : value
     ranksToRows = {"1": 7, "2": 6 ,"3": 5,"4": 4,
@@ -255,15 +1210,37 @@ class move():
 
     colsToFiles = {v: k for k, v in filesToCols.items()}
 
-    def __init__(self ,startSq ,endSq ,board):
+    def __init__(self ,startSq ,endSq ,board, isEnpassantMove=False, isCastleMove=False, promotionChoice=None):
         self.startRow = startSq[0]
         self.startCol = startSq[1]
         self.endRow = endSq[0]
         self.endCol = endSq[1]
         self.pieceMoved = board[self.startRow][self.startCol]
         self.pieceCaptured = board[self.endRow][self.endCol]
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
-        
+        self.isPawnPromotion = promotionChoice is not None
+        self.promotionChoice = promotionChoice # 'Q', 'R', 'B' or 'N'
+        self.isEnpassantMove = isEnpassantMove
+        self.isCastleMove = isCastleMove
+        flags = 0
+        if isEnpassantMove:
+            self.pieceCaptured = 'bp' if self.pieceMoved == 'wp' else 'wp'
+            flags = MOVE_ENPASSANT
+        elif isCastleMove:
+            flags = MOVE_CASTLE
+        elif promotionChoice is not None:
+            flags = 4 + promotionPieces.index(promotionChoice)
+        self.moveID = (self.startRow * 8 + self.startCol) | (self.endRow * 8 + self.endCol) << 6 | flags << 12
+
+    '''
+    decode a packed moveID back into a move on the given board
+    '''
+    @classmethod
+    def fromMoveID(cls, moveID, board):
+        start = moveID & 63
+        end = moveID >> 6 & 63
+        flags = moveID >> 12
+        return cls((start >> 3, start & 7), (end >> 3, end & 7), board, flags == MOVE_ENPASSANT,
+                   flags == MOVE_CASTLE, promotionPieces[flags - 4] if flags >= 4 else None)
 
     '''
     overriding The equals method
@@ -273,11 +1250,43 @@ class move():
             return self.moveID == other.moveID
         return False
 
+    def __hash__(self):
+        return self.moveID
+
+    def __repr__(self):
+        return "move(%s)" % self.getChessNotation()
+
     def getChessNotation(self):
-        return self.getRankFile(self.startRow ,self.startCol) + self.getRankFile(self.endRow ,self.endCol)
+        notation = self.getRankFile(self.startRow ,self.startCol) + self.getRankFile(self.endRow ,self.endCol)
+        return notation + self.promotionChoice.lower() if self.isPawnPromotion else notation
 
     def getRankFile(self ,r ,c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
 
 
 
+'''
+captures and queen promotions, the moves STAGE_CAPTURES covers
+'''
+def isTactical(m):
+    return m.pieceCaptured != "--" or m.promotionChoice == 'Q'
+
+
+'''
+most valuable victim first, least valuable attacker breaking ties
+'''
+def captureOrder(m):
+    score = 10 * exchangeValues.get(m.pieceCaptured[1], 0) - exchangeValues[m.pieceMoved[1]]
+    return score + 10 * exchangeValues[m.promotionChoice] if m.isPawnPromotion else score
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description="chess engine")
+    parser.add_argument("--uci", action="store_true", help="speak the UCI protocol on stdin / stdout")
+    args = parser.parse_args()
+    if not args.uci:
+        parser.error("nothing to do, pass --uci")
+    import chess_uci
+    sys.exit(chess_uci.main())
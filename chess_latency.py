@@ -0,0 +1,56 @@
+'''
+request latency bookkeeping shared by chess_server and chess_loadgen. only the standard
+library is used, so a load generator can import it without pulling in the engine.
+'''
+
+firstBucket = 0.00005 # upper bound of the first latency bucket, 50us
+
+
+class latencystats:
+    '''
+    count, total and worst time, plus a histogram with power of two buckets starting at 50us.
+    percentiles are read from the histogram, so memory per session stays fixed
+    '''
+    bucketCount = 24
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self.buckets = [0] * self.bucketCount
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.worst:
+            self.worst = seconds
+        self.buckets[min(self.bucketCount - 1, int(seconds / firstBucket).bit_length())] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.worst = max(self.worst, other.worst)
+        for i, n in enumerate(other.buckets):
+            self.buckets[i] += n
+
+    '''
+    upper bound in seconds of the bucket holding the given fraction of the requests
+    '''
+    def percentile(self, fraction):
+        if self.count == 0:
+            return 0.0
+        wanted = fraction * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= wanted:
+                return min(firstBucket * 2 ** i, self.worst)
+        return self.worst
+
+    def summary(self):
+        return {"count": self.count,
+                "meanMs": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+                "p50Ms": round(self.percentile(0.5) * 1000, 3),
+                "p95Ms": round(self.percentile(0.95) * 1000, 3),
+                "p99Ms": round(self.percentile(0.99) * 1000, 3),
+                "maxMs": round(self.worst * 1000, 3)}
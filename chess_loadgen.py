@@ -0,0 +1,138 @@
+'''
+load generator for chess_server: simulates many players against a running server and reports
+throughput and latency as the clients see it, next to the server's own metrics.
+
+every player opens its own connection and starts a game (a share of them against the AI).
+it then plays random moves from the legal list in each reply, pausing around --think seconds
+between moves like a person would, until the game ends or --plies moves are played.
+--concurrency caps the connections open at once and --ramp spreads the starts out. nothing
+here imports the engine (chess_latency is standard library only), so one client process
+can drive thousands of players.
+
+  python chess_loadgen.py --players 2000 --concurrency 1000 --think 0.5 --ai-share 0.1
+'''
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+import chess_latency
+
+defaultPort = 8765 # chess_server.defaultPort, not imported since chess_server pulls in the engine
+
+
+class loadstats:
+    def __init__(self):
+        self.latency = {} # op -> chess_latency.latencystats
+        self.games = self.finished = self.errors = self.failedPlayers = 0
+        self.start = time.perf_counter()
+
+    def add(self, op, seconds):
+        stats = self.latency.get(op)
+        if stats is None:
+            stats = self.latency[op] = chess_latency.latencystats()
+        stats.add(seconds)
+
+    def requests(self):
+        return sum(stats.count for stats in self.latency.values())
+
+    def summary(self):
+        seconds = time.perf_counter() - self.start
+        return {"seconds": round(seconds, 3), "games": self.games, "finished": self.finished,
+                "requests": self.requests(), "requestsPerSecond": round(self.requests() / seconds, 1),
+                "errors": self.errors, "failedPlayers": self.failedPlayers,
+                "latency": {op: stats.summary() for op, stats in sorted(self.latency.items())}}
+
+
+async def request(reader, writer, message, stats):
+    start = time.perf_counter()
+    writer.write(json.dumps(message).encode("utf-8") + b"\n")
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("server closed the connection")
+    stats.add(message["op"], time.perf_counter() - start)
+    reply = json.loads(line)
+    if not reply.get("ok"):
+        stats.errors += 1
+    return reply
+
+
+async def runPlayer(host, port, rng, plies, aiShare, think, stats):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        ai = rng.choice(("white", "black")) if rng.random() < aiShare else "none"
+        reply = await request(reader, writer, {"op": "new", "ai": ai}, stats)
+        stats.games += 1
+        for _ in range(plies):
+            if not reply.get("ok") or reply["over"]:
+                break
+            if think > 0:
+                await asyncio.sleep(rng.uniform(0, 2 * think))
+            reply = await request(reader, writer, {"op": "move", "move": rng.choice(reply["legal"])}, stats)
+        if reply.get("over"):
+            stats.finished += 1
+    finally:
+        writer.close()
+
+
+'''
+play players games against the server at host:port and return the loadstats
+'''
+async def runLoad(host, port, players, concurrency=500, plies=40, aiShare=0.0, think=0.0, ramp=0.0, seed=None):
+    stats = loadstats()
+    seeds = random.Random(seed)
+    slots = asyncio.Semaphore(concurrency)
+
+    async def player(index, rng):
+        if ramp > 0:
+            await asyncio.sleep(ramp * index / players)
+        async with slots:
+            try:
+                await runPlayer(host, port, rng, plies, aiShare, think, stats)
+            except (OSError, ValueError):
+                stats.failedPlayers += 1
+
+    await asyncio.gather(*(player(i, random.Random(seeds.getrandbits(64))) for i in range(players)))
+    return stats
+
+
+async def fetchMetrics(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        return await request(reader, writer, {"op": "metrics"}, loadstats())
+    finally:
+        writer.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="simulate many players against chess_server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=defaultPort)
+    parser.add_argument("--players", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=500, help="connections open at once")
+    parser.add_argument("--plies", type=int, default=40, help="moves each player makes at most")
+    parser.add_argument("--ai-share", type=float, default=0.0, help="fraction of games against the AI")
+    parser.add_argument("--think", type=float, default=0.0, help="mean seconds between a player's moves")
+    parser.add_argument("--ramp", type=float, default=0.0, help="seconds over which the players start")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    async def run():
+        stats = await runLoad(args.host, args.port, args.players, args.concurrency, args.plies,
+                              args.ai_share, args.think, args.ramp, args.seed)
+        return stats.summary(), await fetchMetrics(args.host, args.port)
+
+    try:
+        client, server = asyncio.run(run())
+    except OSError as e:
+        sys.stderr.write("cannot reach %s:%d: %s\n" % (args.host, args.port, e))
+        return 1
+    print(json.dumps({"client": client, "server": server}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
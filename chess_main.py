@@ -1,36 +1,98 @@
-
 #Main driver file for Chess Game
 #Handles user input and displays the current GameState.
 
-import pygame as p
+import os
+
 import chess_engine
-import random
+import chess_ai
 
-p.init()
+p = None # pygame, imported by initPygame() when the window opens so importing this module stays cheap
 
 width = height = 512
 dimension = 8
 SQ_Sizee = height // dimension
 Max_FPS = 60
+aiPollInterval = 20 # ms between checks for the AI move while it is thinking
+aiThinkTime = 1.0 # seconds per AI move
+aiPonder = True # keep searching the predicted reply while the human thinks
+openingBookPath = "book.bin" # built with chess_book.py, used when present
+tablebasePath = "tables" # built with chess_tablebase.py, used when present
+spriteAtlasPath = os.path.join("image", "cache", "atlas_%d.png") # % SQ_Sizee, rebuilt when a source image changes
+iconSize = 60
 image = {}
 
+'''
+import pygame and start only the parts the game uses (display and fonts, no audio or joystick)
+'''
+def initPygame():
+    global p
+    if p is None:
+        import pygame
+        pygame.display.init()
+        pygame.font.init()
+        p = pygame
+    return p
+
 # ------------------ LOAD IMAGES ------------------
 
+pieces = ['wp','wR','wN','wB','wK','wQ',
+          'bp','bR','bN','bB','bK','bQ']
+
+'''
+fill image with the pieces scaled to a square and the menu icon, cut from one sprite atlas.
+the atlas is built from the PNGs once and saved, later starts load that single pre-scaled
+file, and it is rebuilt when a source PNG is newer. needs the display mode to be set.
+'''
 def loadImages():
-    pieces = ['wp','wR','wN','wB','wK','wQ',
-              'bp','bR','bN','bB','bK','bQ']
-    for piece in pieces:
-        image[piece] = p.transform.scale(
-            p.image.load("image/" + piece + ".png"),
-            (SQ_Sizee, SQ_Sizee)
-        )
+    if image:
+        return
+    sources = ["image/" + piece + ".png" for piece in pieces] + ["image/icon.png"]
+    atlasPath = spriteAtlasPath % SQ_Sizee
+    atlas = None
+    if os.path.exists(atlasPath) and \
+            os.path.getmtime(atlasPath) >= max(os.path.getmtime(path) for path in sources):
+        try:
+            atlas = p.image.load(atlasPath).convert_alpha()
+        except p.error:
+            atlas = None
+    if atlas is None:
+        atlas = buildAtlas(sources)
+        try:
+            os.makedirs(os.path.dirname(atlasPath), exist_ok=True)
+            p.image.save(atlas, atlasPath)
+        except (OSError, p.error): # a read-only install still works, it just builds every start
+            pass
+    for i, piece in enumerate(pieces):
+        image[piece] = atlas.subsurface((i * SQ_Sizee, 0, SQ_Sizee, SQ_Sizee))
+    image["icon"] = atlas.subsurface((len(pieces) * SQ_Sizee, 0, iconSize, iconSize))
+
+'''
+one surface with the twelve pieces side by side at square size and the icon after them
+'''
+def buildAtlas(sources):
+    atlas = p.Surface((len(pieces) * SQ_Sizee + iconSize, max(SQ_Sizee, iconSize)), p.SRCALPHA)
+    for i, path in enumerate(sources[:-1]):
+        atlas.blit(p.transform.scale(p.image.load(path), (SQ_Sizee, SQ_Sizee)), (i * SQ_Sizee, 0))
+    atlas.blit(p.transform.smoothscale(p.image.load(sources[-1]).convert_alpha(), (iconSize, iconSize)),
+               (len(pieces) * SQ_Sizee, 0))
+    return atlas.convert_alpha()
+
+'''
+valid moves keyed by their start and end squares (moveID & 4095) for the click handler,
+a pawn reaching the last rank always becomes a queen
+'''
+def squareLookup(validMoves):
+    lookup = {}
+    for m in validMoves:
+        lookup.setdefault(m.moveID & 4095, m) # the queen promotion is generated first
+    return lookup
 
 # ------------------ MENU ------------------
 
 def drawMenu(screen, buttons, iconImg):
     screen.fill((25, 25, 35))
 
-    titleFont = p.font.SysFont("Segoe UI", 72, True)
+    titleFont = getFont("Segoe UI", 72, True)
     titleText = titleFont.render("CHESS", True, (240,240,240))
     titleRect = titleText.get_rect(center=(width//2, 130))
     screen.blit(titleText, titleRect)
@@ -40,7 +102,7 @@ def drawMenu(screen, buttons, iconImg):
     screen.blit(iconImg, iconRect)
 
     mousePos = p.mouse.get_pos()
-    font = p.font.SysFont("Segoe UI", 28, True)
+    font = getFont("Segoe UI", 28, True)
 
     for rect, text in buttons:
         color = (100,180,255) if rect.collidepoint(mousePos) else (70,130,200)
@@ -86,11 +148,40 @@ def drawCheckmateText(screen, text, alpha, scale):
 
 # ------------------ MAIN ------------------
 
+'''
+the app is a small state machine: "menu" -> "game" -> "menu" ... until "quit".
+pygame, the window, the images and the AI worker are set up once and shared by every game,
+so going back to the menu costs nothing and does not grow the stack.
+'''
 def main():
+    initPygame()
     screen = p.display.set_mode((width,height))
     clock = p.time.Clock()
-
-    # -------- MENU SETUP --------
+    loadImages()
+    renderer = boardrenderer(screen)
+    aiWorker = None
+
+    state = "menu"
+    players = None
+    while state != "quit":
+        if state == "menu":
+            players = runMenu(screen)
+            state = "quit" if players is None else "game"
+        else:
+            playerOne, playerTwo = players
+            if aiWorker is None and not (playerOne and playerTwo):
+                bookPath = openingBookPath if os.path.exists(openingBookPath) else None
+                tables = tablebasePath if os.path.isdir(tablebasePath) else None
+                aiWorker = chess_ai.aiworker(aiThinkTime, bookPath=bookPath, tablebasePath=tables)
+            state = runGame(screen, clock, renderer, playerOne, playerTwo,
+                            aiWorker if not (playerOne and playerTwo) else None)
+    if aiWorker is not None:
+        aiWorker.cancel()
+
+'''
+show the menu until a choice is made: (playerOne, playerTwo) human flags, or None to quit
+'''
+def runMenu(screen):
     buttonWidth = 200
     buttonHeight = 60
 
@@ -104,63 +195,71 @@ def main():
         (quitButton, "Quit")
     ]
 
-    menu = True
-    playerOne = True
-    playerTwo = True
-
-    iconImg = p.image.load("image/icon.png")
-    iconImg = p.transform.smoothscale(iconImg, (60,60))
+    # the menu only changes when the hovered button does, so it is redrawn on that alone
+    hovered = -1
+    while True:
+        mousePos = p.mouse.get_pos()
+        nowHovered = next((i for i, (rect, _) in enumerate(buttons) if rect.collidepoint(mousePos)), None)
+        if nowHovered != hovered:
+            drawMenu(screen, buttons, image["icon"])
+            hovered = nowHovered
 
-    # -------- MENU LOOP --------
-    while menu:
-        drawMenu(screen, buttons, iconImg)
-
-        for e in p.event.get():
+        for e in waitForEvents():
             if e.type == p.QUIT:
-                return
+                return None
 
             elif e.type == p.MOUSEBUTTONDOWN:
                 mousePos = p.mouse.get_pos()
 
                 if aiButton.collidepoint(mousePos):
-                    playerOne = True
-                    playerTwo = False
-                    menu = False
+                    return (True, False)
 
                 elif twoPlayerButton.collidepoint(mousePos):
-                    playerOne = True
-                    playerTwo = True
-                    menu = False
+                    return (True, True)
 
                 elif quitButton.collidepoint(mousePos):
-                    return
-
-        clock.tick(60)
+                    return None
 
-    # -------- GAME SETUP --------
+'''
+play one game, returns the next state: "menu" (M after the game ended) or "quit"
+'''
+def runGame(screen, clock, renderer, playerOne, playerTwo, aiWorker):
     gs = chess_engine.gamestate()
     validMoves = gs.getValidMoves()
+    validMoveLookup = squareLookup(validMoves)
     moveMade = False
     gameOver = False
 
     animationAlpha = 0
     animationScale = 1.0
 
-    loadImages()
+    # the AI searches in a background thread, its move is picked up by polling each frame
+    renderer.invalidate()
 
-    running = True
     sqSelected = ()
     playerClicks = []
 
     # -------- GAME LOOP --------
-    while running:
+    while True:
 
         humanTurn = (gs.whiteToMove and playerOne) or \
                     (not gs.whiteToMove and playerTwo)
 
-        for e in p.event.get():
+        # sleep until there is input unless something is animating, the board still has to be
+        # drawn (new game, restart) or the AI owes a move
+        if moveMade or (gameOver and animationAlpha < 255) or (renderer.fullRedraw and not gameOver):
+            clock.tick(Max_FPS)
+            events = p.event.get()
+        elif aiWorker is not None and not gameOver and not humanTurn:
+            events = waitForEvents(aiPollInterval)
+        else:
+            events = waitForEvents()
+
+        for e in events:
             if e.type == p.QUIT:
-                running = False
+                if aiWorker is not None:
+                    aiWorker.cancel()
+                return "quit"
 
             elif e.type == p.MOUSEBUTTONDOWN:
                 if humanTurn and not gameOver:
@@ -182,8 +281,9 @@ def main():
                             gs.board
                         )
 
-                        if move in validMoves:
-                            gs.makeMove(move)
+                        validMove = validMoveLookup.get(move.moveID & 4095)
+                        if validMove is not None:
+                            gs.makeMove(validMove)
                             moveMade = True
 
                         sqSelected = ()
@@ -192,168 +292,234 @@ def main():
             elif e.type == p.KEYDOWN:
 
                 if e.key == p.K_z:
+                    if aiWorker is not None:
+                        aiWorker.cancel() # the position it was searching is about to change
                     gs.undoMove()
                     moveMade = True
 
                 if gameOver:
                     if e.key == p.K_r:
+                        if aiWorker is not None:
+                            aiWorker.cancel()
                         gs = chess_engine.gamestate()
                         validMoves = gs.getValidMoves()
+                        validMoveLookup = squareLookup(validMoves)
                         sqSelected = ()
                         playerClicks = []
                         moveMade = False
                         gameOver = False
                         animationAlpha = 0
                         animationScale = 1.0
+                        renderer.invalidate()
 
                     elif e.key == p.K_m:
-                        main()
-                        return
+                        if aiWorker is not None:
+                            aiWorker.cancel()
+                        return "menu"
 
         # -------- UPDATE MOVES --------
         if moveMade:
             validMoves = gs.getValidMoves()
+            validMoveLookup = squareLookup(validMoves)
             moveMade = False
 
             if gs.checkMate:
                 print("CHECKMATE DETECTED")
 
-            if gs.checkMate or gs.staleMate:
+            if gs.checkMate or gs.staleMate or gs.drawReason() is not None:
                 gameOver = True
+                if aiWorker is not None:
+                    aiWorker.cancel() # a ponder search would otherwise run on after the game
 
         # -------- AI MOVE --------
         humanTurn = (gs.whiteToMove and playerOne) or \
                     (not gs.whiteToMove and playerTwo)
 
-        if not gameOver and not humanTurn:
-            if len(validMoves) > 0:
-                aiMove = random.choice(validMoves)
-                gs.makeMove(aiMove)
-                moveMade = True
+        if aiWorker is not None and not gameOver and not humanTurn and len(validMoves) > 0:
+            if not aiWorker.busy():
+                aiWorker.think(gs)
+            result = aiWorker.poll()
+            if result is not None and result.bestMove is not None:
+                aiMove = next((m for m in validMoves if m.moveID == result.bestMove.moveID), None)
+                if aiMove is not None:
+                    gs.makeMove(aiMove)
+                    moveMade = True
+                    if aiPonder and len(result.pv) > 1:
+                        aiWorker.ponder(gs, result.pv[1])
 
         # -------- DRAW BOARD --------
-        drawGameState(screen, gs, sqSelected, validMoves)
+        if not gameOver:
+            dirty = renderer.drawGameState(gs, sqSelected, validMoves)
+            if dirty:
+                p.display.update(dirty)
 
         # -------- OVERLAY --------
-        if gameOver:
+        else:
+            changed = len(renderer.updateFrame(gs, sqSelected, validMoves)) > 0
             if animationAlpha < 255:
                 animationAlpha += 5
                 animationScale += 0.01
+                changed = True
 
-            if gs.checkMate:
-                if gs.whiteToMove:
-                    drawAnimatedEndGameText(
-                        screen,
-                        "Black Wins by Checkmate",
-                        animationAlpha,
-                        animationScale
-                    )
+            if changed:
+                if gs.checkMate:
+                    text = "Black Wins by Checkmate" if gs.whiteToMove else "White Wins by Checkmate"
+                elif gs.staleMate:
+                    text = "Stalemate"
                 else:
-                    drawAnimatedEndGameText(
-                        screen,
-                        "White Wins by Checkmate",
-                        animationAlpha,
-                        animationScale
-                    )
-            else:
-                drawAnimatedEndGameText(
-                    screen,
-                    "Stalemate",
-                    animationAlpha,
-                    animationScale
-                )
-
-        clock.tick(Max_FPS)
-        p.display.flip()
-
-# ------------------ ANIMATED OVERLAY ------------------
-
-def drawAnimatedEndGameText(screen, text, alpha, scale):
-
-    WIDTH, HEIGHT = screen.get_width(), screen.get_height()
-
-    # dark overlay
-    overlay = p.Surface((WIDTH, HEIGHT))
-    overlay.set_alpha(min(alpha, 180))
-    overlay.fill((0, 0, 0))
-    screen.blit(overlay, (0, 0))
-
-    # base font size
-    baseSize = int(50 * scale)
-    fontSize = min(baseSize, 80)
-
-    font = p.font.SysFont("Segoe UI", fontSize, True)
-
-    # shrink text if too wide
-    textSurface = font.render(text, True, (255, 255, 255))
-    while textSurface.get_width() > WIDTH - 40 and fontSize > 20:
-        fontSize -= 2
-        font = p.font.SysFont("Segoe UI", fontSize, True)
-        textSurface = font.render(text, True, (255, 255, 255))
-
-    textSurface.set_alpha(alpha)
-
-    textRect = textSurface.get_rect(center=(WIDTH//2, HEIGHT//2))
-    screen.blit(textSurface, textRect)
-
-    # restart text
-    smallFont = p.font.SysFont("Segoe UI", 24)
-    restartText = smallFont.render("Press R to Restart", True, (200, 200, 200))
-    restartRect = restartText.get_rect(center=(WIDTH//2, HEIGHT//2 + 60))
-    screen.blit(restartText, restartRect)
-
-# ------------------ DRAW FUNCTIONS ------------------
-
-def drawGameState(screen, gs, sqSelected, validMoves):
-    drawBoard(screen)
-    highlightSquares(screen, gs, sqSelected, validMoves)
-    drawPieces(screen, gs.board)
-
-def drawBoard(screen):
-    colors = [p.Color(240,217,181), p.Color(181,136,99)]
-    for r in range(dimension):
-        for c in range(dimension):
-            color = colors[(r+c)%2]
-            p.draw.rect(screen,color,
-                        p.Rect(c*SQ_Sizee,r*SQ_Sizee,
-                               SQ_Sizee,SQ_Sizee))
-
-def highlightSquares(screen, gs, sqSelected, validMoves):
-
-    if len(gs.moveLog) > 0:
-        lastMove = gs.moveLog[-1]
-        s = p.Surface((SQ_Sizee,SQ_Sizee))
-        s.set_alpha(100)
-        s.fill(p.Color("yellow"))
-        screen.blit(s,(lastMove.startCol*SQ_Sizee,
-                       lastMove.startRow*SQ_Sizee))
-        screen.blit(s,(lastMove.endCol*SQ_Sizee,
-                       lastMove.endRow*SQ_Sizee))
-
-    if sqSelected != ():
-        r,c = sqSelected
-        if gs.board[r][c][0] == ('w' if gs.whiteToMove else 'b'):
+                    text = "Draw by " + gs.drawReason()
+                p.display.update(renderer.drawAnimatedEndGameText(text, animationAlpha, animationScale))
+
+# ------------------ RENDERER ------------------
+
+_fonts = {}
+
+def getFont(name, size, bold=False):
+    key = (name, size, bold)
+    if key not in _fonts:
+        _fonts[key] = p.font.SysFont(name, size, bold)
+    return _fonts[key]
+
+
+class boardrenderer:
+    '''
+    draws the game with as little work per frame as possible:
+      -- the empty board is rendered once and copied from, squares are never re-filled
+      -- highlight surfaces, fonts and overlay texts are created once and cached
+      -- every square remembers what it shows (piece and highlight), a frame only redraws the
+         squares whose content changed and hands just those rects to p.display.update
+    the finished frame also lives in an off screen surface, so the end-game overlay can be
+    faded in over it without redrawing the board.
+    '''
+    def __init__(self, screen):
+        self.screen = screen
+        self.frame = p.Surface(screen.get_size())
+        self.background = p.Surface(screen.get_size())
+        colors = [p.Color(240,217,181), p.Color(181,136,99)]
+        for r in range(dimension):
+            for c in range(dimension):
+                self.background.fill(colors[(r+c)%2], squareRect(r, c))
+        self.highlights = {}
+        for kind, color, alpha in (("last", "yellow", 100), ("selected", "blue", 120), ("target", "green", 120)):
             s = p.Surface((SQ_Sizee,SQ_Sizee))
-            s.set_alpha(120)
-
-            s.fill(p.Color("blue"))
-            screen.blit(s,(c*SQ_Sizee,r*SQ_Sizee))
-
-            s.fill(p.Color("green"))
-            for move in validMoves:
-                if move.startRow == r and move.startCol == c:
-                    screen.blit(s,
-                        (move.endCol*SQ_Sizee,
-                         move.endRow*SQ_Sizee))
-
-def drawPieces(screen, board):
-    for r in range(dimension):
-        for c in range(dimension):
-            piece = board[r][c]
+            s.set_alpha(alpha)
+            s.fill(p.Color(color))
+            self.highlights[kind] = s
+        self.overlay = p.Surface(screen.get_size())
+        self.overlay.fill((0, 0, 0))
+        self.texts = {}
+        self.invalidate()
+
+    '''
+    forget what is on screen, the next draw repaints everything (after the menu, a restart
+    or an overlay)
+    '''
+    def invalidate(self):
+        self.shown = [None] * (dimension * dimension)
+        self.fullRedraw = True
+
+    '''
+    what every square should show: (piece, highlight kind or None)
+    '''
+    def squareContents(self, gs, sqSelected, validMoves):
+        marks = {}
+        if len(gs.moveLog) > 0:
+            lastMove = gs.moveLog[-1]
+            marks[(lastMove.startRow, lastMove.startCol)] = "last"
+            marks[(lastMove.endRow, lastMove.endCol)] = "last"
+        if sqSelected != ():
+            r,c = sqSelected
+            if gs.board[r][c][0] == ('w' if gs.whiteToMove else 'b'):
+                marks[(r, c)] = "selected"
+                for move in validMoves:
+                    if move.startRow == r and move.startCol == c:
+                        marks[(move.endRow, move.endCol)] = "target"
+        return [(gs.board[r][c], marks.get((r, c)))
+                for r in range(dimension) for c in range(dimension)]
+
+    '''
+    repaint the changed squares in the off screen frame and return their rects
+    '''
+    def updateFrame(self, gs, sqSelected, validMoves):
+        contents = self.squareContents(gs, sqSelected, validMoves)
+        dirty = []
+        for i, content in enumerate(contents):
+            if content == self.shown[i]:
+                continue
+            r, c = divmod(i, dimension)
+            rect = squareRect(r, c)
+            piece, mark = content
+            self.frame.blit(self.background, rect, rect)
+            if mark is not None:
+                self.frame.blit(self.highlights[mark], rect)
             if piece != "--":
-                screen.blit(image[piece],
-                    p.Rect(c*SQ_Sizee,r*SQ_Sizee,
-                           SQ_Sizee,SQ_Sizee))
+                self.frame.blit(image[piece], rect)
+            self.shown[i] = content
+            dirty.append(rect)
+        return dirty
+
+    '''
+    bring the screen up to date and return the rects that changed
+    '''
+    def drawGameState(self, gs, sqSelected, validMoves):
+        dirty = self.updateFrame(gs, sqSelected, validMoves)
+        if self.fullRedraw:
+            self.fullRedraw = False
+            self.screen.blit(self.frame, (0, 0))
+            return [self.screen.get_rect()]
+        for rect in dirty:
+            self.screen.blit(self.frame, rect, rect)
+        return dirty
+
+    def renderText(self, text, fontName, size, color, bold=True):
+        key = (text, fontName, size, color, bold)
+        if key not in self.texts:
+            self.texts[key] = getFont(fontName, size, bold).render(text, True, color)
+        return self.texts[key]
+
+    '''
+    the end-game text faded in over the board, the whole screen changes so it is returned
+    as one rect
+    '''
+    def drawAnimatedEndGameText(self, text, alpha, scale):
+        WIDTH, HEIGHT = self.screen.get_width(), self.screen.get_height()
+        self.screen.blit(self.frame, (0, 0))
+
+        # dark overlay
+        self.overlay.set_alpha(min(alpha, 180))
+        self.screen.blit(self.overlay, (0, 0))
+
+        # base font size, shrunk if the text is too wide
+        fontSize = min(int(50 * scale), 80)
+        textSurface = self.renderText(text, "Segoe UI", fontSize, (255, 255, 255))
+        while textSurface.get_width() > WIDTH - 40 and fontSize > 20:
+            fontSize -= 2
+            textSurface = self.renderText(text, "Segoe UI", fontSize, (255, 255, 255))
+
+        textSurface.set_alpha(alpha)
+        textRect = textSurface.get_rect(center=(WIDTH//2, HEIGHT//2))
+        self.screen.blit(textSurface, textRect)
+
+        # restart text
+        restartText = self.renderText("Press R to Restart", "Segoe UI", 24, (200, 200, 200), False)
+        restartRect = restartText.get_rect(center=(WIDTH//2, HEIGHT//2 + 60))
+        self.screen.blit(restartText, restartRect)
+        self.fullRedraw = True # the overlay covers the board until the next full copy
+        return [self.screen.get_rect()]
+
+
+def squareRect(r, c):
+    return p.Rect(c*SQ_Sizee, r*SQ_Sizee, SQ_Sizee, SQ_Sizee)
+
+
+'''
+block until something happens (at most timeout ms when given) and return the events,
+so an idle window costs no CPU
+'''
+def waitForEvents(timeout=None):
+    first = p.event.wait(timeout) if timeout else p.event.wait()
+    events = [first] + p.event.get()
+    return [e for e in events if e.type != p.NOEVENT]
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,160 @@
+'''
+multi-core search: the legal root moves are split across a pool of worker processes and
+every worker runs the normal iterative deepening search (chess_search.searcher) on its
+share. workers start from gamestate.snapshot() (starting FEN and the moveIDs
+played), never from a pickled gamestate, and send back plain data.
+
+the scores of different workers are only comparable at the same depth, so the merged
+result is taken at the deepest iteration every worker completed.
+
+  python chess_parallel.py --workers 8 --time 5
+  python chess_parallel.py --fen "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w" --compare
+'''
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import chess_engine
+import chess_search
+
+
+'''
+runs in the worker process: rebuild the game, search only the given root moves and
+return every completed iteration as (depth, score, pv moveIDs, nodes so far)
+'''
+def searchRootMoves(snapshot, rootMoveIDs, maxDepth, timeLimit, nodeLimit, ttSizeMB):
+    gs = chess_engine.gamestate.fromSnapshot(snapshot)
+    rootMoves = [chess_engine.move.fromMoveID(moveID, gs.board) for moveID in rootMoveIDs]
+    iterations = []
+
+    def record(result):
+        iterations.append((result.depth, result.score, [m.moveID for m in result.pv], result.nodes))
+
+    searcher = chess_search.searcher(chess_search.transpositiontable(ttSizeMB))
+    result = searcher.search(gs, maxDepth, timeLimit, nodeLimit, callback=record, rootMoves=rootMoves)
+    return {"pid": os.getpid(), "iterations": iterations, "nodes": result.nodes,
+            "seconds": result.seconds}
+
+
+class parallelresult(chess_search.searchresult):
+    def __init__(self, bestMove, score, depth, nodes, pv, seconds, workers):
+        super().__init__(bestMove, score, depth, nodes, pv, seconds)
+        self.workers = workers # per worker dict: pid, moves, depth, nodes, seconds, nps
+
+    def nodesPerSecond(self):
+        return int(self.nodes / self.seconds) if self.seconds > 0 else 0
+
+
+'''
+search gs with its root moves divided between workers processes and return a parallelresult.
+pass an existing ProcessPoolExecutor as pool to reuse warm workers between moves.
+'''
+def parallelSearch(gs, workers=None, maxDepth=None, timeLimit=None, nodeLimit=None, ttSizeMB=16,
+                   pool=None):
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    moves = gs.getValidMoves()
+    if len(moves) == 0:
+        return parallelresult(None, 0, 0, 0, [], 0.0, [])
+
+    # captures first, then deal the moves out so every worker gets a mix of both
+    moves.sort(key=lambda m: chess_engine.captureOrder(m) if m.pieceCaptured != "--"
+               else -chess_search.INFINITY, reverse=True)
+    shares = [moves[i::workers] for i in range(min(workers, len(moves)))]
+    snapshot = gs.snapshot()
+    perWorkerNodes = nodeLimit // len(shares) if nodeLimit is not None else None
+
+    ownPool = pool is None
+    if ownPool:
+        pool = ProcessPoolExecutor(max_workers=len(shares))
+    try:
+        futures = [pool.submit(searchRootMoves, snapshot, [m.moveID for m in share], maxDepth,
+                               timeLimit, perWorkerNodes, ttSizeMB)
+                   for share in shares]
+        reports = [f.result() for f in futures]
+    finally:
+        if ownPool:
+            pool.shutdown()
+
+    # a worker that stopped on a mate score is final: its last iteration stands for every
+    # deeper depth, so it must not hold the merge back at its shallow depth
+    def completeDepth(iterations):
+        if not iterations:
+            return 0
+        depth, score = iterations[-1][:2]
+        return chess_search.INFINITY if abs(score) > chess_search.MATE_BOUND else depth
+
+    commonDepth = min(completeDepth(r["iterations"]) for r in reports)
+    if commonDepth == chess_search.INFINITY: # every worker found a mate
+        commonDepth = max(r["iterations"][-1][0] for r in reports)
+    best = None
+    for report in reports:
+        candidates = [(score, pv) for depth, score, pv, _ in report["iterations"] if depth == commonDepth]
+        if not candidates and report["iterations"] and report["iterations"][-1][0] < commonDepth:
+            candidates = [tuple(report["iterations"][-1][1:3])] # stopped early on a mate
+        for score, pv in candidates:
+            if best is None or score > best[0]:
+                best = (score, pv)
+
+    workerStats = []
+    for share, report in zip(shares, reports):
+        seconds = report["seconds"]
+        workerStats.append({
+            "pid": report["pid"],
+            "moves": [m.getChessNotation() for m in share],
+            "depth": report["iterations"][-1][0] if report["iterations"] else 0,
+            "nodes": report["nodes"],
+            "seconds": seconds,
+            "nps": int(report["nodes"] / seconds) if seconds > 0 else 0,
+        })
+
+    nodes = sum(r["nodes"] for r in reports)
+    if best is None: # not even depth 1 finished everywhere, fall back to the ordering
+        return parallelresult(moves[0], 0, 0, nodes, moves[:1], time.perf_counter() - start,
+                              workerStats)
+    pv = []
+    replay = chess_engine.gamestate.fromSnapshot(snapshot)
+    for moveID in best[1]:
+        m = chess_engine.move.fromMoveID(moveID, replay.board)
+        pv.append(m)
+        replay.makeMove(m)
+    return parallelresult(pv[0], best[0], commonDepth, nodes, pv, time.perf_counter() - start,
+                          workerStats)
+
+
+def main(argv=None):
+    import chess_perft
+
+    parser = argparse.ArgumentParser(description="parallel root split search")
+    parser.add_argument("--fen", default=chess_perft.referencePositions["startpos"][0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--time", type=float, default=5.0, help="seconds per search")
+    parser.add_argument("--depth", type=int, help="maximum depth")
+    parser.add_argument("--compare", action="store_true",
+                        help="also run a single process search with the same budget and report the speedup")
+    args = parser.parse_args(argv)
+
+    gs = chess_perft.loadPosition(args.fen)
+    result = parallelSearch(gs, args.workers, args.depth, args.time)
+    print("best %s  score %d  depth %d  nodes %d  %.2fs  %d nps" % (
+        result.bestMove.getChessNotation(), result.score, result.depth, result.nodes,
+        result.seconds, result.nodesPerSecond()))
+    print("pv " + " ".join(m.getChessNotation() for m in result.pv))
+    for w in result.workers:
+        print("  worker %d  depth %2d  %9d nodes  %8d nps  %s" % (
+            w["pid"], w["depth"], w["nodes"], w["nps"], " ".join(w["moves"])))
+
+    if args.compare:
+        serial = chess_search.search(gs, maxDepth=args.depth, timeLimit=args.time)
+        serialNps = serial.nodes / serial.seconds if serial.seconds > 0 else 0
+        print("single process: best %s  depth %d  %d nps" % (
+            serial.bestMove.getChessNotation(), serial.depth, serialNps))
+        if serialNps > 0:
+            print("speedup %.2fx nodes per second with %d workers" % (
+                result.nodesPerSecond() / serialNps, len(result.workers)))
+
+
+if __name__ == "__main__":
+    main()
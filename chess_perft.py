@@ -0,0 +1,189 @@
+'''
+perft: walk the legal move tree to a fixed depth and count the leaves.
+the counts are a correctness oracle (they must match the published reference numbers)
+and the timing is a throughput baseline for getValidMoves / makeMove / undoMove.
+
+only the engine modules are imported, never pygame, so this runs on headless boxes.
+
+  python chess_perft.py                         # every reference position, depth 3
+  python chess_perft.py --position kiwipete -d 2 --divide
+  python chess_perft.py --fen "8/8/8/8/8/8/8/K6k w - - 0 1" -d 4
+  python chess_perft.py --engine bitboard --json perft.json
+'''
+
+import argparse
+import json
+import sys
+import time
+
+import chess_bitboard
+import chess_engine
+
+# name -> (fen, node counts for depth 1, 2, 3, ...)
+referencePositions = {
+    "startpos": ("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+                 (20, 400, 8902, 197281, 4865609, 119060324)),
+    "kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                 (48, 2039, 97862, 4085603, 193690690)),
+    "position3": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+                  (14, 191, 2812, 43238, 674624, 11030083)),
+    "position4": ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+                  (6, 264, 9467, 422333, 15833292)),
+    "position5": ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+                  (44, 1486, 62379, 2103487, 89941194)),
+    "position6": ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+                  (46, 2079, 89890, 3894594, 164075551)),
+}
+
+engines = {
+    "gamestate": chess_engine.gamestate,
+    "bitboard": chess_bitboard.bitboardstate,
+}
+
+'''
+build an engine of the given kind at the position described by fen
+'''
+def loadPosition(fen, engine="gamestate"):
+    if engine == "gamestate":
+        return chess_engine.gamestate.from_fen(fen)
+    gs = engines[engine]()
+    gs.setBoard(*chess_engine.parseFen(fen))
+    return gs
+
+
+'''
+number of leaf nodes depth plies below the current position (bulk counted at depth 1).
+the bitboard engine runs its own perft on packed move codes (push / pop), the path its
+speed is meant to be measured on, instead of going through move objects.
+'''
+def perft(gs, depth):
+    if isinstance(gs, chess_bitboard.bitboardstate):
+        return gs.perft(depth)
+    if depth == 0:
+        return 1
+    moves = gs.getValidMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for m in moves:
+        gs.makeMove(m)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+
+'''
+perft split by root move, returns a list of (move notation, nodes)
+'''
+def divide(gs, depth):
+    results = []
+    if isinstance(gs, chess_bitboard.bitboardstate):
+        for code in gs.generateLegal():
+            notation = chess_engine.move.fromMoveID(code, gs.board).getChessNotation()
+            record = gs.push(code)
+            results.append((notation, gs.perft(depth - 1)))
+            gs.pop(code, record)
+        return results
+    for m in gs.getValidMoves():
+        gs.makeMove(m)
+        results.append((m.getChessNotation(), perft(gs, depth - 1)))
+        gs.undoMove()
+    return results
+
+
+'''
+run one position to every depth from 1 to depth and return a result dict
+'''
+def runPosition(name, fen, depth, expected=(), engine="gamestate", showDivide=False):
+    result = {"name": name, "fen": fen, "engine": engine, "depths": []}
+    for d in range(1, depth + 1):
+        gs = loadPosition(fen, engine)
+        entry = {"depth": d}
+        start = time.perf_counter()
+        try:
+            if showDivide and d == depth:
+                split = divide(gs, d)
+                entry["divide"] = dict(split)
+                nodes = sum(n for _, n in split)
+            else:
+                nodes = perft(gs, d)
+        except Exception as e: # report the failure and keep going with the other positions
+            entry["error"] = "%s: %s" % (type(e).__name__, e)
+            result["depths"].append(entry)
+            break
+        elapsed = time.perf_counter() - start
+        entry["nodes"] = nodes
+        entry["seconds"] = round(elapsed, 6)
+        entry["nps"] = int(nodes / elapsed) if elapsed > 0 else 0
+        if d <= len(expected):
+            entry["expected"] = expected[d - 1]
+            entry["ok"] = nodes == expected[d - 1]
+        result["depths"].append(entry)
+    return result
+
+
+def printResult(result, out=sys.stdout):
+    print("%s  [%s]  %s" % (result["name"], result["engine"], result["fen"]), file=out)
+    for entry in result["depths"]:
+        if "divide" in entry:
+            for notation, nodes in sorted(entry["divide"].items()):
+                print("    %s: %d" % (notation, nodes), file=out)
+        if "error" in entry:
+            print("  depth %d  ERROR %s" % (entry["depth"], entry["error"]), file=out)
+            continue
+        status = ""
+        if "expected" in entry:
+            status = "ok" if entry["ok"] else "MISMATCH (expected %d)" % entry["expected"]
+        print("  depth %d  %12d nodes  %9.3fs  %10d nps  %s" % (
+            entry["depth"], entry["nodes"], entry["seconds"], entry["nps"], status), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="perft node counts and move generation speed")
+    parser.add_argument("-d", "--depth", type=int, default=3)
+    parser.add_argument("--position", action="append", choices=sorted(referencePositions),
+                        help="reference position to run (repeatable, default all)")
+    parser.add_argument("--fen", help="run a custom position instead of the reference set")
+    parser.add_argument("--engine", choices=sorted(engines), default="gamestate")
+    parser.add_argument("--divide", action="store_true", help="print node counts per root move")
+    parser.add_argument("--json", metavar="PATH", help="write results as JSON ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    if args.fen:
+        jobs = [("custom", args.fen, ())]
+    else:
+        names = args.position or list(referencePositions)
+        jobs = [(name,) + referencePositions[name] for name in names]
+
+    results = []
+    for name, fen, expected in jobs:
+        result = runPosition(name, fen, args.depth, expected, args.engine, args.divide)
+        results.append(result)
+        if args.json != '-':
+            printResult(result)
+
+    totalNodes = sum(e.get("nodes", 0) for r in results for e in r["depths"])
+    totalTime = sum(e.get("seconds", 0) for r in results for e in r["depths"])
+    summary = {
+        "engine": args.engine,
+        "depth": args.depth,
+        "nodes": totalNodes,
+        "seconds": round(totalTime, 6),
+        "nps": int(totalNodes / totalTime) if totalTime > 0 else 0,
+        "passed": all(e.get("ok", True) and "error" not in e for r in results for e in r["depths"]),
+        "positions": results,
+    }
+    if args.json == '-':
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+    else:
+        print("total %d nodes in %.3fs, %d nps, %s" % (
+            totalNodes, totalTime, summary["nps"], "all ok" if summary["passed"] else "FAILED"))
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(summary, f, indent=2)
+    return 0 if summary["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+'''
+PGN support for the engine: standard algebraic notation (SAN) against a gamestate and a
+streaming reader that yields one game at a time, so huge PGN files never sit in memory.
+'''
+
+import re
+
+import chess_engine
+
+sanPattern = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(=?[NBRQ])?$")
+resultTokens = ("1-0", "0-1", "1/2-1/2", "*")
+tagOrder = ("Event", "Site", "Date", "Round", "White", "Black", "Result") # the seven tag roster
+
+
+'''
+the legal move in gs written as san (e4, Nbd7, exd5, ...), raises ValueError if there is none
+'''
+def parseSan(gs, san):
+    text = san.rstrip("+#!?")
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        endCol = 6 if text in ("O-O", "0-0") else 2
+        for m in gs.getValidMoves():
+            if m.isCastleMove and m.endCol == endCol:
+                return m
+        raise ValueError("no legal move for " + san)
+    match = sanPattern.match(text)
+    if match is None:
+        raise ValueError("not a SAN move: " + san)
+    pieceType, fromFile, fromRank, target, promotion = match.groups()
+    promotion = promotion[-1] if promotion else None
+    pieceType = pieceType or 'p'
+    endRow = chess_engine.move.ranksToRows[target[1]]
+    endCol = chess_engine.move.filesToCols[target[0]]
+
+    candidates = []
+    for m in gs.getValidMoves():
+        if m.pieceMoved[1] != pieceType or m.endRow != endRow or m.endCol != endCol or \
+                m.promotionChoice != promotion or m.isCastleMove:
+            continue
+        if fromFile and m.startCol != chess_engine.move.filesToCols[fromFile]:
+            continue
+        if fromRank and m.startRow != chess_engine.move.ranksToRows[fromRank]:
+            continue
+        candidates.append(m)
+    if len(candidates) != 1:
+        raise ValueError("%s move for %s" % ("ambiguous" if candidates else "no legal", san))
+    return candidates[0]
+
+
+'''
+the legal move m in gs written as san, gs is positioned before the move and left unchanged
+'''
+def toSan(gs, m):
+    target = m.getRankFile(m.endRow, m.endCol)
+    if m.isCastleMove:
+        san = "O-O" if m.endCol == 6 else "O-O-O"
+    elif m.pieceMoved[1] == 'p':
+        san = (m.getRankFile(m.startRow, m.startCol)[0] + "x" + target) \
+            if m.pieceCaptured != "--" else target
+        if m.isPawnPromotion:
+            san += "=" + m.promotionChoice
+    else:
+        san = m.pieceMoved[1]
+        rivals = [o for o in gs.getValidMoves() if o.pieceMoved == m.pieceMoved and o != m
+                  and o.endRow == m.endRow and o.endCol == m.endCol]
+        if rivals:
+            square = m.getRankFile(m.startRow, m.startCol)
+            if all(o.startCol != m.startCol for o in rivals):
+                san += square[0]
+            elif all(o.startRow != m.startRow for o in rivals):
+                san += square[1]
+            else:
+                san += square
+        san += ("x" if m.pieceCaptured != "--" else "") + target
+    gs.makeMove(m)
+    if gs.inCheck():
+        san += "+" if gs.hasLegalMove() else "#"
+    gs.undoMove()
+    return san
+
+
+'''
+one game as PGN text: the seven tag roster first, then any other tags, then the movetext
+wrapped at 80 columns and closed by the result
+'''
+def formatGame(headers, sanMoves, result):
+    headers = dict(headers, Result=result)
+    names = [t for t in tagOrder if t in headers] + [t for t in headers if t not in tagOrder]
+    lines = ['[%s "%s"]' % (t, str(headers[t]).replace('"', "'")) for t in names]
+    lines.append("")
+    tokens = []
+    for ply, san in enumerate(sanMoves):
+        tokens.append(("%d. %s" % (ply // 2 + 1, san)) if ply % 2 == 0 else san)
+    tokens.append(result)
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 80:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n\n"
+
+
+class pgngame:
+    def __init__(self, headers, moves, result):
+        self.headers = headers # tag pairs, e.g. {"White": ..., "Result": "1-0"}
+        self.moves = moves # SAN strings of the main line
+        self.result = result # "1-0", "0-1", "1/2-1/2" or "*"
+
+    '''
+    yield (gamestate, move) for every move of the main line, with gs positioned before the
+    move is made; stops quietly at the first move the engine cannot play
+    '''
+    def replay(self, gs=None):
+        gs = gs if gs is not None else chess_engine.gamestate()
+        for san in self.moves:
+            try:
+                m = parseSan(gs, san)
+            except ValueError:
+                return
+            yield gs, m
+            gs.makeMove(m)
+
+
+def _movetext(text):
+    '''
+    strip comments, variations and annotations and split the rest into SAN tokens
+    '''
+    text = re.sub(r"\{[^}]*\}", " ", text)
+    text = re.sub(r";[^\n]*", " ", text)
+    while "(" in text: # variations can nest, remove the innermost ones first
+        stripped = re.sub(r"\([^()]*\)", " ", text)
+        if stripped == text:
+            break
+        text = stripped
+    tokens = []
+    for token in text.split():
+        token = re.sub(r"^\d+\.+", "", token) # move numbers, also glued to the move: 1.e4
+        if not token or token.startswith("$") or token in resultTokens:
+            continue
+        tokens.append(token)
+    return tokens
+
+
+'''
+read games one at a time from an open text file (or any iterable of lines)
+'''
+def readGames(lines):
+    headers = {}
+    movetext = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith("["):
+            if movetext: # a tag after movetext starts the next game
+                yield _finishGame(headers, movetext)
+                headers, movetext = {}, []
+            match = re.match(r'\[(\w+)\s+"(.*)"\]', line)
+            if match:
+                headers[match.group(1)] = match.group(2)
+        elif line:
+            movetext.append(line)
+    if headers or movetext:
+        yield _finishGame(headers, movetext)
+
+
+def _finishGame(headers, movetext):
+    text = " ".join(movetext)
+    result = headers.get("Result", "*")
+    for token in resultTokens:
+        if text.rstrip().endswith(token):
+            result = token
+            break
+    return pgngame(headers, _movetext(text), result)
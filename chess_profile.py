@@ -0,0 +1,337 @@
+'''
+opt-in instrumentation of the engine hot paths.
+
+while disabled nothing is patched: gamestate, searcher and transpositiontable run their
+plain methods and pay nothing, so this module can ship in every build. enable() swaps the
+hot methods on the classes for counting / timing wrappers, disable() puts the originals back.
+
+  counters   nodes and quiescence nodes searched, moves generated per piece type (full
+             generation, the capture stage and the legal-move queries), attack queries
+             (isSquareAttacked, which squareUnderAttack goes through), transposition table
+             probes and hits
+  timers     calls and total seconds of getValidMoves, the staged generators (iterMoves,
+             getCaptureMoves, iterLegalByPiece; generators are timed only while they run,
+             nested calls are included in their caller), makeMove, undoMove and evaluate
+  sampling   cProfile around any block, or a sampling thread that records stacks in the
+             folded format flamegraph.pl / speedscope read
+
+snapshot() returns everything as a dict, toJson / toPrometheus render it.
+to turn it on in a running process: CHESS_PROFILE=1 in the environment when this module is
+imported, or installSignalHandlers() (SIGUSR1 toggles, SIGUSR2 writes a snapshot).
+
+  python chess_profile.py --depth 4
+  python chess_profile.py --fen "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1" \
+      --time 5 --format prometheus --folded search.folded --cprofile search.prof
+'''
+
+import argparse
+import contextlib
+import cProfile
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+import chess_engine
+import chess_search
+
+pieceTypes = {'p': "pawn", 'N': "knight", 'B': "bishop", 'R': "rook", 'Q': "queen", 'K': "king"}
+counterNames = ("nodes", "quiescenceNodes", "attackQueries", "ttProbes", "ttHits")
+timerNames = ("getValidMoves", "iterMoves", "getCaptureMoves", "iterLegalByPiece", "makeMove", "undoMove",
+              "evaluate")
+generatorNames = ("iterMoves", "iterLegalByPiece") # timed while they run, not while the consumer does
+
+counters = dict.fromkeys(counterNames, 0)
+movesGenerated = dict.fromkeys(pieceTypes.values(), 0)
+timers = {name: [0, 0] for name in timerNames} # name -> [calls, nanoseconds]
+_originals = [] # (class, attribute, original function) while enabled
+_since = time.time()
+
+
+def _counting(name, function):
+    def wrapper(*args, **kwargs):
+        counters[name] += 1
+        return function(*args, **kwargs)
+    return wrapper
+
+
+def _timing(name, function):
+    timer = timers[name]
+    clock = time.perf_counter_ns
+
+    def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timer[0] += 1
+            timer[1] += clock() - start
+    return wrapper
+
+
+def _timingGenerator(name, function):
+    timer = timers[name]
+    clock = time.perf_counter_ns
+
+    def wrapper(*args, **kwargs):
+        timer[0] += 1
+        generator = function(*args, **kwargs)
+        while True:
+            start = clock()
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+            finally:
+                timer[1] += clock() - start
+            yield item
+    return wrapper
+
+
+def _countingMoves(function):
+    def wrapper(*args, **kwargs):
+        moves = function(*args, **kwargs)
+        for m in moves:
+            movesGenerated[pieceTypes[m.pieceMoved[1]]] += 1
+        return moves
+    return wrapper
+
+
+def _countingMovesGenerator(function):
+    def wrapper(*args, **kwargs):
+        for m in function(*args, **kwargs):
+            movesGenerated[pieceTypes[m.pieceMoved[1]]] += 1
+            yield m
+    return wrapper
+
+
+def _countingProbes(function):
+    def wrapper(self, key):
+        counters["ttProbes"] += 1
+        entry = function(self, key)
+        if entry is not None:
+            counters["ttHits"] += 1
+        return entry
+    return wrapper
+
+
+def _wrappers():
+    gamestate, searcher = chess_engine.gamestate, chess_search.searcher
+    yield searcher, "negamax", lambda f: _counting("nodes", f)
+    yield searcher, "quiescence", lambda f: _counting("quiescenceNodes", f)
+    yield chess_search.transpositiontable, "probe", _countingProbes
+    yield gamestate, "getAllPossibleMoves", _countingMoves
+    yield gamestate, "isSquareAttacked", lambda f: _counting("attackQueries", f)
+    # the staged generators the search uses: captures are counted where they are generated,
+    # the legal-move queries (hasLegalMove, countLegalMoves) per move they produce
+    yield gamestate, "getCaptureMoves", _countingMoves
+    yield gamestate, "iterLegalByPiece", _countingMovesGenerator
+    for name in timerNames:
+        if name in generatorNames:
+            yield gamestate, name, lambda f, name=name: _timingGenerator(name, f)
+        else:
+            yield gamestate, name, lambda f, name=name: _timing(name, f)
+
+
+def enabled():
+    return bool(_originals)
+
+
+def enable():
+    if _originals:
+        return
+    for cls, name, wrap in _wrappers():
+        original = cls.__dict__[name]
+        _originals.append((cls, name, original))
+        setattr(cls, name, wrap(original))
+
+
+def disable():
+    while _originals:
+        cls, name, original = _originals.pop()
+        setattr(cls, name, original)
+
+
+def reset():
+    global _since
+    for table in (counters, movesGenerated):
+        for name in table:
+            table[name] = 0
+    for timer in timers.values():
+        timer[0] = timer[1] = 0
+    _since = time.time()
+
+
+'''
+the current numbers as a plain dict (safe to json.dumps)
+'''
+def snapshot():
+    return {
+        "enabled": enabled(),
+        "pid": os.getpid(),
+        "seconds": time.time() - _since,
+        "counters": dict(counters),
+        "movesGenerated": dict(movesGenerated),
+        "timers": {name: {"calls": calls, "seconds": ns / 1e9} for name, (calls, ns) in timers.items()},
+    }
+
+
+def toJson(snap=None):
+    return json.dumps(snapshot() if snap is None else snap, indent=2)
+
+
+'''
+the snapshot in the Prometheus text exposition format
+'''
+def toPrometheus(snap=None):
+    snap = snapshot() if snap is None else snap
+    lines = ["# TYPE chess_profile_enabled gauge",
+             "chess_profile_enabled %d" % snap["enabled"]]
+    for name, value in snap["counters"].items():
+        metric = "chess_" + "".join("_" + ch.lower() if ch.isupper() else ch for ch in name) + "_total"
+        lines += ["# TYPE %s counter" % metric, "%s %d" % (metric, value)]
+    lines.append("# TYPE chess_moves_generated_total counter")
+    for piece, value in snap["movesGenerated"].items():
+        lines.append('chess_moves_generated_total{piece="%s"} %d' % (piece, value))
+    lines.append("# TYPE chess_function_calls_total counter")
+    for name, timer in snap["timers"].items():
+        lines.append('chess_function_calls_total{function="%s"} %d' % (name, timer["calls"]))
+    lines.append("# TYPE chess_function_seconds_total counter")
+    for name, timer in snap["timers"].items():
+        lines.append('chess_function_seconds_total{function="%s"} %.6f' % (name, timer["seconds"]))
+    return "\n".join(lines) + "\n"
+
+
+class cprofiler:
+    '''
+    cProfile around a block, the stats are written to path on exit (read them with pstats
+    or snakeviz)
+
+        with chess_profile.cprofiler("search.prof"):
+            searcher.search(gs, maxDepth=5)
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.profile = cProfile.Profile()
+
+    def __enter__(self):
+        self.profile.enable()
+        return self.profile
+
+    def __exit__(self, *exc):
+        self.profile.disable()
+        self.profile.dump_stats(self.path)
+
+
+class stacksampler:
+    '''
+    samples the stack of one thread (default: the thread that creates the sampler) every
+    interval seconds from a background thread and counts identical stacks. write() saves
+    them in the folded format: "frame;frame;frame count" per line, outermost frame first.
+    '''
+    def __init__(self, interval=0.001, threadId=None):
+        self.interval = interval
+        self.threadId = threading.get_ident() if threadId is None else threadId
+        self.stacks = {}
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.threadId)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                if code.co_name != "wrapper" or code.co_filename != __file__: # hide our own wrappers
+                    stack.append("%s:%s" % (os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as out:
+            for stack, count in sorted(self.stacks.items()):
+                out.write("%s %d\n" % (stack, count))
+
+
+'''
+SIGUSR1 toggles the instrumentation, SIGUSR2 writes the snapshot as JSON to path
+(the pid is filled in for "%d"). POSIX only, must be called from the main thread.
+'''
+def installSignalHandlers(path="chess_profile.%d.json"):
+    def toggle(signum, frame):
+        if enabled():
+            disable()
+        else:
+            reset()
+            enable()
+
+    def dump(signum, frame):
+        with open(path % os.getpid() if "%d" in path else path, "w", encoding="utf-8") as out:
+            out.write(toJson())
+
+    signal.signal(signal.SIGUSR1, toggle)
+    signal.signal(signal.SIGUSR2, dump)
+
+
+if os.environ.get("CHESS_PROFILE", "") not in ("", "0"):
+    enable()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="search one position with instrumentation on")
+    parser.add_argument("--fen", default=chess_engine.startFen)
+    parser.add_argument("--depth", type=int, help="search to this depth")
+    parser.add_argument("--time", type=float, help="search for this many seconds")
+    parser.add_argument("--format", choices=("json", "prometheus"), default="json")
+    parser.add_argument("--cprofile", help="also write cProfile stats to this file")
+    parser.add_argument("--folded", help="also write sampled stacks (flamegraph input) to this file")
+    args = parser.parse_args(argv)
+    if args.depth is None and args.time is None:
+        args.depth = 4
+
+    gs = chess_engine.gamestate.from_fen(args.fen)
+    searcher = chess_search.searcher(chess_search.transpositiontable(16))
+    sampler = stacksampler() if args.folded else None
+    reset()
+    enable()
+    try:
+        with contextlib.ExitStack() as stack:
+            if sampler is not None:
+                stack.enter_context(sampler)
+            if args.cprofile:
+                stack.enter_context(cprofiler(args.cprofile))
+            result = searcher.search(gs, maxDepth=args.depth, timeLimit=args.time)
+        snap = snapshot() # while still enabled, so the export says so
+    finally:
+        disable()
+    if sampler is not None:
+        sampler.write(args.folded)
+    sys.stderr.write("%s\n" % (result,))
+    sys.stdout.write(toJson(snap) + "\n" if args.format == "json" else toPrometheus(snap))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,386 @@
+'''
+search support for the AI, built on chess_engine.gamestate.
+
+  -- transpositiontable : fixed size, memory budgeted table keyed on gamestate.zobristKey
+  -- searcher            : iterative deepening negamax alpha-beta with quiescence
+  -- search()            : one call returning best move, score, depth reached and nodes
+'''
+
+import time
+from array import array
+
+import chess_engine
+
+# bound types stored with every entry
+EXACT, LOWERBOUND, UPPERBOUND = 0, 1, 2
+
+
+class transpositiontable:
+    '''
+    one slot per index, the index is the low bits of the zobrist key and the full key is
+    kept to reject collisions. entries live in parallel typed arrays instead of python
+    objects, so the memory cost is fixed up front at about entrySize bytes per slot:
+      key (8) + best moveID (2) + score (4) + depth (1) + bound and generation (1)
+    replacement: an empty slot, the same position, an entry from an older search or a
+    search at least as deep always wins the slot, otherwise the deeper entry is kept.
+    '''
+    entrySize = 16
+
+    def __init__(self, sizeMB=16):
+        slots = max(1, sizeMB * 1024 * 1024 // self.entrySize)
+        self.size = 1 << (slots.bit_length() - 1) # round down to a power of two for masking
+        self.mask = self.size - 1
+        self.clear()
+
+    def clear(self):
+        self.keys = array('Q', bytes(8 * self.size))
+        self.moves = array('H', bytes(2 * self.size))
+        self.scores = array('i', bytes(4 * self.size))
+        self.depths = array('b', bytes(self.size))
+        self.flags = array('B', bytes(self.size)) # bound | generation << 2
+        self.generation = 0
+        self.used = 0
+        self.resetStats()
+
+    def resetStats(self):
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.replacements = 0 # a different position was evicted
+
+    '''
+    start of a new search, older entries become preferred for replacement
+    '''
+    def newSearch(self):
+        self.generation = (self.generation + 1) & 63
+
+    '''
+    return (depth, score, bound, moveID) for key, or None when the position is not stored
+    '''
+    def probe(self, key):
+        self.probes += 1
+        i = key & self.mask
+        if self.keys[i] != key:
+            return None
+        self.hits += 1
+        flag = self.flags[i]
+        return self.depths[i], self.scores[i], flag & 3, self.moves[i]
+
+    def store(self, key, depth, score, bound, moveID=0):
+        i = key & self.mask
+        storedKey = self.keys[i]
+        self.stores += 1
+        if storedKey == key:
+            if moveID == 0:
+                moveID = self.moves[i] # keep the old best move if this search found none
+        elif storedKey != 0:
+            if self.flags[i] >> 2 == self.generation and self.depths[i] > depth:
+                return # a deeper result from this search is worth more
+            self.replacements += 1
+        else:
+            self.used += 1
+        self.keys[i] = key
+        self.moves[i] = moveID
+        self.scores[i] = score
+        self.depths[i] = max(-128, min(127, depth))
+        self.flags[i] = bound | self.generation << 2
+
+    '''
+    permille of slots in use
+    '''
+    def hashfull(self):
+        return self.used * 1000 // self.size
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "megabytes": self.size * self.entrySize / (1024 * 1024),
+            "probes": self.probes,
+            "hits": self.hits,
+            "misses": self.probes - self.hits,
+            "hitRate": self.hits / self.probes if self.probes else 0.0,
+            "stores": self.stores,
+            "replacements": self.replacements,
+            "hashfull": self.hashfull(),
+        }
+
+
+# ------------------ SCORES ------------------
+
+MATE = 100000
+MATE_BOUND = MATE - 1000 # any score beyond this is a forced mate
+INFINITY = MATE + 1
+
+
+# ------------------ SEARCH ------------------
+
+class searchresult:
+    def __init__(self, bestMove, score, depth, nodes, pv, seconds):
+        self.bestMove = bestMove
+        self.score = score
+        self.depth = depth # last fully completed iteration
+        self.nodes = nodes
+        self.pv = pv # principal variation as a list of moves, starting with bestMove
+        self.seconds = seconds
+
+    def __repr__(self):
+        return "searchresult(bestMove=%r, score=%d, depth=%d, nodes=%d, pv=%s)" % (
+            self.bestMove, self.score, self.depth, self.nodes,
+            " ".join(m.getChessNotation() for m in self.pv))
+
+
+class searchstopped(Exception):
+    '''
+    raised inside the tree when the time or node budget runs out, or when stopped from outside
+    '''
+
+
+class searcher:
+    '''
+    negamax alpha-beta with iterative deepening, principal variation tracking, a
+    transposition table, MVV-LVA / killer / history move ordering and a capture-only
+    quiescence search. one searcher can be reused between moves so the table and the
+    history survive. with a chess_tablebase.tablebase, three piece endings below the root
+    are scored exactly from the tables instead of being searched.
+    '''
+    maxPly = 64
+    checkEvery = 256 # nodes between budget checks
+
+    def __init__(self, tt=None, tablebase=None):
+        self.tt = tt if tt is not None else transpositiontable()
+        self.tablebase = tablebase
+        self.history = [0] * 4096 # butterfly table indexed by start | end << 6
+        self.stopEvent = None
+
+    '''
+    search gs and return a searchresult.
+    stops at maxDepth, after timeLimit seconds, after nodeLimit nodes or when stopEvent
+    (anything with is_set()) is set, whichever comes first. the result always holds the
+    best move of the deepest completed iteration. callback(result) is called after every
+    completed iteration. rootMoves restricts the search to a subset of the legal moves.
+    gs is returned to the position it was given in.
+    '''
+    def search(self, gs, maxDepth=None, timeLimit=None, nodeLimit=None, stopEvent=None,
+               callback=None, rootMoves=None):
+        start = time.perf_counter()
+        self.deadline = start + timeLimit if timeLimit is not None else None
+        self.nodeLimit = nodeLimit
+        self.stopEvent = stopEvent
+        self.nodes = 0
+        self.killers = [[0, 0] for _ in range(self.maxPly + 1)]
+        self.pvTable = [[] for _ in range(self.maxPly + 1)]
+        self.tt.newSearch()
+        maxDepth = maxDepth if maxDepth is not None else self.maxPly
+        checkMate, staleMate = gs.checkMate, gs.staleMate
+
+        moves = gs.getValidMoves()
+        if rootMoves is not None:
+            allowed = set(rootMoves)
+            moves = [m for m in moves if m in allowed]
+        result = searchresult(moves[0] if moves else None, 0, 0, 0, moves[:1], 0.0)
+        if not moves or (len(moves) == 1 and rootMoves is None): # nothing to choose between
+            gs.checkMate, gs.staleMate = checkMate, staleMate
+            result.seconds = time.perf_counter() - start
+            return result
+
+        logLength = len(gs.moveLog)
+        for depth in range(1, maxDepth + 1):
+            try:
+                score = self.searchRoot(gs, moves, depth)
+            except searchstopped:
+                while len(gs.moveLog) > logLength: # unwind whatever the aborted tree left made
+                    gs.undoMove()
+                break
+            pv = self.pvTable[0][:]
+            result = searchresult(pv[0], score, depth, self.nodes, pv, time.perf_counter() - start)
+            if callback is not None:
+                callback(result)
+            if abs(score) > MATE_BOUND: # a forced mate was found, deeper search cannot improve it
+                break
+            # keep the best move first for the next iteration
+            moves.remove(pv[0])
+            moves.insert(0, pv[0])
+
+        result.nodes = self.nodes
+        result.seconds = time.perf_counter() - start
+        gs.checkMate, gs.staleMate = checkMate, staleMate
+        return result
+
+    def searchRoot(self, gs, moves, depth):
+        alpha, beta = -INFINITY, INFINITY
+        bestMove = None
+        for m in moves:
+            gs.makeMove(m)
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, 1)
+            gs.undoMove()
+            if bestMove is None or score > alpha:
+                alpha = score
+                bestMove = m
+                self.pvTable[0] = [m] + self.pvTable[1]
+        self.tt.store(gs.zobristKey, depth, alpha, EXACT, bestMove.moveID)
+        return alpha
+
+    def checkBudget(self):
+        if self.nodeLimit is not None and self.nodes >= self.nodeLimit:
+            raise searchstopped()
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise searchstopped()
+        if self.stopEvent is not None and self.stopEvent.is_set():
+            raise searchstopped()
+
+    def negamax(self, gs, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes % self.checkEvery == 0:
+            self.checkBudget()
+        self.pvTable[ply] = []
+
+        # a repeated position (the side to move can at least repeat it again) or the fifty
+        # move limit is a draw, whatever the table says about the position
+        if ply > 0 and (gs.halfmoveClock >= 100 or gs.repetitions[gs.zobristKey] > 1):
+            return 0
+
+        if self.tablebase is not None and ply > 0 and gs.phase <= 4: # at most a queen left
+            result = self.tablebase.probe(gs)
+            if result is not None:
+                outcome, plies = result
+                if outcome == "win":
+                    return MATE - ply - plies
+                return -MATE + ply + plies if outcome == "loss" else 0
+
+        if depth <= 0 or ply >= self.maxPly:
+            return self.quiescence(gs, alpha, beta, ply)
+
+        key = gs.zobristKey
+        ttMove = 0
+        entry = self.tt.probe(key)
+        if entry is not None:
+            ttDepth, ttScore, bound, ttMove = entry
+            if ttDepth >= depth:
+                ttScore = scoreFromTT(ttScore, ply)
+                if bound == EXACT:
+                    self.pvTable[ply] = self.pvFromTable(gs, depth) # the line this score came from
+                    return ttScore
+                if (bound == LOWERBOUND and ttScore >= beta) or (bound == UPPERBOUND and ttScore <= alpha):
+                    return ttScore
+
+        originalAlpha = alpha
+        bestScore = -INFINITY
+        bestMove = None
+        # staged: hash move, good captures, killers, quiets by history, losing captures.
+        # a cutoff stops the generator, so later stages are never generated
+        for m in gs.iterMoves(hashMove=ttMove, killers=tuple(self.killers[ply]), history=self.history):
+            gs.makeMove(m)
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if score > bestScore:
+                bestScore = score
+                bestMove = m
+                if score > alpha:
+                    alpha = score
+                    self.pvTable[ply] = [m] + self.pvTable[ply + 1]
+                    if alpha >= beta:
+                        if m.pieceCaptured == "--":
+                            self.rememberQuiet(m, depth, ply)
+                        break
+        if bestMove is None: # no legal move
+            return -MATE + ply if gs.inCheck() else 0
+
+        if bestScore >= beta:
+            bound = LOWERBOUND
+        elif bestScore > originalAlpha:
+            bound = EXACT
+        else:
+            bound = UPPERBOUND
+        self.tt.store(key, depth, scoreToTT(bestScore, ply), bound, bestMove.moveID)
+        return bestScore
+
+    '''
+    the line stored in the table from gs on: the best move of each entry, followed while it is
+    legal, for at most maxLength plies and never into a position already on the line
+    '''
+    def pvFromTable(self, gs, maxLength):
+        pv = []
+        seen = set()
+        while len(pv) < maxLength and gs.zobristKey not in seen:
+            seen.add(gs.zobristKey)
+            entry = self.tt.probe(gs.zobristKey)
+            if entry is None or not entry[3]:
+                break
+            context = gs.legalityContext()
+            m = gs.pseudoLegalMove(entry[3], context)
+            if m is None or not gs.isLegal(m, context):
+                break
+            pv.append(m)
+            gs.makeMove(m)
+        for _ in pv:
+            gs.undoMove()
+        return pv
+
+    '''
+    only captures (and queen promotions) are searched past the horizon, so a score is never
+    taken in the middle of an exchange. the side to move may always stand pat on the static evaluation.
+    '''
+    def quiescence(self, gs, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes % self.checkEvery == 0:
+            self.checkBudget()
+
+        if not gs.hasLegalMove():
+            return -MATE + ply if gs.inCheck() else 0
+
+        standPat = gs.evaluate()
+        if standPat >= beta or ply >= self.maxPly:
+            return standPat
+        if standPat > alpha:
+            alpha = standPat
+
+        for m in gs.iterMoves(chess_engine.STAGE_CAPTURES): # losing captures are not searched
+            gs.makeMove(m)
+            score = -self.quiescence(gs, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+        return alpha
+
+    '''
+    a quiet move caused a beta cutoff, keep it as a killer for this ply and credit its history
+    '''
+    def rememberQuiet(self, m, depth, ply):
+        killers = self.killers[ply]
+        if killers[0] != m.moveID:
+            killers[1] = killers[0]
+            killers[0] = m.moveID
+        i = m.moveID & 4095
+        self.history[i] += depth * depth
+        if self.history[i] > 1 << 26: # halve everything so old cutoffs fade and the numbers stay small
+            self.history = [h >> 1 for h in self.history]
+
+
+'''
+mate scores are stored relative to the node, not the root, so they stay valid when the
+same position is reached at another ply
+'''
+def scoreToTT(score, ply):
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def scoreFromTT(score, ply):
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+
+'''
+convenience wrapper: search gs with a fresh searcher and return a searchresult
+'''
+def search(gs, maxDepth=None, timeLimit=None, nodeLimit=None, stopEvent=None, callback=None,
+           tt=None):
+    return searcher(tt).search(gs, maxDepth, timeLimit, nodeLimit, stopEvent, callback)
@@ -0,0 +1,227 @@
+'''
+headless self-play and matches between two players, spread over a process pool.
+only chess_engine and the search are imported (never pygame), so it runs on build machines
+without a display.
+
+a player is given as text:
+    random        a uniformly random legal move
+    depth:N       alpha-beta search to depth N
+    time:T        alpha-beta search for T seconds per move
+    nodes:N       alpha-beta search for N nodes per move
+
+the players swap colours every game. finished games are appended to the PGN file as they
+come in, and a summary line (wins / draws / losses of the first player, the Elo difference
+with a 95% error margin and games per second) is printed as the match goes.
+
+  python chess_selfplay.py depth:3 random --games 200 --pgn games.pgn
+  python chess_selfplay.py time:0.2 depth:2 --games 1000 --workers 8
+'''
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import chess_engine
+import chess_pgn
+import chess_search
+
+playerKinds = ("random", "depth", "time", "nodes")
+
+
+'''
+"depth:3" -> ("depth", 3), raises ValueError for an unknown player
+'''
+def parsePlayer(spec):
+    kind, _, value = spec.partition(":")
+    if kind not in playerKinds or (kind == "random") != (value == ""):
+        raise ValueError("unknown player %r, expected random, depth:N, time:T or nodes:N" % spec)
+    if kind == "random":
+        return (kind, None)
+    return (kind, float(value) if kind == "time" else int(value))
+
+
+class player:
+    def __init__(self, spec, rng, ttSizeMB=8):
+        self.spec = spec
+        self.kind, self.value = parsePlayer(spec)
+        self.rng = rng
+        self.searcher = chess_search.searcher(chess_search.transpositiontable(ttSizeMB)) \
+            if self.kind != "random" else None
+
+    def chooseMove(self, gs, moves):
+        if self.kind == "random":
+            return self.rng.choice(moves)
+        if self.kind == "depth":
+            result = self.searcher.search(gs, maxDepth=self.value)
+        elif self.kind == "time":
+            result = self.searcher.search(gs, timeLimit=self.value)
+        else:
+            result = self.searcher.search(gs, nodeLimit=self.value)
+        return result.bestMove if result.bestMove is not None else moves[0]
+
+
+'''
+runs in the worker process: play one game and return it as plain data.
+the first randomPlies moves are random so deterministic players do not repeat one game.
+'''
+def playGame(roundNumber, whiteSpec, blackSpec, seed, maxPlies=300, randomPlies=4, ttSizeMB=8):
+    rng = random.Random(seed)
+    players = {True: player(whiteSpec, rng, ttSizeMB), False: player(blackSpec, rng, ttSizeMB)}
+    gs = chess_engine.gamestate()
+    sanMoves = []
+    result, termination = "1/2-1/2", "move limit"
+    while True:
+        moves = gs.getValidMoves()
+        if gs.checkMate:
+            result = "0-1" if gs.whiteToMove else "1-0"
+            termination = "checkmate"
+            break
+        if gs.staleMate:
+            termination = "stalemate"
+            break
+        if gs.drawReason() is not None:
+            termination = gs.drawReason()
+            break
+        if len(sanMoves) >= maxPlies:
+            break
+        if len(sanMoves) < randomPlies:
+            m = rng.choice(moves)
+        else:
+            m = players[gs.whiteToMove].chooseMove(gs, moves)
+        sanMoves.append(chess_pgn.toSan(gs, m))
+        gs.makeMove(m)
+    return {"round": roundNumber, "white": whiteSpec, "black": blackSpec, "result": result,
+            "termination": termination, "moves": sanMoves}
+
+
+'''
+Elo difference of a score (wins + draws / 2) / games, with the 95% margin from the spread
+of the per game scores. None while the score is 0 or 1 (the difference is unbounded).
+'''
+def eloDifference(wins, draws, losses):
+    games = wins + draws + losses
+    if games == 0:
+        return None
+    score = (wins + draws / 2) / games
+    if score <= 0 or score >= 1:
+        return None
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+
+    def elo(s):
+        s = min(max(s, 1e-6), 1 - 1e-6)
+        return 400 * math.log10(s / (1 - s))
+
+    return elo(score), (elo(score + margin) - elo(score - margin)) / 2
+
+
+class matchstats:
+    '''
+    running totals from the first player's point of view
+    '''
+    def __init__(self, first):
+        self.first = first
+        self.wins = self.draws = self.losses = 0
+        self.start = time.perf_counter()
+
+    def add(self, game):
+        if game["result"] == "1/2-1/2":
+            self.draws += 1
+        elif (game["result"] == "1-0") == (game["round"] % 2 == 1): # first is white in odd rounds
+            self.wins += 1
+        else:
+            self.losses += 1
+
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    def summary(self):
+        seconds = time.perf_counter() - self.start
+        line = "games %d  +%d =%d -%d" % (self.games(), self.wins, self.draws, self.losses)
+        elo = eloDifference(self.wins, self.draws, self.losses)
+        line += "  elo %+.0f +/- %.0f" % elo if elo is not None else "  elo n/a"
+        line += "  %.2f games/s" % (self.games() / seconds if seconds > 0 else 0)
+        return line
+
+
+'''
+play games between first and second and stream them to out (an open text file or None).
+round r (counted from 1) has first as white when r is odd. at most 2 * workers games are
+in flight, so memory stays flat however many games are asked for. returns the matchstats.
+'''
+def runMatch(first, second, games, workers=None, out=None, seed=None, maxPlies=300, randomPlies=4,
+             ttSizeMB=8, report=None):
+    workers = workers or os.cpu_count() or 1
+    seeds = random.Random(seed)
+    stats = matchstats(first)
+    headers = {"Event": "%s vs %s" % (first, second), "Site": "chess_selfplay",
+               "Date": time.strftime("%Y.%m.%d")}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        nextRound = 1
+        while nextRound <= games or pending:
+            while nextRound <= games and len(pending) < 2 * workers:
+                white, black = (first, second) if nextRound % 2 == 1 else (second, first)
+                pending.add(pool.submit(playGame, nextRound, white, black, seeds.getrandbits(64),
+                                        maxPlies, randomPlies, ttSizeMB))
+                nextRound += 1
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                game = future.result()
+                stats.add(game)
+                if out is not None:
+                    tags = dict(headers, Round=game["round"], White=game["white"],
+                                Black=game["black"], Termination=game["termination"])
+                    out.write(chess_pgn.formatGame(tags, game["moves"], game["result"]))
+                    out.flush()
+                if report is not None:
+                    report(stats)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="headless match between two players")
+    parser.add_argument("first", help="random, depth:N, time:T or nodes:N")
+    parser.add_argument("second", help="random, depth:N, time:T or nodes:N")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--pgn", help="append finished games to this file")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--max-plies", type=int, default=300, help="adjudicate a draw after this many plies")
+    parser.add_argument("--random-plies", type=int, default=4, help="random opening moves per game")
+    parser.add_argument("--hash", type=int, default=8, help="transposition table MB per player")
+    args = parser.parse_args(argv)
+    for spec in (args.first, args.second):
+        try:
+            parsePlayer(spec)
+        except ValueError as e:
+            parser.error(str(e))
+
+    live = sys.stdout.isatty()
+
+    def report(stats):
+        if live:
+            sys.stdout.write("\r" + stats.summary() + "   ")
+            sys.stdout.flush()
+        elif stats.games() % 10 == 0 or stats.games() == args.games:
+            print(stats.summary(), flush=True)
+
+    out = open(args.pgn, "a", encoding="utf-8") if args.pgn else None
+    try:
+        stats = runMatch(args.first, args.second, args.games, args.workers, out, args.seed,
+                         args.max_plies, args.random_plies, args.hash, report)
+    finally:
+        if out is not None:
+            out.close()
+    if live:
+        print()
+    print("%s vs %s: %s" % (args.first, args.second, stats.summary()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
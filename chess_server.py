@@ -0,0 +1,339 @@
+'''
+multi-game server: many games played over plain TCP, all served by one asyncio event loop.
+
+clients send newline delimited JSON. each line holds one request object and gets one reply line:
+    {"op": "new", "ai": "black"}       start a game (ai: "white", "black" or "none", optional "fen")
+    {"op": "join", "session": "..."}   continue a game, also after a reconnect
+    {"op": "move", "move": "e2e4"}     play a move in coordinate notation (promotions as "e7e8q")
+    {"op": "state"}                    the current position
+    {"op": "stats"}                    latency numbers of this session
+    {"op": "metrics"}                  server wide numbers
+every reply has "ok", failed requests carry "error" instead of a result. a game reply has
+session, fen, turn, status ("ok", "check", "checkmate", "stalemate" or the draw reason),
+over, the legal moves, and the AI's answer as "reply" when it moved.
+
+a session keeps one gamestate and the legal moves of its position, so a move is checked with
+one dict lookup and getValidMoves runs once per ply. AI turns go to a shared process pool
+(a chess_selfplay player per spec in every worker), and the loop keeps serving other sessions
+while a search runs. a session idle for --idle seconds is reduced to its snapshot: the starting
+FEN and the moves, packed two bytes each. its next request rebuilds the game from that snapshot,
+and a snapshot left alone for --expire seconds is dropped.
+
+  python chess_server.py --port 8765 --ai nodes:2000 --workers 4
+  python chess_loadgen.py --port 8765 --players 2000
+'''
+
+import argparse
+import array
+import asyncio
+import json
+import os
+import random
+import secrets
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import chess_engine
+import chess_latency
+import chess_selfplay
+
+defaultPort = 8765
+aiColors = {"white": True, "black": False, "none": None}
+
+_worker = {} # per process players, created on first use
+
+
+class requesterror(Exception):
+    pass
+
+
+'''
+runs in the worker process: rebuild the game and return the moveID the player picks
+'''
+def chooseMove(snapshot, spec, ttSizeMB=8):
+    players = _worker.setdefault("players", {})
+    if spec not in players:
+        players[spec] = chess_selfplay.player(spec, random.Random(), ttSizeMB)
+    gs = chess_engine.gamestate.fromSnapshot(snapshot)
+    return players[spec].chooseMove(gs, gs.getValidMoves()).moveID
+
+
+'''
+gamestate.snapshot() as bytes: the FEN, a zero byte, then every moveID as an unsigned short
+(a moveID is below 2 ** 15)
+'''
+def packSnapshot(snapshot):
+    return snapshot["fen"].encode("ascii") + b"\0" + array.array("H", snapshot["moves"]).tobytes()
+
+
+def unpackSnapshot(data):
+    fen, _, moves = data.partition(b"\0")
+    return {"fen": fen.decode("ascii"), "moves": array.array("H", moves).tolist()}
+
+
+class session:
+    def __init__(self, sessionId, gs, aiColor):
+        self.id = sessionId
+        self.gs = gs
+        self.packed = None # snapshot bytes while evicted
+        self.aiColor = aiColor # the side the AI plays: True white, False black, None no AI
+        self.legal = None # notation -> move of the current position
+        self.lock = asyncio.Lock() # one request at a time, also held while the AI thinks
+        self.lastActive = time.monotonic()
+        self.latency = chess_latency.latencystats()
+        self.updateLegal()
+
+    def updateLegal(self):
+        self.legal = {m.getChessNotation(): m for m in self.gs.getValidMoves()}
+
+    def evict(self):
+        self.packed = packSnapshot(self.gs.snapshot())
+        self.gs = None
+        self.legal = None
+
+    def restore(self):
+        self.gs = chess_engine.gamestate.fromSnapshot(unpackSnapshot(self.packed))
+        self.packed = None
+        self.updateLegal()
+
+    def over(self):
+        return not self.legal or self.gs.drawReason() is not None
+
+    def aiToMove(self):
+        return self.aiColor is not None and self.gs.whiteToMove == self.aiColor and not self.over()
+
+    def status(self):
+        if self.gs.checkMate:
+            return "checkmate"
+        if self.gs.staleMate:
+            return "stalemate"
+        reason = self.gs.drawReason()
+        if reason is not None:
+            return reason
+        return "check" if self.gs.inCheck() else "ok"
+
+    def state(self):
+        return {"session": self.id, "fen": self.gs.to_fen(), "turn": "white" if self.gs.whiteToMove else "black",
+                "status": self.status(), "over": self.over(), "legal": list(self.legal)}
+
+
+class gameserver:
+    def __init__(self, aiSpec="nodes:2000", workers=None, idleSeconds=60.0, expireSeconds=3600.0, ttSizeMB=8):
+        chess_selfplay.parsePlayer(aiSpec)
+        self.aiSpec = aiSpec
+        self.ttSizeMB = ttSizeMB
+        self.idleSeconds = idleSeconds
+        self.expireSeconds = expireSeconds
+        self.pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        self.sessions = {}
+        self.counters = dict.fromkeys(("connections", "requests", "errors", "aiMoves", "evictions",
+                                       "restores", "expired", "failures"), 0)
+        self.latency = {} # op -> latencystats, "ai" times the searches alone
+        self.started = time.monotonic()
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+
+    def record(self, op, seconds):
+        stats = self.latency.get(op)
+        if stats is None:
+            stats = self.latency[op] = chess_latency.latencystats()
+        stats.add(seconds)
+
+    async def handleClient(self, reader, writer):
+        self.counters["connections"] += 1
+        current = None
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError: # a line over the stream limit
+                    break
+                if not line:
+                    break
+                start = time.perf_counter()
+                op = "invalid"
+                if current is not None and self.sessions.get(current.id) is not current:
+                    current = None # discarded or expired since the last request
+                try:
+                    try:
+                        request = json.loads(line)
+                    except ValueError as e:
+                        raise requesterror(str(e))
+                    if not isinstance(request, dict):
+                        raise requesterror("a request is a JSON object")
+                    op = str(request.get("op"))
+                    reply, current = await self.dispatch(op, request, current)
+                except requesterror as e:
+                    self.counters["errors"] += 1
+                    reply = {"ok": False, "error": str(e)}
+                except Exception as e: # a bug, not the client's fault: keep serving everyone else
+                    self.counters["failures"] += 1
+                    reply = {"ok": False, "error": "internal error: %s" % e.__class__.__name__}
+                writer.write(json.dumps(reply).encode("utf-8") + b"\n")
+                await writer.drain()
+                seconds = time.perf_counter() - start
+                self.counters["requests"] += 1
+                self.record(op, seconds)
+                if current is not None:
+                    current.latency.add(seconds)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, op, request, current):
+        if op == "new":
+            current = self.newSession(request)
+            return await self.play(current, None), current
+        if op == "join":
+            current = self.sessions.get(request.get("session"))
+            if current is None:
+                raise requesterror("unknown session %s" % request.get("session"))
+            return await self.play(current, None), current
+        if op == "metrics":
+            return self.metrics(), current
+        if op not in ("move", "state", "stats"):
+            raise requesterror("unknown op %s" % op)
+        if current is None:
+            raise requesterror("no game, send new or join first")
+        if op == "stats":
+            return {"ok": True, "session": current.id, "latency": current.latency.summary()}, current
+        if op == "move" and not isinstance(request.get("move"), str):
+            raise requesterror("move needs a move")
+        return await self.play(current, request.get("move") if op == "move" else None), current
+
+    def newSession(self, request):
+        ai = request.get("ai", "none")
+        if ai not in aiColors:
+            raise requesterror("ai must be white, black or none")
+        try:
+            gs = chess_engine.gamestate.from_fen(request["fen"]) if "fen" in request \
+                else chess_engine.gamestate()
+        except (ValueError, TypeError) as e:
+            raise requesterror("bad fen: %s" % e)
+        sessionId = secrets.token_hex(8)
+        current = self.sessions[sessionId] = session(sessionId, gs, aiColors[ai])
+        return current
+
+    '''
+    bring the session back if it was evicted, play the client's move (if any) and the AI's
+    answer, and return the game reply
+    '''
+    async def play(self, current, text):
+        async with current.lock:
+            try:
+                return await self.playLocked(current, text)
+            except requesterror:
+                raise
+            except Exception:
+                self.sessions.pop(current.id, None) # its gamestate may be half updated
+                raise
+
+    async def playLocked(self, current, text):
+        if current.gs is None:
+            current.restore()
+            self.counters["restores"] += 1
+        current.lastActive = time.monotonic()
+        reply = {"ok": True}
+        if text is not None:
+            m = None if current.over() else current.legal.get(text)
+            if m is None:
+                raise requesterror("illegal move %s" % text)
+            current.gs.makeMove(m)
+            current.updateLegal()
+        if current.aiToMove():
+            reply["reply"] = await self.aiMove(current)
+        reply.update(current.state())
+        current.lastActive = time.monotonic()
+        return reply
+
+    async def aiMove(self, current):
+        start = time.perf_counter()
+        moveID = await asyncio.get_running_loop().run_in_executor(
+            self.pool, chooseMove, current.gs.snapshot(), self.aiSpec, self.ttSizeMB)
+        self.record("ai", time.perf_counter() - start)
+        self.counters["aiMoves"] += 1
+        m = next(m for m in current.legal.values() if m.moveID == moveID)
+        current.gs.makeMove(m)
+        current.updateLegal()
+        return m.getChessNotation()
+
+    '''
+    evict sessions idle for idleSeconds and drop snapshots idle for expireSeconds
+    '''
+    def sweep(self, now=None):
+        now = time.monotonic() if now is None else now
+        for sessionId, current in list(self.sessions.items()):
+            if current.lock.locked():
+                continue
+            idle = now - current.lastActive
+            if current.gs is None:
+                if idle >= self.expireSeconds:
+                    del self.sessions[sessionId]
+                    self.counters["expired"] += 1
+            elif idle >= self.idleSeconds:
+                current.evict()
+                self.counters["evictions"] += 1
+
+    async def sweepForever(self):
+        interval = max(0.1, min(self.idleSeconds, self.expireSeconds) / 4)
+        while True:
+            await asyncio.sleep(interval)
+            self.sweep()
+
+    def metrics(self):
+        evicted = sum(1 for current in self.sessions.values() if current.gs is None)
+        sessionLatency = chess_latency.latencystats()
+        for current in self.sessions.values():
+            sessionLatency.merge(current.latency)
+        return {"ok": True, "uptime": round(time.monotonic() - self.started, 3),
+                "sessions": len(self.sessions) - evicted, "evicted": evicted,
+                "counters": dict(self.counters),
+                "latency": {op: stats.summary() for op, stats in sorted(self.latency.items())},
+                "sessionLatency": sessionLatency.summary()}
+
+    '''
+    listen on host:port until cancelled, ready (an asyncio.Event) is set once accepting
+    '''
+    async def serve(self, host="127.0.0.1", port=defaultPort, ready=None):
+        tcp = await asyncio.start_server(self.handleClient, host, port, backlog=4096)
+        sweeper = asyncio.ensure_future(self.sweepForever())
+        if ready is not None:
+            ready.set()
+        try:
+            async with tcp:
+                await tcp.serve_forever()
+        finally:
+            sweeper.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="serve many games over TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=defaultPort)
+    parser.add_argument("--ai", default="nodes:2000", help="AI player: random, depth:N, time:T or nodes:N")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="AI worker processes")
+    parser.add_argument("--idle", type=float, default=60.0, help="evict sessions idle this many seconds")
+    parser.add_argument("--expire", type=float, default=3600.0, help="drop evicted sessions after this many seconds")
+    parser.add_argument("--hash", type=int, default=8, help="transposition table MB per worker")
+    args = parser.parse_args(argv)
+    try:
+        chess_selfplay.parsePlayer(args.ai)
+    except ValueError as e:
+        parser.error(str(e))
+
+    server = gameserver(args.ai, args.workers, args.idle, args.expire, args.hash)
+    sys.stderr.write("listening on %s:%d\n" % (args.host, args.port))
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,372 @@
+'''
+endgame tablebases for three piece endings (KQK, KRK, KPK) built by retrograde analysis.
+
+generation is a batch job:
+  1) every index is decoded into a position, gamestate generates its legal moves and each
+     move is mapped to the index of the position it leads to. this step runs in a process
+     pool, chunks of the index space per task.
+  2) starting from the checkmates, results are propagated backwards through the move graph
+     one ply at a time, which gives win / draw / loss and the exact distance to mate.
+
+the strong side is always white in the files, a position where black has the extra piece
+is probed colour-flipped. pawnless tables keep the white king in the a1-d1-d4 triangle
+(the other squares are mirror images), KPK keeps the pawn on files a-d.
+
+file layout: a 16 byte header (b"CTB1", the name padded to 4 bytes, entry count, 4 spare
+bytes) then one byte per index:
+    0          draw (or unresolved, which is the same thing)
+    1 .. 254   distance to mate in plies + 1, odd plies: side to move wins, even: it loses
+    255        illegal index (overlapping pieces, side not to move in check, ...)
+
+  python chess_tablebase.py generate tables/ --workers 8
+  python chess_tablebase.py probe tables/ "8/8/8/4k3/8/8/8/4K2R w"
+'''
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import chess_engine
+
+DRAW = 0
+ILLEGAL = 255
+headerFormat = struct.Struct("<4s4sI4x")
+headerSize = headerFormat.size
+
+# generation order, KPK promotes into the other two
+tableNames = ("KQK", "KRK", "KPK")
+
+# white king squares of the pawnless tables: files a-d, rank 1 up to the a1-h8 diagonal
+triangle = [r * 8 + c for r in range(7, 3, -1) for c in range(4) if 7 - r <= c]
+triangleIndex = {sq: i for i, sq in enumerate(triangle)}
+
+
+'''
+board name of the white piece in a table: KQK -> wQ, KPK -> wp
+'''
+def strongPiece(name):
+    return "wp" if name[1] == 'P' else "w" + name[1]
+
+
+'''
+number of indexes in a table
+'''
+def tableSize(name):
+    if name == "KPK":
+        return 64 * 64 * 24 * 2 # white king, black king, pawn on a2-d7, side to move
+    return len(triangle) * 64 * 64 * 2
+
+
+def _mirrorFile(sq):
+    return sq ^ 7
+
+
+def _mirrorRank(sq):
+    return sq ^ 56
+
+
+def _diagonal(sq):
+    '''
+    reflect in the a1-h8 diagonal: file and rank swap places
+    '''
+    r, c = divmod(sq, 8)
+    return (7 - c) * 8 + (7 - r)
+
+
+'''
+index of the position (white king, black king, white piece squares, side to move) after
+moving it into the stored symmetry class, or -1 if the pawn is off its legal ranks
+'''
+def positionIndex(name, wk, bk, piece, whiteToMove):
+    stm = 0 if whiteToMove else 1
+    if name == "KPK":
+        if piece & 7 > 3:
+            wk, bk, piece = _mirrorFile(wk), _mirrorFile(bk), _mirrorFile(piece)
+        row = piece >> 3
+        if not 1 <= row <= 6:
+            return -1
+        pawn = (row - 1) * 4 + (piece & 7)
+        return ((wk * 64 + bk) * 24 + pawn) * 2 + stm
+    if wk & 7 > 3:
+        wk, bk, piece = _mirrorFile(wk), _mirrorFile(bk), _mirrorFile(piece)
+    if wk >> 3 < 4:
+        wk, bk, piece = _mirrorRank(wk), _mirrorRank(bk), _mirrorRank(piece)
+    if 7 - (wk >> 3) > (wk & 7):
+        wk, bk, piece = _diagonal(wk), _diagonal(bk), _diagonal(piece)
+    return ((triangleIndex[wk] * 64 + bk) * 64 + piece) * 2 + stm
+
+
+def decodeIndex(name, index):
+    index, stm = divmod(index, 2)
+    if name == "KPK":
+        index, pawn = divmod(index, 24)
+        wk, bk = divmod(index, 64)
+        piece = (pawn // 4 + 1) * 8 + pawn % 4
+    else:
+        index, piece = divmod(index, 64)
+        wkIndex, bk = divmod(index, 64)
+        wk = triangle[wkIndex]
+    return wk, bk, piece, stm == 0
+
+
+'''
+set gs up with the position at index, returns False for an illegal position
+'''
+def setupPosition(gs, name, index):
+    wk, bk, piece, whiteToMove = decodeIndex(name, index)
+    if len({wk, bk, piece}) < 3:
+        return False
+    board = [["--"] * 8 for _ in range(8)]
+    board[wk >> 3][wk & 7] = "wK"
+    board[bk >> 3][bk & 7] = "bK"
+    board[piece >> 3][piece & 7] = strongPiece(name)
+    gs.setBoard(board, whiteToMove)
+    # the side that just moved may not be in check (this also rules out touching kings)
+    if whiteToMove:
+        return not gs.isSquareAttacked(bk >> 3, bk & 7, 'w')
+    return not gs.isSquareAttacked(wk >> 3, wk & 7, 'b')
+
+
+'''
+worker task: expand indexes start..stop into the move graph.
+returns a list with, per index: None (illegal), or (inCheck, successors, externals) where
+successors are indexes in this table and externals are stored values from other tables
+(promotions) or DRAW (the last white piece was captured).
+'''
+def expandRange(name, start, stop, directory):
+    gs = chess_engine.gamestate()
+    probe = tablebase(directory) if name == "KPK" else None
+    ownPiece = strongPiece(name)
+    results = []
+    for index in range(start, stop):
+        if not setupPosition(gs, name, index):
+            results.append(None)
+            continue
+        successors = []
+        externals = []
+        for m in gs.getValidMoves():
+            gs.makeMove(m)
+            wk = gs.whiteKingLocation[0] * 8 + gs.whiteKingLocation[1]
+            bk = gs.blackKingLocation[0] * 8 + gs.blackKingLocation[1]
+            if m.pieceMoved[0] == 'w' and m.pieceMoved[1] != 'K':
+                pieceSq = m.endRow * 8 + m.endCol
+                piece = gs.board[m.endRow][m.endCol]
+            else:
+                pieceSq = piece = None
+                for whitePiece in chess_engine.pieceNames['w'][:-1]:
+                    for r, c in gs.pieceLocations[whitePiece]:
+                        pieceSq, piece = r * 8 + c, whitePiece
+            if piece is None: # black king took the last piece
+                externals.append(DRAW)
+            elif piece != ownPiece: # promoted
+                if piece[1] in "QR":
+                    externals.append(probe.lookup("K%sK" % piece[1], wk, bk, pieceSq, gs.whiteToMove))
+                else: # a minor piece cannot mate
+                    externals.append(DRAW)
+            else:
+                successors.append(positionIndex(name, wk, bk, pieceSq, gs.whiteToMove))
+            gs.undoMove()
+        results.append((gs.inCheck(), successors, externals))
+    return results
+
+
+'''
+build the table name and return its values as a bytearray (one byte per index)
+'''
+def generateTable(name, directory, workers=None, chunk=4096, log=None):
+    size = tableSize(name)
+    start = time.perf_counter()
+    ranges = [(i, min(i + chunk, size)) for i in range(0, size, chunk)]
+    if workers == 1:
+        expanded = [expandRange(name, a, b, directory) for a, b in ranges]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            expanded = list(pool.map(expandRange, [name] * len(ranges), [a for a, _ in ranges],
+                                     [b for _, b in ranges], [directory] * len(ranges)))
+    if log:
+        log("%s: move graph of %d positions in %.1fs" % (name, size, time.perf_counter() - start))
+
+    values = bytearray(size)
+    resolved = bytearray(size)
+    remaining = array('i', bytes(4 * size)) # successors not yet known to win for the opponent
+    blocked = bytearray(size) # some move reaches a draw, so this can never be a loss
+    externalMax = bytearray(size) # longest external win for the opponent, in plies
+    buckets = [[] for _ in range(256)] # positions waiting to be resolved, by plies to mate
+    predecessorCount = array('i', bytes(4 * size))
+
+    index = 0
+    for block in expanded:
+        for entry in block:
+            if entry is None:
+                values[index] = ILLEGAL
+                resolved[index] = 1
+            else:
+                inCheck, successors, externals = entry
+                remaining[index] = len(successors)
+                for s in successors:
+                    predecessorCount[s] += 1
+                for v in externals:
+                    if v == DRAW:
+                        blocked[index] = 1
+                    elif (v - 1) % 2 == 0: # the opponent is lost after this move
+                        buckets[v].append(index) # win in (v - 1) + 1 plies
+                    else:
+                        externalMax[index] = max(externalMax[index], v - 1)
+                if not successors and not externals:
+                    if inCheck:
+                        buckets[0].append(index) # checkmated
+                    else:
+                        resolved[index] = 1 # stalemate
+                elif not successors and not blocked[index] and externalMax[index]:
+                    buckets[externalMax[index] + 1].append(index)
+            index += 1
+
+    # predecessors in compressed rows: predecessors of i are flat[offsets[i]:offsets[i + 1]]
+    offsets = array('i', bytes(4 * (size + 1)))
+    for i in range(size):
+        offsets[i + 1] = offsets[i] + predecessorCount[i]
+    fill = array('i', offsets[:-1])
+    flat = array('i', bytes(4 * offsets[size]))
+    index = 0
+    for block in expanded:
+        for entry in block:
+            if entry is not None:
+                for s in entry[1]:
+                    flat[fill[s]] = index
+                    fill[s] += 1
+            index += 1
+    del expanded, fill, predecessorCount
+
+    for plies in range(255):
+        for p in buckets[plies]:
+            if resolved[p]:
+                continue
+            resolved[p] = 1
+            values[p] = plies + 1
+            if plies % 2 == 0: # p is lost, every position moving into it is won
+                for q in flat[offsets[p]:offsets[p + 1]]:
+                    if not resolved[q]:
+                        buckets[plies + 1].append(q)
+            else: # p is won, one fewer escape for every position moving into it
+                for q in flat[offsets[p]:offsets[p + 1]]:
+                    remaining[q] -= 1
+                    if remaining[q] == 0 and not resolved[q] and not blocked[q]:
+                        buckets[max(plies, externalMax[q]) + 1].append(q)
+        buckets[plies] = None
+
+    if log:
+        wins = sum(1 for v in values if v != ILLEGAL and v and (v - 1) % 2 == 1)
+        log("%s: done in %.1fs, %d wins for the side to move" % (name, time.perf_counter() - start, wins))
+    return values
+
+
+def writeTable(path, name, values):
+    with open(path, "wb") as f:
+        f.write(headerFormat.pack(b"CTB1", name.encode().ljust(4, b"\0"), len(values)))
+        f.write(values)
+
+
+'''
+generate every table in tableNames order into directory
+'''
+def generateAll(directory, workers=None, log=print):
+    os.makedirs(directory, exist_ok=True)
+    for name in tableNames:
+        values = generateTable(name, directory, workers, log=log)
+        writeTable(os.path.join(directory, name + ".ctb"), name, values)
+
+
+class tablebase:
+    '''
+    probe side: tables are opened lazily and memory mapped, a probe is an index
+    computation and one byte read
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}
+
+    def table(self, name):
+        if name not in self.tables:
+            path = os.path.join(self.directory, name + ".ctb")
+            if not os.path.exists(path):
+                self.tables[name] = None
+            else:
+                with open(path, "rb") as f:
+                    magic, stored, count = headerFormat.unpack(f.read(headerSize))
+                    if magic != b"CTB1" or stored.rstrip(b"\0").decode() != name:
+                        raise ValueError("not a %s table: %s" % (name, path))
+                    self.tables[name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.tables[name]
+
+    def close(self):
+        for data in self.tables.values():
+            if data is not None:
+                data.close()
+        self.tables = {}
+
+    '''
+    stored byte for white king, black king and white piece squares, or None without a table
+    '''
+    def lookup(self, name, wk, bk, piece, whiteToMove):
+        data = self.table(name)
+        if data is None:
+            return None
+        index = positionIndex(name, wk, bk, piece, whiteToMove)
+        return data[headerSize + index] if index >= 0 else ILLEGAL
+
+    '''
+    the tablebase result for gs as ("win" | "loss" | "draw", plies to mate) from the side to
+    move's point of view, or None if gs is not a three piece ending with a table on disk
+    '''
+    def probe(self, gs):
+        pieces = [(piece, r * 8 + c) for piece, squares in gs.pieceLocations.items()
+                  if piece[1] != 'K' for r, c in squares]
+        if len(pieces) > 1:
+            return None
+        if not pieces:
+            return ("draw", 0) # bare kings
+        piece, pieceSq = pieces[0]
+        wk = gs.whiteKingLocation[0] * 8 + gs.whiteKingLocation[1]
+        bk = gs.blackKingLocation[0] * 8 + gs.blackKingLocation[1]
+        whiteToMove = gs.whiteToMove
+        if piece[0] == 'b': # store the strong side as white: flip the board and the colours
+            wk, bk, pieceSq = _mirrorRank(bk), _mirrorRank(wk), _mirrorRank(pieceSq)
+            whiteToMove = not whiteToMove
+        if piece[1] in "BN":
+            return ("draw", 0)
+        value = self.lookup("K%sK" % piece[1].upper(), wk, bk, pieceSq, whiteToMove)
+        if value is None or value == ILLEGAL:
+            return None
+        if value == DRAW:
+            return ("draw", 0)
+        plies = value - 1
+        return ("win" if plies % 2 else "loss", plies)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="generate or probe three piece endgame tables")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate = commands.add_parser("generate")
+    generate.add_argument("directory")
+    generate.add_argument("--workers", type=int, default=os.cpu_count())
+    probe = commands.add_parser("probe")
+    probe.add_argument("directory")
+    probe.add_argument("fen")
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        generateAll(args.directory, args.workers)
+    else:
+        import chess_perft
+        gs = chess_perft.loadPosition(args.fen)
+        print(tablebase(args.directory).probe(gs))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+'''
+UCI front end: lets GUIs, tournament managers and scripts drive the engine over stdin/stdout.
+
+  python -m chess_engine --uci
+  python chess_uci.py
+
+the main thread only reads and answers commands; every go runs the search in a background
+thread on its own copy of the position. so stop and ponderhit are seen while the search runs,
+and the search notices them at its next budget check (every searcher.checkEvery nodes, a few
+milliseconds).
+
+supported: uci, debug, isready, setoption (Hash, Ponder), ucinewgame,
+position [startpos | fen F] [moves ...], go [depth N] [nodes N] [movetime MS]
+[wtime MS] [btime MS] [winc MS] [binc MS] [movestogo N] [infinite] [ponder], stop, ponderhit, quit
+'''
+
+import sys
+import threading
+import time
+
+import chess_ai
+import chess_engine
+import chess_search
+
+engineName = "Python Chess"
+engineAuthor = "Dev Panchal"
+defaultHashMB = 16
+
+
+'''
+"info score" value of a search score: cp for normal scores, mate in moves when mate is forced
+'''
+def formatScore(score):
+    if score > chess_search.MATE_BOUND:
+        return "mate %d" % ((chess_search.MATE - score + 1) // 2)
+    if score < -chess_search.MATE_BOUND:
+        return "mate %d" % -((chess_search.MATE + score + 1) // 2)
+    return "cp %d" % score
+
+
+'''
+seconds to spend on this move from the go parameters, None when there is no limit
+'''
+def thinkTime(params, whiteToMove):
+    if "movetime" in params:
+        return params["movetime"] / 1000
+    left = params.get("wtime" if whiteToMove else "btime")
+    if left is None:
+        return None
+    increment = params.get("winc" if whiteToMove else "binc", 0)
+    movesToGo = params.get("movestogo", 30)
+    budget = left / max(1, movesToGo) + increment * 0.8
+    return max(0.01, min(budget, left * 0.5) / 1000 - 0.05) # keep a margin for the reply to travel
+
+
+'''
+the go arguments as a dict: numbers for the valued ones, True for infinite and ponder
+'''
+def parseGo(tokens):
+    params = {}
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in ("infinite", "ponder"):
+            params[token] = True
+        elif token in ("depth", "nodes", "movetime", "wtime", "btime", "winc", "binc", "movestogo") \
+                and i + 1 < len(tokens):
+            i += 1
+            params[token] = int(tokens[i])
+        i += 1
+    return params
+
+
+class ucisession:
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.outLock = threading.Lock()
+        self.gs = chess_engine.gamestate()
+        self.searcher = chess_search.searcher(chess_search.transpositiontable(defaultHashMB))
+        self.job = None # chess_ai.aijob of the running search, it doubles as the stop event
+        self.thread = None
+        self.budget = None # seconds a ponder search gets once the ponder hit arrives
+        self.holdBestMove = False # infinite and ponder searches report only after stop / ponderhit
+        self.finished = None # bestmove line held back until then
+        self.debug = False
+
+    def send(self, line):
+        with self.outLock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    '''
+    handle one command line, returns False on quit
+    '''
+    def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == "uci":
+            self.send("id name %s" % engineName)
+            self.send("id author %s" % engineAuthor)
+            self.send("option name Hash type spin default %d min 1 max 1024" % defaultHashMB)
+            self.send("option name Ponder type check default false")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "debug":
+            self.debug = args[:1] == ["on"]
+        elif command == "setoption":
+            self.setOption(args)
+        elif command == "ucinewgame":
+            self.stop()
+            self.searcher.tt.clear()
+            self.searcher.history = [0] * 4096
+        elif command == "position":
+            self.stop()
+            self.setPosition(args)
+        elif command == "go":
+            self.stop()
+            self.go(parseGo(args))
+        elif command == "stop":
+            self.stop()
+        elif command == "ponderhit":
+            self.ponderHit()
+        elif command == "quit":
+            self.stop()
+            return False
+        elif self.debug:
+            self.send("info string unknown command %s" % command)
+        return True
+
+    def setOption(self, args):
+        text = " ".join(args)
+        name, _, value = text.partition(" value ")
+        name = name.replace("name", "", 1).strip().lower()
+        if name == "hash":
+            self.stop()
+            self.searcher.tt = chess_search.transpositiontable(max(1, int(value)))
+
+    def setPosition(self, args):
+        if args[:1] == ["startpos"]:
+            fen, rest = chess_engine.startFen, args[1:]
+        elif args[:1] == ["fen"]:
+            end = args.index("moves") if "moves" in args else len(args)
+            fen, rest = " ".join(args[1:end]), args[end:]
+        else:
+            return
+        try:
+            self.gs.setFen(fen)
+        except ValueError as e:
+            self.send("info string bad fen: %s" % e)
+            return
+        for text in rest[1:] if rest[:1] == ["moves"] else ():
+            m = next((m for m in self.gs.getValidMoves() if m.getChessNotation() == text), None)
+            if m is None:
+                self.send("info string illegal move %s" % text)
+                return
+            self.gs.makeMove(m)
+
+    def go(self, params):
+        budget = thinkTime(params, self.gs.whiteToMove)
+        ponder = params.get("ponder", False)
+        self.budget = budget
+        self.holdBestMove = ponder or params.get("infinite", False)
+        self.finished = None
+        deadline = None if ponder or budget is None else time.perf_counter() + budget
+        job = chess_ai.aijob(self.gs.snapshot(), ponder, deadline)
+        self.job = job
+        self.thread = threading.Thread(target=self.run, args=(job, params.get("depth"), params.get("nodes")),
+                                       daemon=True)
+        self.thread.start()
+
+    def run(self, job, maxDepth, nodeLimit):
+        gs = chess_engine.gamestate.fromSnapshot(job.snapshot)
+        start = time.perf_counter()
+
+        def report(result):
+            seconds = max(time.perf_counter() - start, 1e-6)
+            self.send("info depth %d score %s nodes %d nps %d time %d pv %s" % (
+                result.depth, formatScore(result.score), result.nodes, result.nodes / seconds,
+                seconds * 1000, " ".join(m.getChessNotation() for m in result.pv)))
+
+        result = self.searcher.search(gs, maxDepth=maxDepth, nodeLimit=nodeLimit, stopEvent=job,
+                                      callback=report)
+        if result.bestMove is None:
+            line = "bestmove 0000"
+        elif len(result.pv) > 1:
+            line = "bestmove %s ponder %s" % (result.bestMove.getChessNotation(), result.pv[1].getChessNotation())
+        else:
+            line = "bestmove %s" % result.bestMove.getChessNotation()
+        with self.outLock:
+            if self.holdBestMove and not job.cancelled: # finished early, wait for stop / ponderhit
+                self.finished = line
+                return
+        self.send(line)
+
+    '''
+    end the running search, its bestmove is sent before this returns
+    '''
+    def stop(self):
+        if self.thread is None:
+            return
+        with self.outLock:
+            self.job.cancelled = True
+            line, self.finished = self.finished, None
+        self.thread.join()
+        self.thread = None
+        self.job = None
+        if line is not None:
+            self.send(line)
+
+    def ponderHit(self):
+        job = self.job
+        if job is None or not job.ponder:
+            return
+        with self.outLock:
+            job.ponder = False
+            self.holdBestMove = False
+            if self.budget is not None:
+                job.deadline = time.perf_counter() + self.budget
+            line, self.finished = self.finished, None
+        if line is not None: # the ponder search was already done
+            self.thread.join()
+            self.thread = None
+            self.job = None
+            self.send(line)
+
+
+def main(argv=None, inp=sys.stdin, out=sys.stdout):
+    session = ucisession(out)
+    for line in inp:
+        if not session.handle(line.strip()):
+            break
+    else:
+        session.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import os
+import random
+
+import pytest
+
+import chess_archive
+import chess_engine
+
+
+def randomGame(rng, plies):
+    gs = chess_engine.gamestate()
+    for _ in range(plies):
+        moves = gs.getValidMoves()
+        if not moves:
+            break
+        gs.makeMove(rng.choice(moves))
+    return gs
+
+
+def writeGames(path, count, seed=1, blockGames=4, compress=True):
+    rng = random.Random(seed)
+    written = []
+    with chess_archive.archivewriter(str(path), blockGames, compress) as writer:
+        for i in range(count):
+            gs = randomGame(rng, rng.randrange(0, 40))
+            result = chess_archive.results[i % 4]
+            ref = writer.addGamestate(gs, result, {"Round": str(i)})
+            written.append((ref, gs.snapshot(), result))
+    return written
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_write_read_round_trip(tmp_path, compress):
+    path = tmp_path / "games.arc"
+    written = writeGames(path, 10, compress=compress)
+    with chess_archive.archivereader(str(path)) as reader:
+        games = list(reader)
+        assert [game.ref for game in games] == [ref for ref, _, _ in written]
+        for game, (ref, snapshot, result) in zip(games, written):
+            assert game.snapshot() == snapshot
+            assert game.result == result
+            assert reader.gameAt(ref).snapshot() == snapshot
+        assert games[3].tags == {"Round": "3"}
+
+
+def test_replay_reaches_the_final_position(tmp_path):
+    path = tmp_path / "games.arc"
+    written = writeGames(path, 3)
+    with chess_archive.archivereader(str(path)) as reader:
+        gs = chess_engine.gamestate()
+        for game, (_, snapshot, _) in zip(reader, written):
+            for gs, m in game.replay(gs):
+                pass # the generator plays each move when it is resumed, the last one included
+            assert gs.to_fen() == chess_engine.gamestate.fromSnapshot(snapshot).to_fen()
+
+
+def test_non_standard_start_is_kept(tmp_path):
+    path = tmp_path / "games.arc"
+    fen = "4k3/8/8/8/4Pp2/8/8/4K3 b - e3 0 1"
+    gs = chess_engine.gamestate.from_fen(fen)
+    gs.makeMove(next(m for m in gs.getValidMoves() if m.isEnpassantMove))
+    with chess_archive.archivewriter(str(path)) as writer:
+        ref = writer.addGamestate(gs, "0-1")
+    with chess_archive.archivereader(str(path)) as reader:
+        game = reader.gameAt(ref)
+    assert game.fen == fen
+    assert [chess_archive.moveIdNotation(moveID) for moveID in game.moves] == ["f4e3"]
+
+
+def test_index_finds_every_game_that_reached_a_position(tmp_path):
+    path, indexPath = tmp_path / "games.arc", tmp_path / "games.idx"
+    written = writeGames(path, 12)
+    expected = {}
+    for ref, snapshot, _ in written:
+        gs = chess_engine.gamestate()
+        keys = [gs.zobristKey]
+        for moveID in snapshot["moves"]:
+            gs.makeMove(chess_engine.move.fromMoveID(moveID, gs.board))
+            keys.append(gs.zobristKey)
+        for ply, key in enumerate(keys):
+            expected.setdefault(key, {}).setdefault(ref, ply)
+
+    count = chess_archive.buildIndex(str(path), str(indexPath), runEntries=16)
+    assert count == sum(len(games) for games in expected.values())
+    with chess_archive.archiveindex(str(indexPath)) as index:
+        for key, games in expected.items():
+            assert dict(index.lookup(key)) == games
+        assert index.lookup(1) == []
+        start = index.lookup(chess_engine.gamestate().zobristKey)
+    assert sorted(ref for ref, _ in start) == sorted(ref for ref, _, _ in written)
+
+    with chess_archive.archivereader(str(path)) as reader:
+        stats = chess_archive.continuations(reader, start)
+    assert sum(entry[0] for entry in stats.values()) == len(written)
+
+
+def test_append_after_a_cut_short_block(tmp_path):
+    path = tmp_path / "games.arc"
+    written = writeGames(path, 8, blockGames=4)
+    size = os.path.getsize(path)
+    with open(path, "r+b") as f:
+        f.truncate(size - 5) # the second block loses its tail
+    with chess_archive.archivereader(str(path)) as reader:
+        assert len(list(reader)) == 4
+
+    gs = randomGame(random.Random(9), 10)
+    with chess_archive.archivewriter(str(path)) as writer:
+        ref = writer.addGamestate(gs, "1-0")
+    with chess_archive.archivereader(str(path)) as reader:
+        games = list(reader)
+        assert [game.snapshot() for game in games[:4]] == [snapshot for _, snapshot, _ in written[:4]]
+        assert len(games) == 5
+        assert reader.gameAt(ref).snapshot() == gs.snapshot()
+
+
+def test_corrupt_block_raises_value_error(tmp_path):
+    path = tmp_path / "games.arc"
+    writeGames(path, 4, blockGames=4)
+    with open(path, "r+b") as f:
+        f.seek(chess_archive.headerFormat.size + chess_archive.blockFormat.size + 2)
+        f.write(b"\xff\xff\xff\xff")
+    with chess_archive.archivereader(str(path)) as reader:
+        with pytest.raises(ValueError):
+            list(reader)
+
+
+def test_not_an_archive(tmp_path):
+    path = tmp_path / "games.txt"
+    path.write_text("[Event \"x\"]\n")
+    with pytest.raises(ValueError):
+        chess_archive.archivereader(str(path))
+    with pytest.raises(ValueError):
+        chess_archive.archivewriter(str(path))
@@ -0,0 +1,78 @@
+import chess_engine
+
+
+def legalMoves(gs):
+    return sorted(m.getChessNotation() for m in gs.getValidMoves())
+
+
+def test_fen_en_passant_without_pawn_is_dropped():
+    gs = chess_engine.gamestate.from_fen("4k3/8/8/8/5p2/8/8/4K3 b - e3 0 1")
+    assert gs.enPassant == ()
+    assert "f4e3" not in legalMoves(gs)
+    assert gs.to_fen() == "4k3/8/8/8/5p2/8/8/4K3 b - - 0 1"
+    assert gs.pieceLocations["wp"] == set()
+
+
+def test_fen_en_passant_for_wrong_side_is_dropped():
+    gs = chess_engine.gamestate.from_fen("4k3/8/8/8/4Pp2/8/3P4/4K3 w - e3 0 1")
+    assert gs.enPassant == ()
+    assert not any(m.isEnpassantMove for m in gs.getValidMoves())
+    assert "d2e3" not in legalMoves(gs)
+
+
+def test_fen_en_passant_with_blocked_start_square_is_dropped():
+    gs = chess_engine.gamestate.from_fen("4k3/8/8/8/4Pp2/8/4P3/4K3 b - e3 0 1")
+    assert gs.enPassant == ()
+
+
+def test_fen_en_passant_valid_square_is_kept():
+    gs = chess_engine.gamestate.from_fen("4k3/8/8/8/4Pp2/8/8/4K3 b - e3 0 1")
+    assert gs.enPassant == (5, 4)
+    capture = next(m for m in gs.getValidMoves() if m.isEnpassantMove)
+    assert capture.getChessNotation() == "f4e3"
+    gs.makeMove(capture)
+    assert gs.to_fen() == "4k3/8/8/8/8/4p3/8/4K3 w - - 0 2"
+    assert gs.pieceLocations["wp"] == set()
+    gs.undoMove()
+    assert gs.to_fen() == "4k3/8/8/8/4Pp2/8/8/4K3 b - e3 0 1"
+
+
+def test_bitboard_drops_the_same_en_passant_squares():
+    import chess_bitboard
+    gs = chess_bitboard.bitboardstate()
+    for fen, square in (("4k3/8/8/8/5p2/8/8/4K3 b - e3 0 1", -1), ("4k3/8/8/8/4Pp2/8/3P4/4K3 w - e3 0 1", -1),
+                        ("4k3/8/8/8/4Pp2/8/8/4K3 b - e3 0 1", 44)):
+        gs.setBoard(*chess_engine.parseFen(fen))
+        assert gs.enPassant == square
+
+
+def findMove(gs, notation):
+    return next(m for m in gs.getValidMoves() if m.getChessNotation() == notation)
+
+
+def test_see_values():
+    for fen, notation, value in (
+            ("4k3/8/8/4p3/8/8/8/4R1K1 w - - 0 1", "e1e5", 100), # undefended pawn
+            ("4k3/8/3p4/4n3/3P4/8/8/4K3 w - - 0 1", "d4e5", 220), # pawn takes a knight, pawn retakes
+            ("4k3/8/3p4/4p3/8/8/8/4R1K1 w - - 0 1", "e1e5", -400), # rook takes a pawn, pawn retakes
+            ("4r1k1/8/8/4p3/8/8/4R3/4R1K1 w - - 0 1", "e2e5", 100), # x-ray rook behind the first one
+            ("4r1k1/4r3/8/4p3/8/8/4R3/4R1K1 w - - 0 1", "e2e5", -400), # black has the last rook
+            ("4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1", "e5d6", 100), # en passant
+            ("1n2k3/P7/8/8/8/8/8/4K3 w - - 0 1", "a7b8q", 1120), # promotion capture
+            ("4k3/8/8/8/8/4n3/3p4/4K3 w - - 0 1", "e1d2", 100)): # king takes, nothing can retake it legally
+        gs = chess_engine.gamestate.from_fen(fen)
+        m = findMove(gs, notation)
+        assert gs.see(m) == value, (fen, notation)
+        assert gs.to_fen() == fen
+
+
+def test_see_ge_agrees_with_see():
+    for fen, notation in (("4k3/8/3p4/4n3/3P4/8/8/4K3 w - - 0 1", "d4e5"), ("4k3/8/3p4/4p3/8/8/8/4R1K1 w - - 0 1", "e1e5"),
+                          ("4r1k1/8/8/4p3/8/8/4R3/4R1K1 w - - 0 1", "e2e5"), ("4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1", "e5d6")):
+        gs = chess_engine.gamestate.from_fen(fen)
+        m = findMove(gs, notation)
+        value = gs.see(m)
+        for threshold in (-1000, -400, -1, 0, 1, 100, 220, 1000):
+            assert gs.see_ge(m, threshold) == (value >= threshold), (fen, notation, threshold)
+    gs = chess_engine.gamestate()
+    assert gs.see_ge(findMove(gs, "g1f3"), 0)
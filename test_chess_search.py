@@ -0,0 +1,27 @@
+import chess_engine
+import chess_search
+
+
+def test_empty_root_moves_returns_no_move():
+    gs = chess_engine.gamestate()
+    fen = gs.to_fen()
+    result = chess_search.searcher().search(gs, maxDepth=3, rootMoves=[])
+    assert result.bestMove is None
+    assert result.pv == []
+    assert result.depth == 0
+    assert gs.to_fen() == fen
+
+
+def test_root_moves_restrict_the_search():
+    gs = chess_engine.gamestate()
+    allowed = [m for m in gs.getValidMoves() if m.getChessNotation() in ("a2a3", "h2h3")]
+    result = chess_search.searcher().search(gs, maxDepth=2, rootMoves=allowed)
+    assert result.bestMove in allowed
+    assert result.depth == 2
+
+
+def test_finds_mate_in_one():
+    gs = chess_engine.gamestate.from_fen("6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1")
+    result = chess_search.searcher().search(gs, maxDepth=3)
+    assert result.bestMove.getChessNotation() == "a1a8"
+    assert result.score > chess_search.MATE_BOUND